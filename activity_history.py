@@ -0,0 +1,239 @@
+"""
+Bulk download of the authorized athletes' own activity history and activity streams.
+
+The history from /athlete/activities is split into windows of HISTORY_WINDOW, from the
+athlete's account creation until now, and the windows are fetched concurrently, each
+paging on its own. The oldest window is open-ended, since activities imported from other
+platforms can start before the account was created. A window is recorded in the progress
+file once all its pages are stored, so a run cut short by the rate limit or a crash
+resumes with the windows still missing. The newest window is still filling up and is
+fetched again on every run.
+
+Streams are then fetched for every stored activity that is not in the athlete's
+StreamStore yet, newest first, and appended in batches.
+
+Run for every athlete in the token store:
+    python activity_history.py
+    python activity_history.py --max-streams 500
+"""
+import argparse
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+import requests
+from dotenv import load_dotenv
+from activity_store import read_athlete_activities, upsert_athlete_activities
+from atomic_files import read_json, update_json
+from fetch_engine import MAX_WORKERS, MIN_REQUEST_INTERVAL, RequestThrottle
+from instrumentation import run_in_context
+from stream_store import STREAM_KEYS, StreamStore
+from strava_api import (RateLimitExhausted, rate_budget, request_activity_streams, request_athlete,
+                        request_athlete_activities)
+from token_store import get_access_token, load_tokens
+
+HISTORY_PROGRESS_FILE = 'data/history_progress.json'
+HISTORY_WINDOW = timedelta(days=90)
+HISTORY_PAGE_SIZE = 200
+STREAM_BATCH_SIZE = 50  # activities appended to the stream store at once
+
+logger = logging.getLogger('activity_history')
+
+@dataclass
+class HistorySyncResult:
+    activities: int = 0
+    windows_fetched: int = 0
+    windows_left: int = 0
+    deferred: bool = False
+
+def load_history_progress(athlete_id) -> List[int]:
+    """Start times (epoch seconds) of the history windows already stored for an athlete."""
+    return read_json(HISTORY_PROGRESS_FILE, {}).get(str(athlete_id), [])
+
+def _mark_window_done(athlete_id, window_start: int):
+    def merge(progress):
+        done = set(progress.get(str(athlete_id), []))
+        done.add(window_start)
+        progress[str(athlete_id)] = sorted(done)
+        return progress
+    update_json(HISTORY_PROGRESS_FILE, merge, {})
+
+def plan_windows(created_at: datetime, now: datetime, done: List[int]) -> List[Tuple[int, int]]:
+    """
+    (after, before) epoch seconds of the windows still to fetch, newest first.
+
+    The oldest window starts at the epoch rather than at created_at, so that activities
+    uploaded or imported with earlier start dates are fetched too.
+    """
+    window = int(HISTORY_WINDOW.total_seconds())
+    origin, end = int(created_at.timestamp()), int(now.timestamp())
+    starts = [0] + list(range(origin + window, end, window))
+    done = set(done)
+    windows = [(start, max(start, origin) + window) for start in starts if start not in done]
+    return windows[::-1]
+
+def fetch_window(access_token: str, after: int, before: int, throttle: RequestThrottle,
+                 abort: threading.Event) -> Optional[List[Dict[str, Any]]]:
+    """All activities started inside one window, or None if the run was aborted before it completed."""
+    activities = []
+    page = 1
+    while not abort.is_set():
+        throttle.wait()
+        # after and before are both exclusive; widen by a second so boundary activities land in a window
+        batch = request_athlete_activities(access_token, after=max(after - 1, 0), before=before, page=page,
+                                           per_page=HISTORY_PAGE_SIZE)
+        activities.extend(batch)
+        if len(batch) < HISTORY_PAGE_SIZE:
+            return activities
+        page += 1
+    return None
+
+def _fetch_window_in_background(*args) -> Optional[List[Dict[str, Any]]]:
+    with rate_budget.background():
+        return fetch_window(*args)
+
+def sync_history(access_token: str, athlete_id, created_at: datetime, now: Optional[datetime] = None,
+                 max_workers: int = MAX_WORKERS, min_request_interval: float = MIN_REQUEST_INTERVAL) -> HistorySyncResult:
+    """
+    Download the windows of an athlete's history not stored yet.
+
+    Windows are fetched in parallel on a bounded thread pool and stored from the calling
+    thread as each completes. Once the rate budget cannot recover, the remaining windows
+    are left for the next run.
+
+    Args:
+        access_token (str): the athlete's access token, with activity:read_all scope
+        athlete_id: owner of the token
+        created_at (datetime): creation time of the athlete's account, where the windows after the oldest start
+        now (Optional[datetime]): end of the history, defaults to the current time
+        max_workers (int): number of windows fetched at the same time
+        min_request_interval (float): seconds between two request starts across all workers
+    """
+    now = now or datetime.now(timezone.utc)
+    windows = plan_windows(created_at, now, load_history_progress(athlete_id))
+    result = HistorySyncResult()
+    throttle = RequestThrottle(min_request_interval)
+    abort = threading.Event()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        fetch_window_task = run_in_context(_fetch_window_in_background)
+        futures = {executor.submit(fetch_window_task, access_token, after, before, throttle, abort): (after, before)
+                   for after, before in windows}
+        for future in as_completed(futures):
+            after, before = futures[future]
+            try:
+                activities = future.result()
+            except RateLimitExhausted:
+                abort.set()
+                activities = None
+            except requests.RequestException as e:
+                logger.warning("Failed to fetch history window starting %s: %s",
+                               datetime.fromtimestamp(after, timezone.utc).date(), e)
+                activities = None
+            if activities is None:
+                result.windows_left += 1
+                continue
+            result.activities += upsert_athlete_activities(activities)
+            result.windows_fetched += 1
+            if before <= now.timestamp():
+                _mark_window_done(athlete_id, after)
+    result.deferred = abort.is_set()
+    return result
+
+def _fetch_streams(access_token: str, activity_id: int, throttle: RequestThrottle,
+                   abort: threading.Event) -> Optional[Dict[str, List]]:
+    if abort.is_set():
+        return None
+    throttle.wait()
+    with rate_budget.background():
+        try:
+            return request_activity_streams(access_token, activity_id, STREAM_KEYS)
+        except requests.HTTPError as e:
+            if e.response.status_code == 404:
+                return {}  # manual activity: stored empty so it is not asked for again
+            raise
+
+def sync_streams(access_token: str, athlete_id, max_activities: Optional[int] = None, max_workers: int = MAX_WORKERS,
+                 min_request_interval: float = MIN_REQUEST_INTERVAL) -> int:
+    """
+    Download the streams of stored activities missing from the athlete's StreamStore, newest first.
+
+    Each activity costs one request, so a long history takes several rate-limit windows;
+    whatever was fetched before the budget ran out is kept and the rest follows next run.
+
+    Args:
+        access_token (str): the athlete's access token
+        athlete_id: owner of the activities
+        max_activities (Optional[int]): stop after this many activities
+        max_workers (int): number of activities fetched at the same time
+        min_request_interval (float): seconds between two request starts across all workers
+
+    Returns:
+        int: number of activities whose streams were stored
+    """
+    store = StreamStore(athlete_id)
+    have_streams = set(store.activity_ids().tolist())
+    stored_ids = read_athlete_activities(athlete_id, columns=['id'])['id'].tolist()
+    missing = [activity_id for activity_id in reversed(stored_ids) if activity_id not in have_streams][:max_activities]
+    throttle = RequestThrottle(min_request_interval)
+    abort = threading.Event()
+    added = 0
+    batch = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        fetch_streams_task = run_in_context(_fetch_streams)
+        futures = {executor.submit(fetch_streams_task, access_token, activity_id, throttle, abort): activity_id
+                   for activity_id in missing}
+        for future in as_completed(futures):
+            try:
+                streams = future.result()
+            except RateLimitExhausted:
+                abort.set()
+                streams = None
+            except requests.RequestException as e:
+                logger.warning("Failed to fetch streams of activity %s: %s", futures[future], e)
+                streams = None
+            if streams is not None:
+                batch[futures[future]] = streams
+            if len(batch) >= STREAM_BATCH_SIZE:
+                added += store.append(batch)
+                batch = {}
+    added += store.append(batch) if batch else 0
+    return added
+
+def sync_athlete(access_token: str, athlete_id, streams: bool = True, max_streams: Optional[int] = None) -> Dict[str, Any]:
+    """Bring one athlete's history, then their streams, up to date; returns counts for logging."""
+    profile = request_athlete(access_token)
+    created_at = datetime.fromisoformat(profile['created_at'].replace('Z', '+00:00'))
+    history = sync_history(access_token, athlete_id, created_at)
+    summary = {'activities': history.activities, 'windows_fetched': history.windows_fetched,
+               'windows_left': history.windows_left, 'streams': 0}
+    if streams and not history.deferred:
+        summary['streams'] = sync_streams(access_token, athlete_id, max_streams)
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--no-streams', action='store_true', help='only download activity summaries')
+    parser.add_argument('--max-streams', type=int, default=None, help='activities whose streams are fetched per athlete')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    load_dotenv()
+    client_id = os.getenv('STRAVA_CLIENT_ID')
+    client_secret = os.getenv('STRAVA_CLIENT_SECRET')
+    for athlete_id in load_tokens():
+        started = time.monotonic()
+        try:
+            access_token = get_access_token(athlete_id, client_id, client_secret)
+            summary = sync_athlete(access_token, athlete_id, streams=not args.no_streams, max_streams=args.max_streams)
+        except requests.RequestException as e:
+            logger.warning("Skipping athlete %s: %s", athlete_id, e)
+            continue
+        logger.info("Athlete %s: %d activities in %d windows (%d left), streams of %d activities, in %.1fs",
+                    athlete_id, summary['activities'], summary['windows_fetched'], summary['windows_left'],
+                    summary['streams'], time.monotonic() - started)
+
+if __name__ == '__main__':
+    main()
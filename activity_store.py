@@ -0,0 +1,456 @@
+import os
+import sqlite3
+from contextlib import closing
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Optional, Union
+import pandas as pd
+from instrumentation import traced
+
+DB_PATH = 'data/activities.db'
+LEGACY_CSV_PATH = 'data/all_club_activities.csv'
+
+# Column name -> SQLite type, in the order of the legacy CSV register
+REGISTER_COLUMNS = {
+    'resource_state': 'INTEGER',
+    'athlete': 'TEXT',
+    'name': 'TEXT',
+    'distance': 'REAL',
+    'moving_time': 'REAL',
+    'elapsed_time': 'INTEGER',
+    'total_elevation_gain': 'REAL',
+    'type': 'TEXT',
+    'sport_type': 'TEXT',
+    'workout_type': 'REAL',
+    'club_id': 'INTEGER',
+    'upload_date': 'TEXT',
+    'club_name': 'TEXT',
+    'avg_speed': 'REAL',
+    'firstname': 'TEXT',
+    'lastname': 'TEXT',
+}
+# In-memory dtypes of register columns read back from the store. Repeated labels are
+# dictionary-encoded, free text is a string column and measures are 32-bit; nullable
+# integers use pandas' masked types. The store keeps full precision for fingerprinting.
+REGISTER_DTYPES = {
+    'resource_state': 'Int8',
+    'athlete': 'string',
+    'name': 'string',
+    'distance': 'float32',
+    'moving_time': 'float32',
+    'elapsed_time': 'Int32',
+    'total_elevation_gain': 'float32',
+    'type': 'category',
+    'sport_type': 'category',
+    'workout_type': 'Int8',
+    'club_id': 'int64',
+    'club_name': 'category',
+    'avg_speed': 'float32',
+    'firstname': 'category',
+    'lastname': 'category',
+}
+# Fields that identify an activity; hashed together into its fingerprint
+FINGERPRINT_FIELDS = ['club_id', 'firstname', 'lastname', 'name', 'sport_type', 'distance', 'moving_time',
+                      'elapsed_time', 'total_elevation_gain']
+# Dedup index maintained next to the register columns
+INDEX_COLUMNS = {
+    'fingerprint': 'INTEGER',
+    'first_seen': 'TEXT',
+    'last_seen': 'TEXT',
+}
+# Daily rollup cube maintained incrementally from newly appended activities
+ROLLUP_KEY = ['club_id', 'sport_type', 'firstname', 'lastname', 'day']
+ROLLUP_MEASURES = {
+    # measure -> (source column, pandas aggregation, SQL merge with the stored value)
+    'activity_count': ('fingerprint', 'size', 'sum'),
+    'distance_sum': ('distance', 'sum', 'sum'),
+    'distance_max': ('distance', 'max', 'max'),
+    'moving_time_sum': ('moving_time', 'sum', 'sum'),
+    'moving_time_max': ('moving_time', 'max', 'max'),
+    'elevation_sum': ('total_elevation_gain', 'sum', 'sum'),
+    'elevation_max': ('total_elevation_gain', 'max', 'max'),
+    'speed_sum': ('avg_speed', 'sum', 'sum'),
+    'speed_count': ('avg_speed', 'count', 'sum'),
+    'speed_max': ('avg_speed', 'max', 'max'),
+}
+# In-memory dtypes of the rollup cube. Its label columns are the keys every query and
+# leaderboard groups on, and grouping is faster on plain strings than on categoricals
+# with thousands of athletes, so only club_name is dictionary-encoded; the sums and
+# maxima are shown as they are in the leaderboards and stay float64
+ROLLUP_DTYPES = {
+    'club_id': 'int64',
+    'club_name': 'category',
+    **{name: 'int32' for name in ROLLUP_MEASURES if name.endswith('count')},
+}
+# Own activities of authorized athletes from /athlete/activities, in Strava's units (metres, seconds, m/s)
+ATHLETE_ACTIVITY_COLUMNS = {
+    'id': 'INTEGER PRIMARY KEY',
+    'athlete_id': 'INTEGER',
+    'name': 'TEXT',
+    'sport_type': 'TEXT',
+    'start_date': 'TEXT',
+    'start_date_local': 'TEXT',
+    'distance': 'REAL',
+    'moving_time': 'INTEGER',
+    'elapsed_time': 'INTEGER',
+    'total_elevation_gain': 'REAL',
+    'average_speed': 'REAL',
+    'max_speed': 'REAL',
+    'average_heartrate': 'REAL',
+    'max_heartrate': 'REAL',
+    'average_watts': 'REAL',
+    'weighted_average_watts': 'REAL',
+    'kilojoules': 'REAL',
+    'suffer_score': 'REAL',
+    'has_heartrate': 'INTEGER',
+    'device_watts': 'INTEGER',
+    'trainer': 'INTEGER',
+    'commute': 'INTEGER',
+}
+SCHEMA_VERSION = 5
+
+def connect(db_path: str = DB_PATH) -> sqlite3.Connection:
+    """
+    Open the activity store, creating or upgrading the schema and migrating the legacy CSV register on first use.
+    """
+    is_new = not os.path.exists(db_path)
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.execute('PRAGMA journal_mode=WAL')
+    if is_new:
+        _create_schema(conn)
+        if os.path.exists(LEGACY_CSV_PATH):
+            migrate_csv(LEGACY_CSV_PATH, conn)
+    else:
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        if version < SCHEMA_VERSION:
+            _upgrade_schema(conn, version)
+    return conn
+
+def _create_schema(conn: sqlite3.Connection):
+    columns = ', '.join(f'{name} {sql_type}' for name, sql_type in {**REGISTER_COLUMNS, **INDEX_COLUMNS}.items())
+    with conn:
+        conn.execute(f'CREATE TABLE IF NOT EXISTS activities ({columns})')
+        _create_indexes(conn)
+        _create_meta(conn)
+        _create_rollup(conn)
+        _create_athlete_activities(conn)
+        conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+
+def _create_indexes(conn: sqlite3.Connection):
+    conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_activities_fingerprint ON activities (fingerprint)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_activities_club_date ON activities (club_id, upload_date)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_activities_club_name ON activities (club_name)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_activities_upload_date ON activities (upload_date)')
+
+def _create_meta(conn: sqlite3.Connection):
+    conn.execute('CREATE TABLE IF NOT EXISTS store_meta (key TEXT PRIMARY KEY, value INTEGER)')
+    conn.execute("INSERT OR IGNORE INTO store_meta (key, value) VALUES ('data_version', 0)")
+
+def _create_rollup(conn: sqlite3.Connection):
+    measures = ', '.join(f'{name} {"INTEGER" if name.endswith("count") else "REAL"}' for name in ROLLUP_MEASURES)
+    conn.execute(f'CREATE TABLE IF NOT EXISTS activity_rollup (club_id INTEGER, sport_type TEXT, firstname TEXT, '
+                 f'lastname TEXT, day TEXT, club_name TEXT, {measures}, PRIMARY KEY ({", ".join(ROLLUP_KEY)}))')
+
+def _create_athlete_activities(conn: sqlite3.Connection):
+    columns = ', '.join(f'{name} {sql_type}' for name, sql_type in ATHLETE_ACTIVITY_COLUMNS.items())
+    conn.execute(f'CREATE TABLE IF NOT EXISTS athlete_activities ({columns})')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_athlete_activities_start ON athlete_activities (athlete_id, start_date_local)')
+
+def _upgrade_schema(conn: sqlite3.Connection, version: int):
+    """
+    Bring an older store up to SCHEMA_VERSION.
+
+    Version 1 was deduplicated on (club_id, name, moving_time) and gains the fingerprint
+    index; version 2 gains the store_meta table holding the data version; version 3
+    gains the daily rollup cube, built once from the stored activities; version 4 gains
+    the table of the athletes' own activities.
+    """
+    with conn:
+        if version < 2:
+            for name, sql_type in INDEX_COLUMNS.items():
+                conn.execute(f'ALTER TABLE activities ADD COLUMN {name} {sql_type}')
+            existing_df = pd.read_sql_query(f'SELECT rowid, {", ".join(FINGERPRINT_FIELDS)} FROM activities', conn)
+            fingerprints = activity_fingerprints(existing_df)
+            conn.executemany('UPDATE activities SET fingerprint = ?, first_seen = upload_date, last_seen = upload_date WHERE rowid = ?',
+                             zip(fingerprints.tolist(), existing_df['rowid'].tolist()))
+            conn.execute('DROP INDEX IF EXISTS idx_activities_dedup')
+            _create_indexes(conn)
+        if version < 3:
+            _create_meta(conn)
+        if version < 4:
+            _create_rollup(conn)
+            stored_df = pd.read_sql_query(
+                f'SELECT fingerprint, club_name, upload_date, {", ".join(c for c in ROLLUP_KEY if c != "day")}, '
+                f'distance, moving_time, total_elevation_gain, avg_speed FROM activities', conn)
+            _update_rollup(stored_df, conn)
+        if version < 5:
+            _create_athlete_activities(conn)
+        conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+
+def activity_fingerprints(df: pd.DataFrame) -> pd.Series:
+    """
+    Stable 64-bit fingerprint of each activity, computed in one vectorized pass over FINGERPRINT_FIELDS.
+
+    Numbers are normalised to float so that a value read back from the store hashes
+    the same as the freshly processed one.
+    """
+    key_df = df.reindex(columns=FINGERPRINT_FIELDS)
+    numeric = ['club_id', 'distance', 'moving_time', 'elapsed_time', 'total_elevation_gain']
+    key_df[numeric] = key_df[numeric].apply(pd.to_numeric, errors='coerce').astype('float64')
+    text = [c for c in FINGERPRINT_FIELDS if c not in numeric]
+    key_df[text] = key_df[text].astype(object).where(key_df[text].notna(), '').astype(str)
+    hashes = pd.util.hash_pandas_object(key_df, index=False)
+    # SQLite integers are signed 64-bit
+    return pd.Series(hashes.to_numpy().view('int64'), index=df.index, name='fingerprint')
+
+def with_dtypes(df: pd.DataFrame, dtypes: Dict[str, str]) -> pd.DataFrame:
+    """Cast the columns of df that appear in dtypes (REGISTER_DTYPES or ROLLUP_DTYPES); other columns are kept as they are."""
+    return df.astype({column: dtype for column, dtype in dtypes.items() if column in df.columns})
+
+def migrate_csv(csv_path: str, conn: sqlite3.Connection) -> int:
+    """One-time import of the legacy CSV register. Returns the number of rows imported."""
+    legacy_df = pd.read_csv(csv_path, parse_dates=['upload_date'])
+    # Oldest first so first_seen reflects the earliest fetch of each activity
+    legacy_df = legacy_df.sort_values('upload_date', kind='stable')
+    return upsert_activities(legacy_df, conn)
+
+def _to_records(df: pd.DataFrame) -> List[tuple]:
+    df = df.reindex(columns=list(REGISTER_COLUMNS) + list(INDEX_COLUMNS))
+    df['upload_date'] = pd.to_datetime(df['upload_date']).dt.strftime('%Y-%m-%d %H:%M:%S.%f')
+    df['first_seen'] = df['upload_date']
+    df['last_seen'] = df['upload_date']
+    df['athlete'] = df['athlete'].map(lambda x: str(x) if isinstance(x, dict) else x)
+    df = df.astype(object).where(df.notna(), None)
+    return list(df.itertuples(index=False, name=None))
+
+def find_known_fingerprints(fingerprints: List[int], conn: sqlite3.Connection) -> set:
+    """Return the subset of fingerprints already in the store; each lookup is one probe of the unique index."""
+    known = set()
+    for i in range(0, len(fingerprints), 500):
+        chunk = fingerprints[i:i + 500]
+        rows = conn.execute(f'SELECT fingerprint FROM activities WHERE fingerprint IN ({", ".join("?" * len(chunk))})', chunk)
+        known.update(row[0] for row in rows)
+    return known
+
+@traced('store')
+def upsert_activities(df: pd.DataFrame, conn: Optional[sqlite3.Connection] = None) -> int:
+    """
+    Append activities not seen before and refresh last_seen on the ones already stored.
+
+    Existing rows keep their upload_date and first_seen, so history is never rewritten or re-sorted.
+    The rollup cube is updated from the appended activities only, in the same transaction.
+
+    Args:
+        df (pd.DataFrame): activities shaped like the output of process_activities
+        conn (Optional[sqlite3.Connection]): open store connection, a new one is opened if omitted
+
+    Returns:
+        int: number of new activities appended
+    """
+    if df.empty:
+        return 0
+    if conn is None:
+        with closing(connect()) as own_conn:
+            return upsert_activities(df, own_conn)
+    df = df.assign(fingerprint=activity_fingerprints(df))
+    # Within one batch the latest occurrence wins, as with the register's old keep='last'
+    df = df.drop_duplicates(subset='fingerprint', keep='last')
+    columns = list(REGISTER_COLUMNS) + list(INDEX_COLUMNS)
+    sql = (f'INSERT INTO activities ({", ".join(columns)}) VALUES ({", ".join("?" * len(columns))}) '
+           f'ON CONFLICT (fingerprint) DO UPDATE SET last_seen = MAX(last_seen, excluded.last_seen)')
+    with conn:
+        # Take the write lock before looking up known rows, so two writers can never both count an activity as new
+        conn.execute('BEGIN IMMEDIATE')
+        known = find_known_fingerprints(df['fingerprint'].tolist(), conn)
+        conn.executemany(sql, _to_records(df))
+        _update_rollup(df[~df['fingerprint'].isin(known)], conn)
+        conn.execute("UPDATE store_meta SET value = value + 1 WHERE key = 'data_version'")
+    return len(df) - len(known)
+
+def rollup_activities(df: pd.DataFrame) -> pd.DataFrame:
+    """Aggregate activities into rollup rows, one per (club, sport type, athlete, upload day)."""
+    df = df.assign(day=pd.to_datetime(df['upload_date']).dt.strftime('%Y-%m-%d'))
+    # Missing names must not drop activities from the cube; '' is not among the labels of a categorical column
+    df[['firstname', 'lastname', 'sport_type']] = df[['firstname', 'lastname', 'sport_type']].astype(object).fillna('')
+    aggregations = {name: (source, how) for name, (source, how, _) in ROLLUP_MEASURES.items()}
+    aggregations['club_name'] = ('club_name', 'last')
+    return df.groupby(ROLLUP_KEY, sort=False, observed=True).agg(**aggregations).reset_index()
+
+def _update_rollup(new_df: pd.DataFrame, conn: sqlite3.Connection):
+    if new_df.empty:
+        return
+    rollup_df = rollup_activities(new_df)
+    columns = ROLLUP_KEY + ['club_name'] + list(ROLLUP_MEASURES)
+    merges = ['club_name = excluded.club_name']
+    for name, (_, _, merge) in ROLLUP_MEASURES.items():
+        if merge == 'sum':
+            merges.append(f'{name} = {name} + excluded.{name}')
+        else:
+            # SQLite's scalar MAX() returns NULL as soon as one argument is NULL
+            merges.append(f'{name} = MAX(COALESCE({name}, excluded.{name}), COALESCE(excluded.{name}, {name}))')
+    sql = (f'INSERT INTO activity_rollup ({", ".join(columns)}) VALUES ({", ".join("?" * len(columns))}) '
+           f'ON CONFLICT ({", ".join(ROLLUP_KEY)}) DO UPDATE SET {", ".join(merges)}')
+    rollup_df = rollup_df[columns].astype(object).where(rollup_df[columns].notna(), None)
+    conn.executemany(sql, rollup_df.itertuples(index=False, name=None))
+
+@traced('store')
+def read_rollup(columns: Optional[List[str]] = None, club_id: Optional[int] = None, club_name: Optional[str] = None,
+                start: Optional[date] = None, end: Optional[date] = None) -> pd.DataFrame:
+    """
+    Read the rollup cube, or the requested columns of one club's or day range's rows, with day parsed to a
+    datetime and the other columns in ROLLUP_DTYPES.
+
+    Args:
+        columns (Optional[List[str]]): columns to return, all if omitted
+        club_id (Optional[int]): only rows of this club
+        club_name (Optional[str]): only rows of this club
+        start (Optional[date]): earliest day, inclusive
+        end (Optional[date]): latest day, inclusive
+    """
+    rollup_columns = ROLLUP_KEY + ['club_name'] + list(ROLLUP_MEASURES)
+    columns = columns or rollup_columns
+    unknown = set(columns) - set(rollup_columns)
+    if unknown:
+        raise ValueError(f"Unknown rollup columns: {sorted(unknown)}")
+    clauses, params = [], []
+    if club_id is not None:
+        clauses.append('club_id = ?')
+        params.append(int(club_id))
+    if club_name is not None:
+        clauses.append('club_name = ?')
+        params.append(club_name)
+    if start is not None:
+        clauses.append('day >= ?')
+        params.append(start.isoformat())
+    if end is not None:
+        clauses.append('day <= ?')
+        params.append(end.isoformat())
+    where = f' WHERE {" AND ".join(clauses)}' if clauses else ''
+    with closing(connect()) as conn:
+        df = pd.read_sql_query(f'SELECT {", ".join(columns)} FROM activity_rollup{where}', conn, params=params)
+    if 'day' in df.columns:
+        df['day'] = pd.to_datetime(df['day'])
+    return with_dtypes(df, ROLLUP_DTYPES)
+
+def club_ids() -> List[int]:
+    """Ids of the clubs with activities in the register."""
+    with closing(connect()) as conn:
+        return [row[0] for row in conn.execute('SELECT DISTINCT club_id FROM activities')]
+
+def data_version() -> int:
+    """Counter bumped by every write to the store; cached views of the register are keyed on it."""
+    with closing(connect()) as conn:
+        return conn.execute("SELECT value FROM store_meta WHERE key = 'data_version'").fetchone()[0]
+
+@traced('store')
+def read_activities(columns: Optional[List[str]] = None, club_id: Optional[int] = None, club_name: Optional[str] = None,
+                    start: Optional[Union[date, datetime]] = None, end: Optional[Union[date, datetime]] = None,
+                    sport_types: Optional[List[str]] = None) -> pd.DataFrame:
+    """
+    Read activities from the store, newest upload first.
+
+    Only the requested columns are read and every filter is evaluated by SQLite on its indexes.
+
+    Args:
+        columns (Optional[List[str]]): columns to return, all register columns if omitted; the
+            fingerprint, first_seen and last_seen index columns may also be requested
+        club_id (Optional[int]): only activities of this club
+        club_name (Optional[str]): only activities of this club
+        start (Optional[Union[date, datetime]]): earliest upload_date, inclusive
+        end (Optional[Union[date, datetime]]): latest upload_date, inclusive (a date includes the whole day)
+        sport_types (Optional[List[str]]): only these sport types
+
+    Returns:
+        pd.DataFrame: matching activities in REGISTER_DTYPES, with upload_date parsed when selected
+    """
+    columns = columns or list(REGISTER_COLUMNS)
+    unknown = set(columns) - set(REGISTER_COLUMNS) - set(INDEX_COLUMNS)
+    if unknown:
+        raise ValueError(f"Unknown register columns: {sorted(unknown)}")
+    clauses, params = [], []
+    if club_id is not None:
+        clauses.append('club_id = ?')
+        params.append(int(club_id))
+    if club_name is not None:
+        clauses.append('club_name = ?')
+        params.append(club_name)
+    if start is not None:
+        clauses.append('upload_date >= ?')
+        params.append(start.isoformat(sep=' ') if isinstance(start, datetime) else start.isoformat())
+    if end is not None:
+        clauses.append('upload_date <= ?')
+        params.append(end.isoformat(sep=' ') if isinstance(end, datetime) else f'{end.isoformat()} 23:59:59.999999')
+    if sport_types is not None:
+        clauses.append(f'sport_type IN ({", ".join("?" * len(sport_types))})')
+        params.extend(sport_types)
+    where = f' WHERE {" AND ".join(clauses)}' if clauses else ''
+    sql = f'SELECT {", ".join(columns)} FROM activities{where} ORDER BY upload_date DESC, rowid DESC'
+    with closing(connect()) as conn:
+        df = pd.read_sql_query(sql, conn, params=params)
+    if 'upload_date' in df.columns:
+        df['upload_date'] = pd.to_datetime(df['upload_date'])
+    return with_dtypes(df, REGISTER_DTYPES)
+
+@traced('store')
+def upsert_athlete_activities(activities: List[Dict[str, Any]], conn: Optional[sqlite3.Connection] = None) -> int:
+    """
+    Store summaries from /athlete/activities, replacing earlier copies of the same activity id.
+
+    Returns:
+        int: number of activities written
+    """
+    if not activities:
+        return 0
+    if conn is None:
+        with closing(connect()) as own_conn:
+            return upsert_athlete_activities(activities, own_conn)
+    columns = list(ATHLETE_ACTIVITY_COLUMNS)
+    records = [tuple(activity['athlete']['id'] if column == 'athlete_id' else activity.get(column) for column in columns)
+               for activity in activities]
+    with conn:
+        conn.executemany(f'INSERT OR REPLACE INTO athlete_activities ({", ".join(columns)}) '
+                         f'VALUES ({", ".join("?" * len(columns))})', records)
+    return len(records)
+
+@traced('store')
+def read_athlete_activities(athlete_id: int, columns: Optional[List[str]] = None, start: Optional[date] = None,
+                            end: Optional[date] = None) -> pd.DataFrame:
+    """
+    Read an athlete's own activities, oldest first, with start_date_local parsed when selected.
+
+    Args:
+        athlete_id (int): owner of the activities
+        columns (Optional[List[str]]): columns to return, all of ATHLETE_ACTIVITY_COLUMNS if omitted
+        start (Optional[date]): earliest local start day, inclusive
+        end (Optional[date]): latest local start day, inclusive
+    """
+    columns = columns or list(ATHLETE_ACTIVITY_COLUMNS)
+    unknown = set(columns) - set(ATHLETE_ACTIVITY_COLUMNS)
+    if unknown:
+        raise ValueError(f"Unknown athlete activity columns: {sorted(unknown)}")
+    clauses, params = ['athlete_id = ?'], [int(athlete_id)]
+    if start is not None:
+        clauses.append('start_date_local >= ?')
+        params.append(start.isoformat())
+    if end is not None:
+        clauses.append('start_date_local < ?')
+        params.append((end + timedelta(days=1)).isoformat())
+    sql = f'SELECT {", ".join(columns)} FROM athlete_activities WHERE {" AND ".join(clauses)} ORDER BY start_date_local, id'
+    with closing(connect()) as conn:
+        df = pd.read_sql_query(sql, conn, params=params)
+    if 'start_date_local' in df.columns:
+        # Strava marks local times with a Z although they carry no zone
+        df['start_date_local'] = pd.to_datetime(df['start_date_local'].str.rstrip('Z'))
+    return df
+
+def count_athlete_activities(athlete_id: int, end: Optional[date] = None) -> int:
+    """Number of an athlete's own activities, up to and including the local day end when given."""
+    sql, params = 'SELECT COUNT(*) FROM athlete_activities WHERE athlete_id = ?', [int(athlete_id)]
+    if end is not None:
+        sql += ' AND start_date_local < ?'
+        params.append((end + timedelta(days=1)).isoformat())
+    with closing(connect()) as conn:
+        return conn.execute(sql, params).fetchone()[0]
+
+def count_activities() -> int:
+    with closing(connect()) as conn:
+        return conn.execute('SELECT COUNT(*) FROM activities').fetchone()[0]
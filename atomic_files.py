@@ -0,0 +1,102 @@
+"""
+Crash- and concurrency-safe updates of the small JSON state files under data/.
+
+Every write goes to a temporary file in the same directory and is renamed over the
+target, so readers see either the old or the new content and never a partial file.
+Read-modify-write updates hold an exclusive lock on a sidecar .lock file, which
+serializes them across threads, Streamlit sessions and processes (dashboard and
+ingestion worker).
+"""
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Optional
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+LOCK_POLL_INTERVAL = 0.05  # seconds between two lock attempts on Windows
+
+_thread_locks = {}
+_thread_locks_guard = threading.Lock()
+
+def _thread_lock(path: str) -> threading.Lock:
+    with _thread_locks_guard:
+        return _thread_locks.setdefault(os.path.abspath(path), threading.Lock())
+
+@contextmanager
+def file_lock(path: str):
+    """Hold an exclusive lock for path, shared by every thread and process using the same path."""
+    with _thread_lock(path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(f'{path}.lock', 'a+b') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            else:
+                while True:
+                    try:
+                        lock_file.seek(0)
+                        msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+                        break
+                    except OSError:
+                        time.sleep(LOCK_POLL_INTERVAL)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+                else:
+                    lock_file.seek(0)
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+def atomic_write(path: str, data: bytes, mode: Optional[int] = None):
+    """Replace path with data in one rename; mode sets the file permissions (e.g. 0o600)."""
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=f'.{os.path.basename(path)}.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        if mode is not None:
+            os.chmod(temp_path, mode)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def read_json(path: str, default: Any = None) -> Any:
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return default
+
+def write_json(path: str, data: Any):
+    atomic_write(path, json.dumps(data).encode('utf-8'))
+
+def update_json(path: str, update: Callable[[Any], Any], default: Any = None) -> Any:
+    """
+    Apply update to the current content of a JSON file and write the result atomically, under the file's lock.
+
+    Args:
+        path (str): JSON file to update
+        update (Callable[[Any], Any]): receives the current content (or default) and returns the new content
+        default (Any): content assumed when the file is missing or unreadable
+
+    Returns:
+        Any: the content written
+    """
+    with file_lock(path):
+        data = update(read_json(path, default))
+        write_json(path, data)
+        return data
@@ -0,0 +1,86 @@
+"""
+Memory footprint of the cached register and rollup frames, untyped versus REGISTER_DTYPES / ROLLUP_DTYPES.
+
+Stores synthetic club activities in a temporary store, then loads the register and the
+rollup cube twice: as plain pandas reads them (object strings, float64 numbers, every
+column) and as the dashboard caches them (dictionary-encoded labels, 32-bit measures,
+only REGISTER_VIEW_COLUMNS). Reports the deep memory usage of both and times a grouped
+aggregation on each. The run fails if the compact frames aggregate to different totals.
+
+Run from the repository root:
+    python -m benchmarks.bench_memory --activities 200000 --clubs 20
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from contextlib import closing
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+import pandas as pd
+from activity_store import REGISTER_COLUMNS, connect, read_activities, read_rollup, upsert_activities
+from benchmarks.synthetic import make_activities, make_clubs, make_members, split_across_clubs
+from data_access import REGISTER_VIEW_COLUMNS
+from data_processing import process_activities
+
+def _untyped(sql: str, date_column: str) -> pd.DataFrame:
+    with closing(connect()) as conn:
+        df = pd.read_sql_query(sql, conn)
+    df[date_column] = pd.to_datetime(df[date_column])
+    return df
+
+def _megabytes(df: pd.DataFrame) -> float:
+    return df.memory_usage(deep=True).sum() / 1e6
+
+def _best_of(repeat: int, func) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--activities', type=int, default=200000)
+    parser.add_argument('--clubs', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='strava-memory-')
+    os.makedirs(os.path.join(workdir, 'data'))
+    os.chdir(workdir)
+    clubs = make_clubs(args.clubs)
+    counts = split_across_clubs(args.activities, clubs)
+    upsert_activities(pd.concat([process_activities(make_activities(counts[club['id']], make_members(club), seed=club['id']),
+                                                    club['id'], club['name']) for club in clubs], ignore_index=True))
+
+    frames = {
+        'register': (_untyped(f'SELECT {", ".join(REGISTER_COLUMNS)} FROM activities', 'upload_date'),
+                     read_activities(columns=REGISTER_VIEW_COLUMNS),
+                     ['club_id', 'sport_type', 'firstname', 'lastname'], 'distance'),
+        'rollup': (_untyped('SELECT * FROM activity_rollup', 'day'), read_rollup(),
+                   ['club_id', 'firstname', 'lastname'], 'distance_sum'),
+    }
+    drift = 0.0
+    for label, (untyped, typed, keys, measure) in frames.items():
+        before, after = _megabytes(untyped), _megabytes(typed)
+        print(f"{label}: {len(typed)} rows, {before:.1f}MB untyped -> {after:.1f}MB typed ({before / after:.1f}x smaller)")
+        totals = {}
+        for name, df in [('untyped', untyped), ('typed', typed)]:
+            group = lambda: df.groupby(keys, sort=False, observed=True)[measure].sum()
+            totals[name] = group()
+            print(f"  groupby {'/'.join(keys)} {name}: {_best_of(args.repeat, group) * 1000:.1f}ms")
+        # A group missing on either side counts as infinite drift
+        merged = totals['untyped'].reset_index().merge(totals['typed'].reset_index().astype({key: object for key in keys}),
+                                                       on=keys, how='outer', suffixes=('_untyped', '_typed'))
+        expected, got = merged[f'{measure}_untyped'], merged[f'{measure}_typed']
+        drift = max(drift, ((got - expected).abs() / expected.abs().clip(lower=1)).fillna(float('inf')).max())
+    print(f"max relative drift of the typed totals: {drift:.2g}")
+    sys.exit(1 if drift > 1e-5 else 0)
+
+if __name__ == '__main__':
+    main()
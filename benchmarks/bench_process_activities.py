@@ -0,0 +1,28 @@
+"""
+Throughput of data_processing.process_activities on synthetic club activity batches.
+
+Run from the repository root:
+    python -m benchmarks.bench_process_activities --activities 100000 --repeat 5
+"""
+import argparse
+import time
+from benchmarks.synthetic import make_activities
+from data_processing import process_activities
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--activities', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    activities = make_activities(args.activities)
+    timings = []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        process_activities(activities, 1, 'Benchmark Club')
+        timings.append(time.perf_counter() - start)
+    best = min(timings)
+    print(f"process_activities: {args.activities} activities, best of {args.repeat}: {best:.3f}s "
+          f"({args.activities / best:,.0f} activities/s)")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""
+Cold start of the dashboard: time to import main.py and to render the login page.
+
+Each measurement runs in a fresh interpreter so module caches do not hide import costs.
+The run fails when the best first paint exceeds --budget seconds or when a plotting
+backend gets imported before anyone has logged in.
+
+Run from the repository root:
+    python -m benchmarks.bench_startup --repeat 5 --budget 2.5
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Modules the login page has no use for; they are only loaded once charts are drawn
+DEFERRED_MODULES = ['visualization', 'colorcet', 'bs4']
+
+PROBE = """
+import json, os, sys, time
+from cryptography.fernet import Fernet
+os.environ.setdefault('ENCRYPTION_KEY', Fernet.generate_key().decode())
+os.environ.setdefault('STRAVA_CLIENT_SECRET', 'bench-secret')
+os.environ.setdefault('STRAVA_CLIENT_ID', '1')
+start = time.perf_counter()
+import main
+imported = time.perf_counter() - start
+from streamlit.testing.v1 import AppTest
+app = AppTest.from_file(os.path.abspath('main.py'), default_timeout=60)
+start = time.perf_counter()
+app.run()
+painted = time.perf_counter() - start
+print(json.dumps({'import': imported, 'first_paint': painted, 'exception': bool(app.exception),
+                  'loaded': [name for name in json.loads(sys.argv[1]) if name in sys.modules]}))
+"""
+
+def measure() -> dict:
+    output = subprocess.run([sys.executable, '-c', PROBE, json.dumps(DEFERRED_MODULES)], cwd=REPO_ROOT,
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--budget', type=float, default=2.5, help='maximum seconds for import plus first paint')
+    args = parser.parse_args()
+    runs = [measure() for _ in range(args.repeat)]
+    best_import = min(run['import'] for run in runs)
+    best_total = min(run['import'] + run['first_paint'] for run in runs)
+    loaded = sorted({name for run in runs for name in run['loaded']})
+    print(f"import main: best of {args.repeat}: {best_import:.3f}s")
+    print(f"import + login page first paint: best of {args.repeat}: {best_total:.3f}s (budget {args.budget:.1f}s)")
+    failures = []
+    if any(run['exception'] for run in runs):
+        failures.append("the login page raised an exception")
+    if loaded:
+        failures.append(f"loaded before login: {', '.join(loaded)}")
+    if best_total > args.budget:
+        failures.append(f"first paint over budget by {best_total - args.budget:.3f}s")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""
+Training load series: full computation over a long history versus the incremental update of a rerun.
+
+Stores a synthetic multi-year history of one athlete, computes the daily series once,
+then adds a day of activities at a time and times each update against recomputing from
+scratch. The run fails if the incremental series drifts from the full one.
+
+Run from the repository root:
+    python -m benchmarks.bench_training_load --activities 5000 --days 30
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+import pandas as pd
+from activity_store import upsert_athlete_activities
+from benchmarks.synthetic import make_athlete_activities
+from training_load import TrainingLoad
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--activities', type=int, default=5000, help='activities in the stored history')
+    parser.add_argument('--days', type=int, default=30, help='days added one at a time after the first computation')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='strava-training-load-')
+    os.makedirs(os.path.join(workdir, 'data'))
+    os.chdir(workdir)
+    activities = make_athlete_activities(args.activities, start=datetime(2012, 1, 1, tzinfo=timezone.utc))
+    days = pd.to_datetime(pd.Series([a['start_date_local'][:10] for a in activities]))
+    last_days = sorted(days.unique())[-args.days:]
+    history = [a for a, day in zip(activities, days) if day < last_days[0]]
+    upsert_athlete_activities(history)
+
+    load = TrainingLoad(1)
+    start = time.perf_counter()
+    load.daily(last_days[0] - pd.Timedelta(days=1))
+    first = time.perf_counter() - start
+    incremental, full = [], []
+    for day in last_days:
+        upsert_athlete_activities([a for a, d in zip(activities, days) if d == day])
+        start = time.perf_counter()
+        daily = load.daily(day)
+        incremental.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        expected = TrainingLoad(1).daily(day)
+        full.append(time.perf_counter() - start)
+
+    drift = (daily[expected.columns] - expected).abs().max().max()
+    print(f"{len(expected)} days, {args.activities} activities: first computation {first * 1000:.1f}ms")
+    print(f"per new day: incremental {sum(incremental) / len(incremental) * 1000:.1f}ms, "
+          f"full recompute {sum(full) / len(full) * 1000:.1f}ms, max drift {drift:.2g}")
+    sys.exit(1 if drift > 1e-6 * max(expected['cum_distance'].iloc[-1], 1) else 0)
+
+if __name__ == '__main__':
+    main()
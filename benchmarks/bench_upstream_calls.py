@@ -0,0 +1,79 @@
+"""
+Upstream Strava requests per dashboard page view, and for a burst of concurrent sessions.
+
+Runs the logged-in dashboard once against the local stub server and counts the requests
+that reach it, per endpoint. Then starts several sessions at the same moment, each with its
+own token, all asking for the same athlete profile endpoints and the same club, and counts
+how many requests single-flight and the shared response cache let through.
+
+Run from the repository root:
+    python -m benchmarks.bench_upstream_calls --sessions 20 --latency-ms 100
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from cryptography.fernet import Fernet
+from benchmarks.stub_server import StubStrava
+from benchmarks.synthetic import make_activities, make_clubs, make_members
+
+def page_view(stub: StubStrava) -> dict:
+    from streamlit.testing.v1 import AppTest
+    app = AppTest.from_file(os.path.join(REPO_ROOT, 'main.py'), default_timeout=120)
+    app.session_state['access_token'] = 'bench-token'
+    before = stub.path_counts.copy()
+    app.run()
+    if app.exception:
+        raise RuntimeError(app.exception[0].value)
+    return dict(stub.path_counts - before)
+
+def concurrent_sessions(stub: StubStrava, club_id: int, n_sessions: int) -> dict:
+    import strava_api
+    barrier = threading.Barrier(n_sessions)
+    def session(token):
+        barrier.wait()
+        strava_api.request_athlete(token)
+        strava_api.request_club_members(token, club_id)
+    # One user with many tabs open shares a token; club data is shared by every member
+    tokens = ['shared-token'] * (n_sessions // 2) + [f'token-{i}' for i in range(n_sessions - n_sessions // 2)]
+    before = stub.path_counts.copy()
+    threads = [threading.Thread(target=session, args=(token,)) for token in tokens]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return dict(stub.path_counts - before)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sessions', type=int, default=20)
+    parser.add_argument('--latency-ms', type=float, default=100, help='stub latency per request, so concurrent calls overlap')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='strava-upstream-')
+    os.makedirs(os.path.join(workdir, 'data'))
+    os.symlink(os.path.join(REPO_ROOT, 'media'), os.path.join(workdir, 'media'))
+    os.chdir(workdir)
+    clubs = make_clubs(3)
+    members = {club['id']: make_members(club)[:50] for club in clubs}
+    activities = {club['id']: make_activities(100, members[club['id']], seed=club['id']) for club in clubs}
+    with StubStrava(clubs, members, activities, latency=args.latency_ms / 1000) as stub:
+        os.environ.update(STRAVA_BASE_URL=stub.base_url, ENCRYPTION_KEY=Fernet.generate_key().decode(),
+                          STRAVA_CLIENT_SECRET='bench-secret', STRAVA_CLIENT_ID='1')
+        view = page_view(stub)
+        print(f"page view: {sum(view.values())} upstream requests")
+        for path, count in sorted(view.items()):
+            print(f"  {path:<40}{count:>4}")
+        burst = concurrent_sessions(stub, clubs[0]['id'], args.sessions)
+        print(f"{args.sessions} concurrent sessions (profile + club members): {sum(burst.values())} upstream requests "
+              f"instead of {2 * args.sessions}")
+        for path, count in sorted(burst.items()):
+            print(f"  {path:<40}{count:>4}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+"""
+Offline benchmark suite for the ingestion and dashboard hot paths.
+
+Everything runs against synthetic data and a local Strava stub server, inside a temporary
+working directory, so the real data/ folder is never touched and no network is needed.
+Each run is appended to benchmarks/results/history.jsonl and compared with the previous
+run at the same scale.
+
+Run from the repository root:
+    python -m benchmarks.run_benchmarks --activities 100000 --clubs 50
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HISTORY_FILE = os.path.join(REPO_ROOT, 'benchmarks', 'results', 'history.jsonl')
+sys.path.insert(0, REPO_ROOT)
+
+import pandas as pd
+import strava_api
+from benchmarks.stub_server import StubStrava
+from benchmarks.synthetic import make_activities, make_clubs, make_members, split_across_clubs
+from data_processing import (SPORT_CATEGORIES, athlete_totals, leaderboard_totals, process_activities,
+                             rank_leaderboards, sport_summary, update_activities_register)
+from activity_store import read_rollup
+from fetch_engine import fetch_clubs
+from query import Query
+from visualization import create_activity_plots
+
+@contextmanager
+def timed(results: Dict[str, float], stage: str):
+    start = time.perf_counter()
+    yield
+    results[stage] = round(time.perf_counter() - start, 4)
+
+def run_suite(n_activities: int, n_clubs: int, fetch_clubs_count: int, latency: float, workers: int, seed: int,
+              short_limit: int = 600, error_rate: float = 0.0) -> Dict[str, float]:
+    results = {}
+    clubs = make_clubs(n_clubs, seed=seed)
+    members = {club['id']: make_members(club, seed=seed) for club in clubs}
+    counts = split_across_clubs(n_activities, clubs, seed=seed)
+    with timed(results, 'generate'):
+        activities = {club['id']: make_activities(counts[club['id']], members[club['id']], seed=club['id']) for club in clubs}
+
+    # Fetch loop against the stub, with the production retry and rate-limit handling
+    with StubStrava(clubs, members, activities, latency=latency, short_limit=short_limit, error_rate=error_rate, seed=seed) as stub:
+        strava_api.STRAVA_BASE_URL = stub.base_url
+        strava_api.STRAVA_API_URL = f'{stub.base_url}/api/v3'
+        with timed(results, 'fetch'):
+            fetched = list(fetch_clubs('stub-access-token', clubs[:fetch_clubs_count], max_workers=workers, min_request_interval=0))
+        results['fetch_requests'] = stub.request_count
+        results['fetch_activities'] = sum(len(r.activities or []) for r in fetched)
+        results['fetch_deferred'] = sum(r.deferred for r in fetched)
+        results['fetch_failed'] = sum(bool(r.error) for r in fetched)
+
+    with timed(results, 'process_activities'):
+        frames = [process_activities(activities[club['id']], club['id'], club['name']) for club in clubs]
+    new_df = pd.concat(frames, ignore_index=True)
+    results['process_activities_per_s'] = round(len(new_df) / max(results['process_activities'], 1e-9))
+
+    with timed(results, 'register_cold'):
+        update_activities_register(new_df)
+    incremental = make_activities(200, members[clubs[0]['id']], seed=seed + 1)
+    with timed(results, 'register_incremental'):
+        update_activities_register(process_activities(incremental, clubs[0]['id'], clubs[0]['name']))
+
+    # Dashboard aggregations for the busiest club
+    busiest = max(clubs, key=lambda club: counts[club['id']])
+    with timed(results, 'aggregations'):
+        rollup_df = read_rollup()
+        club_rollup = rollup_df[rollup_df['club_id'] == busiest['id']]
+        for sport_types in SPORT_CATEGORIES.values():
+            athlete_totals(club_rollup[club_rollup['sport_type'].isin(sport_types)])
+        sport_summary(club_rollup)
+        rank_leaderboards(leaderboard_totals(club_rollup))
+
+    # Slider moves: the dashboard's date-range queries of the busiest club, after its scans are cached once
+    extent = (Query('activities').where(club_id=busiest['id'])
+              .agg(first=('upload_date', 'min'), last=('upload_date', 'max')).collect().iloc[0])
+    first_day, last_day = extent['first'].date(), extent['last'].date()
+    plot_columns = ('firstname', 'lastname', 'sport_type', 'distance', 'moving_time')
+    with timed(results, 'slider_50_moves'):
+        for offset in range(50):
+            start = first_day + (last_day - first_day) * offset / 50
+            Query('activities').where(club_id=busiest['id'], start=start, end=last_day).select(*plot_columns).collect()
+            (Query('rollup').where(club_id=busiest['id'], start=start, end=last_day).group_by('sport_type')
+             .agg(activity_count=('activity_count', 'sum'), distance_sum=('distance_sum', 'sum')).collect())
+
+    # Per-sport totals over every club, in this process and on the per-club process pool once its workers are up
+    all_clubs = Query('activities').group_by('sport_type').agg(activities=('distance', 'size'), distance=('distance', 'sum'),
+                                                             avg_speed=('avg_speed', 'mean'))
+    with timed(results, 'query_all_clubs'):
+        all_clubs.collect()
+    Query('rollup').group_by('club_id').agg(activity_count=('activity_count', 'sum')).collect(parallel=True)
+    with timed(results, 'query_all_clubs_parallel'):
+        all_clubs.collect(parallel=True)
+
+    club_df = new_df[new_df['club_id'] == busiest['id']]
+    with timed(results, 'figure'):
+        fig = create_activity_plots(club_df, 'Bench', 'M.')
+        payload = fig.to_json()
+    results['figure_payload_kb'] = round(len(payload) / 1024)
+    return results
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def previous_run(params: Dict) -> Dict:
+    try:
+        with open(HISTORY_FILE, 'r') as f:
+            runs = [json.loads(line) for line in f if line.strip()]
+    except FileNotFoundError:
+        return {}
+    matching = [run for run in runs if run['params'] == params]
+    return matching[-1] if matching else {}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--activities', type=int, default=100000, help='total synthetic activities (1k-1M)')
+    parser.add_argument('--clubs', type=int, default=50, help='number of synthetic clubs (1-500)')
+    parser.add_argument('--fetch-clubs', type=int, default=22, help='clubs fetched through the stub server')
+    parser.add_argument('--latency-ms', type=float, default=50, help='stub latency per request')
+    parser.add_argument('--workers', type=int, default=4, help='fetch thread pool size')
+    parser.add_argument('--short-limit', type=int, default=600, help='stub requests per 15 minutes before it answers 429')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of stub requests answered with a 503')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-save', action='store_true', help='do not append this run to the history file')
+    args = parser.parse_args()
+
+    params = {'activities': args.activities, 'clubs': args.clubs, 'fetch_clubs': min(args.fetch_clubs, args.clubs),
+              'latency_ms': args.latency_ms, 'workers': args.workers, 'short_limit': args.short_limit,
+              'error_rate': args.error_rate, 'seed': args.seed}
+    workdir = tempfile.mkdtemp(prefix='strava-bench-')
+    os.makedirs(os.path.join(workdir, 'data'))
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        results = run_suite(args.activities, args.clubs, params['fetch_clubs'], args.latency_ms / 1000, args.workers, args.seed,
+                            short_limit=args.short_limit, error_rate=args.error_rate)
+    finally:
+        os.chdir(cwd)
+
+    baseline = previous_run(params).get('results', {})
+    print(f"{'stage':<28}{'result':>14}{'previous':>14}")
+    for stage, value in results.items():
+        print(f"{stage:<28}{value:>14}{baseline.get(stage, ''):>14}")
+    if not args.no_save:
+        os.makedirs(os.path.dirname(HISTORY_FILE), exist_ok=True)
+        with open(HISTORY_FILE, 'a') as f:
+            f.write(json.dumps({'timestamp': datetime.now().isoformat(timespec='seconds'), 'revision': git_revision(),
+                                'params': params, 'results': results}) + '\n')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+"""
+Stress run of concurrent register writers: several processes, each with several session threads.
+
+Every writer commits overlapping slices of the same synthetic club feeds through the
+dashboard's write path (register writer queue, store transaction, fetch log and
+high-water marks), while reader threads keep taking snapshots. The run fails if a
+reader ever sees a partial JSON file or a shrinking register, or if the final register,
+rollup cube or state files disagree with what was written.
+
+Run from the repository root:
+    python -m benchmarks.stress_writers --processes 4 --threads 8 --batches 20
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from typing import List, Tuple
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+import pandas as pd
+from activity_store import activity_fingerprints, count_activities, read_rollup
+from benchmarks.synthetic import make_activities, make_clubs, make_members
+from data_processing import process_activities
+from fetch_engine import FETCH_LOG_FILE, HIGH_WATER_MARK_FILE
+from ingestion import commit_clubs, register_writer
+
+def club_feeds(n_clubs: int, feed_size: int, seed: int) -> dict:
+    """Identical in every process, so writers overlap on the same activities."""
+    clubs = make_clubs(n_clubs, seed=seed)
+    return {club['id']: (club, make_activities(feed_size, make_members(club, seed=seed)[:40], seed=club['id'])) for club in clubs}
+
+def write_batches(feeds: dict, n_batches: int, batch_size: int, seed: int, submitted: list):
+    rng = random.Random(seed)
+    for _ in range(n_batches):
+        club_id = rng.choice(list(feeds))
+        club, feed = feeds[club_id]
+        start = rng.randrange(max(len(feed) - batch_size, 1))
+        batch = feed[start:start + batch_size]
+        df = process_activities(batch, club_id, club['name'])
+        register_writer.submit(commit_clubs, [df], {club_id: [f'{seed}-{start}']}, [club_id]).result()
+        submitted.append((club_id, start, start + batch_size))
+
+def writer_process(args: Tuple, results):
+    n_threads, n_batches, batch_size, n_clubs, feed_size, seed, process_index = args
+    feeds = club_feeds(n_clubs, feed_size, seed)
+    submitted = []
+    threads = [threading.Thread(target=write_batches, args=(feeds, n_batches, batch_size, seed * 1000 + process_index * 100 + i, submitted))
+               for i in range(n_threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    results.put(submitted)
+
+def read_snapshots(stop: threading.Event, failures: List[str], reads: List[int]):
+    last_count = 0
+    while not stop.is_set():
+        for path in (FETCH_LOG_FILE, HIGH_WATER_MARK_FILE):
+            try:
+                with open(path, 'r') as f:
+                    json.load(f)
+            except FileNotFoundError:
+                pass
+            except json.JSONDecodeError as e:
+                failures.append(f"partial read of {path}: {e}")
+        count = count_activities()
+        if count < last_count:
+            failures.append(f"register shrank from {last_count} to {count}")
+        last_count = count
+        reads.append(count)
+
+def expected_activities(submitted: list, n_clubs: int, feed_size: int, seed: int) -> int:
+    feeds = club_feeds(n_clubs, feed_size, seed)
+    frames = [process_activities(feeds[club_id][1][start:end], club_id, feeds[club_id][0]['name'])
+              for club_id, start, end in sorted(set(submitted))]
+    return activity_fingerprints(pd.concat(frames)).nunique()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=8, help='session threads per process')
+    parser.add_argument('--batches', type=int, default=20, help='commits per thread')
+    parser.add_argument('--batch-size', type=int, default=200)
+    parser.add_argument('--clubs', type=int, default=10)
+    parser.add_argument('--feed-size', type=int, default=2000, help='activities per club feed')
+    parser.add_argument('--readers', type=int, default=2)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='strava-stress-')
+    os.makedirs(os.path.join(workdir, 'data'))
+    os.chdir(workdir)
+    count_activities()  # create the store before the writers race for it
+
+    stop = threading.Event()
+    failures, reads = [], []
+    readers = [threading.Thread(target=read_snapshots, args=(stop, failures, reads)) for _ in range(args.readers)]
+    for reader in readers:
+        reader.start()
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    start = time.perf_counter()
+    processes = [context.Process(target=writer_process, args=((args.threads, args.batches, args.batch_size, args.clubs,
+                                                               args.feed_size, args.seed, i), results))
+                 for i in range(args.processes)]
+    for process in processes:
+        process.start()
+    submitted = [batch for _ in processes for batch in results.get()]
+    for process in processes:
+        process.join()
+    elapsed = time.perf_counter() - start
+    stop.set()
+    for reader in readers:
+        reader.join()
+
+    if any(process.exitcode for process in processes):
+        failures.append("a writer process crashed")
+    stored = count_activities()
+    expected = expected_activities(submitted, args.clubs, args.feed_size, args.seed)
+    if stored != expected:
+        failures.append(f"register holds {stored} activities, expected {expected}")
+    rolled_up = int(read_rollup()['activity_count'].sum())
+    if rolled_up != stored:
+        failures.append(f"rollup counts {rolled_up} activities, register holds {stored}")
+    with open(FETCH_LOG_FILE, 'r') as f:
+        logged = set(json.load(f))
+    missing = {str(club_id) for club_id, _, _ in submitted} - logged
+    if missing:
+        failures.append(f"fetch log misses clubs {sorted(missing)}")
+
+    writers = args.processes * args.threads
+    print(f"{len(submitted)} commits from {writers} writers in {args.processes} processes: {elapsed:.2f}s "
+          f"({len(submitted) / elapsed:.1f} commits/s), {stored} unique activities, {len(reads)} snapshot reads")
+    for failure in failures[:20]:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+"""
+Local stand-in for the Strava v3 endpoints used by strava_api, for offline benchmarks.
+
+Serves synthetic data with Strava-style pagination and X-RateLimit-* headers, and can
+add per-request latency, enforce a 15-minute request limit with 429s, and inject 5xx errors.
+Responses carry an ETag and a matching If-None-Match is answered with a 304.
+"""
+import hashlib
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from datetime import datetime
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+from benchmarks.synthetic import make_streams
+
+class StubStrava:
+    """
+    Synthetic Strava account: one athlete, their own activities, their clubs, and each club's members and activities.
+
+    Args:
+        clubs (List[Dict]): club summaries
+        members (Dict[int, List[Dict]]): members per club id
+        activities (Dict[int, List[Dict]]): activities per club id, newest first
+        latency (float): seconds added to every response
+        short_limit (int): requests allowed per 15-minute window before answering 429
+        daily_limit (int): requests allowed per day, reported in the headers
+        error_rate (float): fraction of API requests answered with a 503
+        athlete_activities (Optional[List[Dict]]): the athlete's own activities, oldest first
+    """
+
+    def __init__(self, clubs: List[Dict], members: Dict[int, List[Dict]], activities: Dict[int, List[Dict]],
+                 latency: float = 0.0, short_limit: int = 600, daily_limit: int = 6000, error_rate: float = 0.0,
+                 seed: int = 0, athlete_activities: Optional[List[Dict]] = None):
+        self.clubs = clubs
+        self.members = members
+        self.activities = activities
+        self.latency = latency
+        self.short_limit = short_limit
+        self.daily_limit = daily_limit
+        self.error_rate = error_rate
+        self.athlete_activities = athlete_activities or []
+        self._activities_by_id = {activity['id']: activity for activity in self.athlete_activities}
+        # The account postdates its oldest activities, as when they were imported from another platform
+        created_at = (self.athlete_activities[len(self.athlete_activities) // 4]['start_date']
+                      if self.athlete_activities else '2017-06-01T00:00:00Z')
+        self.athlete = {'id': 1, 'resource_state': 3, 'firstname': 'Bench', 'lastname': 'M.', 'created_at': created_at}
+        self.request_count = 0
+        self.throttled_count = 0
+        self.not_modified_count = 0
+        self.path_counts = Counter()
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+
+    @property
+    def base_url(self) -> str:
+        return f'http://127.0.0.1:{self._server.server_port}'
+
+    def start(self) -> 'StubStrava':
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                stub._handle(self, 'GET')
+
+            def do_POST(self):
+                stub._handle(self, 'POST')
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _route(self, method: str, path: str, query: Dict[str, List[str]]) -> Optional[object]:
+        parts = path.strip('/').split('/')
+        page = int(query.get('page', ['1'])[0])
+        per_page = int(query.get('per_page', ['30'])[0])
+        def paginate(items):
+            return items[(page - 1) * per_page:page * per_page]
+        if method == 'POST' and parts == ['oauth', 'token']:
+            return {'token_type': 'Bearer', 'access_token': 'stub-access-token', 'refresh_token': 'stub-refresh-token',
+                    'expires_at': int(time.time()) + 6 * 3600, 'expires_in': 6 * 3600, 'athlete': self.athlete}
+        if parts[:2] != ['api', 'v3']:
+            return None
+        parts = parts[2:]
+        if parts == ['athlete']:
+            return self.athlete
+        if parts == ['athlete', 'clubs']:
+            return paginate(self.clubs)
+        if parts == ['athlete', 'activities']:
+            def started(activity):
+                return datetime.fromisoformat(activity['start_date'].replace('Z', '+00:00')).timestamp()
+            after = float(query.get('after', ['-inf'])[0])
+            before = float(query.get('before', ['inf'])[0])
+            # Strava lists newest first, or oldest first when only after is given
+            selected = [activity for activity in self.athlete_activities if after < started(activity) < before]
+            return paginate(selected if 'after' in query and 'before' not in query else selected[::-1])
+        if len(parts) == 3 and parts[0] == 'activities' and parts[1].isdigit() and parts[2] == 'streams':
+            activity = self._activities_by_id.get(int(parts[1]))
+            return None if activity is None or activity.get('manual') else make_streams(activity)
+        if parts == ['activities', 'following']:
+            return []
+        if len(parts) == 3 and parts[0] == 'athletes' and parts[2] == 'stats':
+            totals = {'count': 42, 'distance': 1234567.0, 'moving_time': 180000, 'elapsed_time': 200000, 'elevation_gain': 9876.0}
+            return {'all_ride_totals': totals, 'recent_ride_totals': totals, 'all_run_totals': totals, 'recent_run_totals': totals}
+        if len(parts) == 3 and parts[0] == 'clubs' and parts[1].isdigit():
+            club_id = int(parts[1])
+            if parts[2] == 'members' and club_id in self.members:
+                return paginate(self.members[club_id])
+            if parts[2] == 'activities' and club_id in self.activities:
+                return paginate(self.activities[club_id])
+        return None
+
+    def _handle(self, handler: BaseHTTPRequestHandler, method: str):
+        url = urlparse(handler.path)
+        # Drain the request body so the next request on this keep-alive connection starts clean
+        handler.rfile.read(int(handler.headers.get('Content-Length') or 0))
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.request_count += 1
+            self.path_counts[url.path] += 1
+            usage = self.request_count
+            throttled = usage > self.short_limit
+            failed = not throttled and self._rng.random() < self.error_rate
+            if throttled:
+                self.throttled_count += 1
+        if throttled:
+            status, body = 429, {'message': 'Rate Limit Exceeded', 'errors': []}
+        elif failed:
+            status, body = 503, {'message': 'Service Unavailable'}
+        else:
+            body = self._route(method, url.path, parse_qs(url.query))
+            status = 200 if body is not None else 404
+            if body is None:
+                body = {'message': 'Record Not Found', 'errors': []}
+        payload = json.dumps(body).encode('utf-8')
+        etag = f'"{hashlib.md5(payload).hexdigest()}"'
+        if status == 200 and handler.headers.get('If-None-Match') == etag:
+            with self._lock:
+                self.not_modified_count += 1
+            status, payload = 304, b''
+        handler.send_response(status)
+        handler.send_header('Content-Type', 'application/json; charset=utf-8')
+        handler.send_header('Content-Length', str(len(payload)))
+        if status in (200, 304):
+            handler.send_header('ETag', etag)
+        handler.send_header('X-RateLimit-Limit', f'{self.short_limit},{self.daily_limit}')
+        handler.send_header('X-RateLimit-Usage', f'{min(usage, self.short_limit)},{usage}')
+        handler.end_headers()
+        handler.wfile.write(payload)
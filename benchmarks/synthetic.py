@@ -0,0 +1,127 @@
+"""
+Synthetic Strava data shaped like the v3 club and athlete endpoints, for offline benchmarks.
+"""
+import random
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List
+
+SPORT_TYPES = ['Ride', 'Run', 'VirtualRide', 'TrailRun', 'MountainBikeRide', 'Swim', 'GravelRide', 'Walk']
+SPORT_WEIGHTS = [48, 28, 11, 4, 3, 2, 2, 2]  # roughly the mix in data/all_club_activities.csv
+# (mean km, mean km/h) per sport type
+SPORT_PROFILES = {
+    'Ride': (55, 27), 'Run': (10, 11), 'VirtualRide': (35, 30), 'TrailRun': (15, 8),
+    'MountainBikeRide': (35, 17), 'Swim': (2, 3), 'GravelRide': (60, 22), 'Walk': (6, 5),
+}
+
+def make_clubs(n_clubs: int, seed: int = 0) -> List[Dict]:
+    """Club summaries as returned by /athlete/clubs."""
+    rng = random.Random(seed)
+    return [{
+        'id': 100000 + i,
+        'resource_state': 2,
+        'name': f'Synthetic Club {i}',
+        'sport_type': rng.choice(['cycling', 'running', 'triathlon', 'other']),
+        'member_count': rng.randint(5, 400),
+        'private': False,
+    } for i in range(n_clubs)]
+
+def make_members(club: Dict, seed: int = 0) -> List[Dict]:
+    """Member list of a club as returned by /clubs/{id}/members."""
+    rng = random.Random(f'{seed}-{club["id"]}')
+    return [{
+        'resource_state': 2,
+        'firstname': f'Athlete{club["id"] % 1000}_{i}',
+        'lastname': f'{chr(65 + rng.randrange(26))}.',
+        'membership': 'member',
+        'admin': False,
+        'owner': False,
+    } for i in range(club['member_count'])]
+
+def make_activities(n: int, members: List[Dict] = None, seed: int = 0) -> List[Dict]:
+    """Club activity summaries as returned by /clubs/{id}/activities, newest first."""
+    rng = random.Random(seed)
+    members = members or [{'firstname': f'Athlete{i}', 'lastname': f'{chr(65 + i % 26)}.'} for i in range(500)]
+    sports = rng.choices(SPORT_TYPES, weights=SPORT_WEIGHTS, k=n)
+    activities = []
+    for i, sport_type in enumerate(sports):
+        member = members[rng.randrange(len(members))]
+        mean_km, mean_speed = SPORT_PROFILES[sport_type]
+        distance = rng.expovariate(1 / mean_km) * 1000
+        moving_time = int(distance / 1000 / max(rng.gauss(mean_speed, mean_speed / 5), 1) * 3600)
+        activities.append({
+            'resource_state': 2,
+            'athlete': {'resource_state': 2, 'firstname': member['firstname'], 'lastname': member['lastname']},
+            'name': f'{sport_type} #{seed}-{i}',
+            'distance': round(distance, 1),
+            'moving_time': moving_time,
+            'elapsed_time': moving_time + rng.randint(0, 3600),
+            'total_elevation_gain': round(rng.expovariate(1 / 300), 1),
+            'type': sport_type,
+            'sport_type': sport_type,
+            'workout_type': rng.choice([None, 0, 10, 12]),
+        })
+    return activities
+
+def make_athlete_activities(n: int, athlete_id: int = 1, start: datetime = datetime(2018, 1, 1, tzinfo=timezone.utc),
+                            seed: int = 0) -> List[Dict]:
+    """The athlete's own activity summaries as returned by /athlete/activities, oldest first, about one a day."""
+    rng = random.Random(seed)
+    sports = rng.choices(SPORT_TYPES, weights=SPORT_WEIGHTS, k=n)
+    activities = []
+    started = start
+    for i, sport_type in enumerate(sports):
+        started += timedelta(hours=rng.uniform(4, 44))
+        mean_km, mean_speed = SPORT_PROFILES[sport_type]
+        distance = rng.expovariate(1 / mean_km) * 1000
+        moving_time = max(int(distance / 1000 / max(rng.gauss(mean_speed, mean_speed / 5), 1) * 3600), 60)
+        has_heartrate = rng.random() < 0.8
+        activities.append({
+            'resource_state': 2,
+            'athlete': {'id': athlete_id, 'resource_state': 1},
+            'id': 9000000 + seed * 1000000 + i,
+            'name': f'{sport_type} #{i}',
+            'distance': round(distance, 1),
+            'moving_time': moving_time,
+            'elapsed_time': moving_time + rng.randint(0, 1800),
+            'total_elevation_gain': round(rng.expovariate(1 / 300), 1),
+            'type': sport_type,
+            'sport_type': sport_type,
+            'start_date': started.strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'start_date_local': (started + timedelta(hours=1)).strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'average_speed': round(distance / moving_time, 3),
+            'max_speed': round(distance / moving_time * 1.8, 3),
+            'has_heartrate': has_heartrate,
+            'average_heartrate': round(rng.gauss(140, 12), 1) if has_heartrate else None,
+            'max_heartrate': round(rng.gauss(175, 8), 1) if has_heartrate else None,
+            'suffer_score': round(moving_time / 3600 * rng.uniform(20, 90)) if has_heartrate else None,
+            'trainer': sport_type == 'VirtualRide',
+            'commute': rng.random() < 0.05,
+            'manual': rng.random() < 0.02,
+        })
+    return activities
+
+def make_streams(activity: Dict, sample_interval: int = 5) -> Dict[str, Dict]:
+    """Streams of an activity as returned by /activities/{id}/streams?key_by_type=true, one sample every few seconds."""
+    rng = random.Random(activity['id'])
+    n = max(activity['moving_time'] // sample_interval, 2)
+    speed = activity['distance'] / activity['moving_time']
+    time = [i * sample_interval for i in range(n)]
+    velocity = [max(rng.gauss(speed, speed / 6), 0.0) for _ in range(n)]
+    distance, altitude = [0.0], [100.0]
+    for v in velocity[1:]:
+        distance.append(distance[-1] + v * sample_interval)
+        altitude.append(altitude[-1] + rng.gauss(0, 0.5))
+    streams = {'time': time, 'distance': distance, 'altitude': altitude, 'velocity_smooth': velocity}
+    if activity.get('has_heartrate'):
+        streams['heartrate'] = [round(rng.gauss(activity['average_heartrate'], 8)) for _ in range(n)]
+    return {key: {'data': data, 'series_type': 'distance', 'original_size': n, 'resolution': 'high'}
+            for key, data in streams.items()}
+
+def split_across_clubs(n_activities: int, clubs: List[Dict], seed: int = 0) -> Dict[int, int]:
+    """Number of activities per club, skewed so that a few busy clubs hold most of the history."""
+    rng = random.Random(seed)
+    weights = [1 / (rank + 1) for rank in range(len(clubs))]
+    counts = dict.fromkeys((club['id'] for club in clubs), 0)
+    for club in rng.choices(clubs, weights=weights, k=n_activities):
+        counts[club['id']] += 1
+    return counts
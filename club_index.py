@@ -0,0 +1,75 @@
+"""
+Cached index of club metadata, so fetch eligibility and club selection need no extra Strava calls.
+
+Club summaries from /athlete/clubs already carry member_count. They are stored once per
+club together with the club's activity rate, and each athlete's club list is re-listed
+from Strava only when it is older than CLUB_INDEX_TTL. Last fetch times stay in the fetch
+log and are joined in when the index is read.
+"""
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+import pandas as pd
+from atomic_files import read_json, update_json
+from fetch_engine import load_fetch_log
+from strava_api import request_athlete_clubs
+
+CLUB_INDEX_FILE = 'data/club_index.json'
+CLUB_INDEX_TTL = timedelta(days=1)
+CLUB_FIELDS = ['id', 'name', 'sport_type', 'member_count']
+INDEX_COLUMNS = CLUB_FIELDS + ['activity_rate', 'last_fetched']
+
+def _empty_index() -> Dict[str, Dict]:
+    return {'clubs': {}, 'athletes': {}}
+
+def load_club_index() -> Dict[str, Dict]:
+    return read_json(CLUB_INDEX_FILE, _empty_index())
+
+def update_club_listing(athlete_id, clubs: List[Dict[str, Any]], now: Optional[datetime] = None):
+    """Store an athlete's club list as returned by /athlete/clubs, keeping the activity rates already known."""
+    listed_at = (now or datetime.now()).isoformat()
+    def merge(index):
+        for club in clubs:
+            entry = index['clubs'].setdefault(str(club['id']), {})
+            entry.update({field: club.get(field) for field in CLUB_FIELDS})
+        index['athletes'][str(athlete_id)] = {'club_ids': [club['id'] for club in clubs], 'listed_at': listed_at}
+        return index
+    update_json(CLUB_INDEX_FILE, merge, _empty_index())
+
+def update_activity_rates(activity_rates: Dict[int, float]):
+    """Record the activities per day of freshly fetched clubs, as computed by fetch_engine.estimate_activity_rates."""
+    def merge(index):
+        for club_id, rate in activity_rates.items():
+            index['clubs'].setdefault(str(club_id), {'id': club_id})['activity_rate'] = rate
+        return index
+    update_json(CLUB_INDEX_FILE, merge, _empty_index())
+
+def get_athlete_clubs_indexed(access_token: str, athlete_id, now: Optional[datetime] = None) -> List[Dict[str, Any]]:
+    """
+    Return an athlete's clubs from the index, listing them from Strava only when the entry is missing or stale.
+
+    Args:
+        access_token (str): Strava access token of the athlete
+        athlete_id: Strava athlete id
+        now (Optional[datetime]): reference time, defaults to datetime.now()
+
+    Returns:
+        List[Dict[str, Any]]: club entries with CLUB_FIELDS and activity_rate when known
+
+    Raises:
+        requests.RequestException: if the club list has to be fetched and the request fails
+    """
+    now = now or datetime.now()
+    index = load_club_index()
+    athlete = index['athletes'].get(str(athlete_id))
+    if athlete is None or now - datetime.fromisoformat(athlete['listed_at']) > CLUB_INDEX_TTL:
+        update_club_listing(athlete_id, request_athlete_clubs(access_token), now)
+        index = load_club_index()
+        athlete = index['athletes'][str(athlete_id)]
+    return [index['clubs'][str(club_id)] for club_id in athlete['club_ids']]
+
+def club_index_frame(clubs: List[Dict[str, Any]]) -> pd.DataFrame:
+    """Index entries as a frame with INDEX_COLUMNS, joined with the last fetch time of each club."""
+    fetch_log = load_fetch_log()
+    df = pd.DataFrame(clubs).reindex(columns=INDEX_COLUMNS)
+    df['last_fetched'] = pd.to_datetime(df['id'].map(lambda club_id: fetch_log.get(str(club_id))))
+    return df
@@ -0,0 +1,52 @@
+import pandas as pd
+import streamlit as st
+from datetime import date
+from typing import Optional
+from instrumentation import traced
+from activity_store import data_version, read_activities
+from training_load import TrainingLoad
+
+# Register columns kept in memory; resource_state, athlete, elapsed_time, type and workout_type are only read from the store
+REGISTER_VIEW_COLUMNS = ['name', 'distance', 'moving_time', 'total_elevation_gain', 'sport_type', 'club_id',
+                         'upload_date', 'club_name', 'avg_speed', 'firstname', 'lastname']
+
+@st.cache_resource(max_entries=1, show_spinner=False)
+def _load_register(version: int) -> pd.DataFrame:
+    # Only the latest version is kept; older frames are released as soon as the store changes
+    return read_activities(columns=REGISTER_VIEW_COLUMNS)
+
+@traced('store')
+def get_activities() -> pd.DataFrame:
+    """
+    Return the activity register (REGISTER_VIEW_COLUMNS), loaded from the store once per data version.
+
+    The same frame is shared by every rerun and every session until the store is written
+    again, so callers must treat it as read-only and copy before modifying it.
+    """
+    return _load_register(data_version())
+
+@st.cache_resource(max_entries=64, show_spinner=False)
+def _training_load(athlete_id: int) -> TrainingLoad:
+    return TrainingLoad(athlete_id)
+
+@traced('store')
+def get_training_load(athlete_id: int, today: Optional[date] = None) -> pd.DataFrame:
+    """
+    Return an athlete's daily training series (see training_load), shared read-only like get_activities.
+
+    One TrainingLoad per athlete lives for the whole server process, so a rerun only
+    adds the days and activities that arrived since the previous one.
+    """
+    return _training_load(int(athlete_id)).daily(today)
+
+def date_slice(df: pd.DataFrame, column: str, start: Optional[date] = None, end: Optional[date] = None) -> pd.DataFrame:
+    """
+    Rows of df whose column falls between start and end (whole days, inclusive).
+
+    df must be sorted by column: both bounds are found by binary search, so the cost does
+    not grow with the length of the history and no per-row date objects are built.
+    """
+    values = df[column]
+    lo = 0 if start is None else values.searchsorted(pd.Timestamp(start), side='left')
+    hi = len(df) if end is None else values.searchsorted(pd.Timestamp(end) + pd.Timedelta(days=1), side='left')
+    return df.iloc[lo:hi]
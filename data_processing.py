@@ -1,30 +1,86 @@
 import pandas as pd
 from datetime import datetime
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
 import ast
 import requests
+from activity_store import upsert_activities
+from data_access import get_activities
+from instrumentation import traced
 
+# Fields kept from Strava's club activity summaries; anything else in the payload is dropped
+RAW_ACTIVITY_FIELDS = ['name', 'distance', 'moving_time', 'elapsed_time', 'total_elevation_gain',
+                       'type', 'sport_type', 'workout_type']
+# Schema of the frame returned by process_activities; labels are dictionary-encoded as in
+# activity_store.REGISTER_DTYPES, but measures stay float64 until stored, because the
+# fingerprint hashes their exact rounded values
+ACTIVITY_SCHEMA = {
+    'name': 'string',
+    'distance': 'float64',  # km, 1 decimal
+    'moving_time': 'float64',  # hours, 2 decimals
+    'elapsed_time': 'Int32',  # seconds
+    'total_elevation_gain': 'float64',
+    'type': 'category',
+    'sport_type': 'category',
+    'workout_type': 'Int8',
+    'club_id': 'int64',
+    'upload_date': 'datetime64[us]',
+    'club_name': 'category',
+    'avg_speed': 'float64',  # km/h, NaN when moving_time is 0
+    'firstname': 'category',
+    'lastname': 'category',
+}
+
+def _athlete_names(athletes: List) -> Tuple[List[str], List[str]]:
+    """Extract first and last names; athletes re-read from CSV arrive as dict reprs and are parsed first."""
+    if not all(type(athlete) is dict for athlete in athletes):
+        athletes = [ast.literal_eval(a) if isinstance(a, str) else a for a in athletes]
+        athletes = [a if isinstance(a, dict) else {} for a in athletes]
+    return [a.get('firstname', 'N/A') for a in athletes], [a.get('lastname', 'N/A') for a in athletes]
+
+@traced('ingest')
 def process_activities(activities: List[Dict], club_id: int, club_name: str) -> pd.DataFrame:
+    """
+    Normalise raw club activity JSON into a frame with the fixed ACTIVITY_SCHEMA.
+
+    Distance is converted to km and moving time to hours; avg_speed is derived from
+    the rounded values as before, but is left missing rather than infinite for
+    activities without moving time.
+
+    Args:
+        activities (List[Dict]): activity summaries as returned by the club activities endpoint
+        club_id (int): club the activities were fetched from
+        club_name (str): name of that club
+
+    Returns:
+        pd.DataFrame: one row per activity, empty if there are no activities
+    """
     if not activities:
         return pd.DataFrame()
-    df = pd.DataFrame(activities)
-    df['distance'] = round(df['distance'] / 1000, 1)  # Convert to kilometers rounded to 1 decimal
-    df['moving_time'] = round(df['moving_time'] / 3600, 2)  # Convert to hours rounded to 2 decimals
-    df['club_id'] = club_id
-    df['club_name'] = club_name
-    df['upload_date'] = datetime.now()
-    if 'distance' in df.columns and 'moving_time' in df.columns:
-        df['avg_speed'] = round(df['distance'] / df['moving_time'], 2)
-    else:
-        print("Warning: Unable to calculate average speed due to missing data")
-    # Drop the original athlete column and the temporary athlete_dict column
-    # Extract firstname and lastname from the athlete dictionary
-    df['athlete_dict'] = df['athlete'].apply(lambda x: ast.literal_eval(x) if isinstance(x, str) else x)
-    df['firstname'] = df['athlete_dict'].apply(lambda x: x.get('firstname', 'N/A'))
-    df['lastname'] = df['athlete_dict'].apply(lambda x: x.get('lastname', 'N/A'))
-    df = df.drop(columns=['athlete', 'athlete_dict'])    
-    return df
+    # Build each column straight into its schema dtype, skipping pandas' per-cell type inference
+    raw = {field: pd.Series([activity.get(field) for activity in activities], dtype=ACTIVITY_SCHEMA[field])
+           for field in RAW_ACTIVITY_FIELDS}
+    firstnames, lastnames = _athlete_names([activity.get('athlete') for activity in activities])
+    distance = (raw['distance'] / 1000).round(1)  # Convert to kilometers rounded to 1 decimal
+    moving_time = (raw['moving_time'] / 3600).round(2)  # Convert to hours rounded to 2 decimals
+    df = pd.DataFrame({
+        'name': raw['name'],
+        'distance': distance,
+        'moving_time': moving_time,
+        'elapsed_time': raw['elapsed_time'],
+        'total_elevation_gain': raw['total_elevation_gain'],
+        'type': raw['type'],
+        'sport_type': raw['sport_type'],
+        'workout_type': raw['workout_type'],
+        'club_id': club_id,
+        'upload_date': datetime.now(),
+        'club_name': club_name,
+        'avg_speed': (distance / moving_time.where(moving_time > 0)).round(2),
+        'firstname': firstnames,
+        'lastname': lastnames,
+    })
+    return df.astype(ACTIVITY_SCHEMA)
 
+@traced('store')
 def update_activities_register(new_activities_df: pd.DataFrame) -> pd.DataFrame:
     """
     Update the activities register with new activities.
@@ -35,20 +91,98 @@ def update_activities_register(new_activities_df: pd.DataFrame) -> pd.DataFrame:
     Returns:
         pd.DataFrame: Updated DataFrame with all activities
     """
-    file_path = 'data/all_club_activities.csv'
-    
-    try:
-        existing_df = pd.read_csv(file_path, parse_dates=['upload_date'])
-        combined_df = pd.concat([existing_df, new_activities_df])
-        combined_df = combined_df.sort_values('upload_date').drop_duplicates(
-            subset=['name', 'moving_time', 'club_id'], keep='last'
-        )
-        combined_df = combined_df.sort_values('upload_date', ascending=False).reset_index(drop=True)
-    except FileNotFoundError:
-        combined_df = new_activities_df
-    
-    combined_df.to_csv(file_path, index=False)
-    return combined_df
+    # The store's fingerprint index appends unseen activities and only touches last_seen on known ones
+    upsert_activities(new_activities_df)
+    return get_activities()
+
+def named_athletes(rollup_df: pd.DataFrame) -> pd.DataFrame:
+    """Rollup rows of identified athletes; the cube files activities without a name under empty strings."""
+    return rollup_df[(rollup_df['firstname'] != '') | (rollup_df['lastname'] != '')]
+
+# Dashboard sport categories; Strava reports trail runs as 'TrailRun' and gravel rides as 'GravelRide'
+SPORT_CATEGORIES = {
+    "Running (Trail + Running)": ['Trail', 'TrailRun', 'Run'],
+    "Cycling (Gravel, Road, Mountain Bike, Virtual)": ['Gravel Ride', 'GravelRide', 'Ride', 'MountainBikeRide', 'VirtualRide'],
+    "Swimming": ['Swim']
+}
+ALL_ACTIVITIES = "All Activities"
+# Leaderboard label -> (per-athlete measure, how it is ranked)
+LEADERBOARD_METRICS = {
+    "Highest ascent": 'elevation_max',
+    "Highest cumulative moving time": 'moving_time_sum',
+    "Highest cumulative distance": 'distance_sum',
+    "Highest average moving speed": 'avg_speed',
+    "Highest number of activities": 'activity_count',
+}
+# Measures kept per (category, athlete) and how they are aggregated
+LEADERBOARD_TOTALS = {
+    'activity_count': 'sum',
+    'distance_sum': 'sum',
+    'moving_time_sum': 'sum',
+    'elevation_max': 'max',
+    'speed_sum': 'sum',
+    'speed_count': 'sum',
+}
+
+@traced('aggregate')
+def leaderboard_totals(rollup_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Per (sport category, athlete) totals for every leaderboard metric, in a single grouped pass.
+
+    Each rollup row counts towards its sport category and towards ALL_ACTIVITIES.
+    """
+    named_df = named_athletes(rollup_df)
+    category_of = {sport: category for category, sports in SPORT_CATEGORIES.items() for sport in sports}
+    categorised = named_df.assign(category=named_df['sport_type'].map(category_of)).dropna(subset=['category'])
+    both_df = pd.concat([categorised, named_df.assign(category=ALL_ACTIVITIES)], ignore_index=True)
+    return both_df.groupby(['category', 'firstname', 'lastname'], sort=False, observed=True).agg(LEADERBOARD_TOTALS).reset_index()
+
+@traced('aggregate')
+def rank_leaderboards(totals_df: pd.DataFrame, k: int = 3) -> pd.DataFrame:
+    """
+    Rank athletes on every leaderboard metric within every category.
+
+    Ties share a rank ("min" ranking), so a leaderboard may list more than k athletes
+    when several are tied at rank k.
+
+    Returns:
+        pd.DataFrame: category, metric, rank, firstname, lastname, value
+    """
+    totals_df = totals_df.assign(avg_speed=totals_df['speed_sum'] / totals_df['speed_count'].where(totals_df['speed_count'] > 0))
+    boards = []
+    for label, measure in LEADERBOARD_METRICS.items():
+        ranks = totals_df.groupby('category', sort=False, observed=True)[measure].rank(method='min', ascending=False)
+        top = totals_df.loc[ranks <= k, ['category', 'firstname', 'lastname', measure]].rename(columns={measure: 'value'})
+        boards.append(top.assign(metric=label, rank=ranks[ranks <= k].astype(int)))
+    if not boards:
+        return pd.DataFrame(columns=['category', 'metric', 'rank', 'firstname', 'lastname', 'value'])
+    leaderboards = pd.concat(boards, ignore_index=True)
+    return leaderboards.sort_values(['category', 'metric', 'rank'], kind='stable')[['category', 'metric', 'rank', 'firstname', 'lastname', 'value']]
+
+@traced('aggregate')
+def athlete_totals(rollup_df: pd.DataFrame) -> pd.DataFrame:
+    """Per-athlete activity count, total distance and moving time, and mean activity speed from rollup rows."""
+    totals = named_athletes(rollup_df).groupby(['firstname', 'lastname'], sort=False, observed=True).agg(
+        activity_count=('activity_count', 'sum'),
+        distance=('distance_sum', 'sum'),
+        moving_time=('moving_time_sum', 'sum'),
+        speed_sum=('speed_sum', 'sum'),
+        speed_count=('speed_count', 'sum'),
+    ).reset_index()
+    totals['avg_speed'] = totals['speed_sum'] / totals['speed_count'].where(totals['speed_count'] > 0)
+    return totals.drop(columns=['speed_sum', 'speed_count'])
 
-def get_palmares(df: pd.DataFrame, sport_types: List[str], metric: str) -> pd.DataFrame:
-    return df[df['sport_type'].isin(sport_types)].groupby(['firstname', 'lastname'])[metric].max().nlargest(3).reset_index()
+@traced('aggregate')
+def sport_summary(rollup_df: pd.DataFrame) -> pd.DataFrame:
+    """Per-sport totals and per-activity means from rollup rows."""
+    summary = rollup_df.groupby('sport_type', observed=True).agg(
+        activity_count=('activity_count', 'sum'),
+        distance_sum=('distance_sum', 'sum'),
+        moving_time_sum=('moving_time_sum', 'sum'),
+        speed_sum=('speed_sum', 'sum'),
+        speed_count=('speed_count', 'sum'),
+    )
+    summary['distance_mean'] = summary['distance_sum'] / summary['activity_count']
+    summary['moving_time_mean'] = summary['moving_time_sum'] / summary['activity_count']
+    summary['avg_speed_mean'] = summary['speed_sum'] / summary['speed_count'].where(summary['speed_count'] > 0)
+    return summary[['distance_sum', 'distance_mean', 'moving_time_sum', 'moving_time_mean', 'avg_speed_mean', 'activity_count']].reset_index()
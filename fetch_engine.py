@@ -0,0 +1,228 @@
+import hashlib
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import pandas as pd
+import requests
+from atomic_files import read_json, update_json, write_json
+from instrumentation import run_in_context
+from strava_api import iter_club_activity_pages, rate_budget, RateLimitExhausted
+
+MAX_WORKERS = 4
+MIN_REQUEST_INTERVAL = 0.5  # seconds between two request starts, shared by all workers
+MAX_CLUB_MEMBERS = 300
+HIGH_WATER_MARK_FILE = 'data/club_high_water_marks.json'
+FETCH_LOG_FILE = 'data/fetch_log.json'
+WORKER_STATUS_FILE = 'data/ingest_worker.json'
+HIGH_WATER_MARK_SIZE = 5  # newest activities remembered per club
+FULL_PAGE_SIZE = 200  # first sync of a club
+INCREMENTAL_PAGE_SIZE = 30  # clubs with a high-water mark usually only need the first page
+MIN_REFRESH_INTERVAL = timedelta(hours=6)
+MIN_ACTIVITY_RATE = 0.5  # activities per day assumed for clubs without history
+
+@dataclass
+class ClubFetchResult:
+    club_id: int
+    club_name: str
+    activities: Optional[List[Dict[str, Any]]] = None
+    high_water_mark: Optional[List[str]] = None
+    skipped: Optional[str] = None
+    deferred: bool = False
+    error: Optional[str] = None
+    elapsed: float = 0.0
+
+class RequestThrottle:
+    """Spaces out request starts across threads so a parallel fetch stays under Strava's rate limits."""
+
+    def __init__(self, min_interval: float = MIN_REQUEST_INTERVAL):
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.min_interval
+        if slot > now:
+            time.sleep(slot - now)
+
+def activity_fingerprint(activity: Dict[str, Any]) -> str:
+    """Stable identifier for a club activity; the club feed exposes neither an id nor a start date."""
+    athlete = activity.get('athlete') or {}
+    key = [athlete.get('firstname'), athlete.get('lastname'), activity.get('name'), activity.get('distance'),
+           activity.get('moving_time'), activity.get('elapsed_time'), activity.get('sport_type')]
+    return hashlib.sha1(json.dumps(key, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+def load_high_water_marks() -> Dict[str, List[str]]:
+    return read_json(HIGH_WATER_MARK_FILE, {})
+
+def update_high_water_marks(marks: Dict[int, List[str]]):
+    def merge(stored):
+        for club_id, mark in marks.items():
+            if mark:
+                stored[str(club_id)] = mark
+        return stored
+    update_json(HIGH_WATER_MARK_FILE, merge, {})
+
+def load_fetch_log() -> Dict[str, str]:
+    return read_json(FETCH_LOG_FILE, {})
+
+def get_last_fetch_time(club_id) -> datetime:
+    return datetime.fromisoformat(load_fetch_log().get(str(club_id), '2000-01-01T00:00:00'))
+
+def update_fetch_log(*club_ids):
+    now = datetime.now().isoformat()
+    def merge(log):
+        for club_id in club_ids:
+            log[str(club_id)] = now
+        return log
+    update_json(FETCH_LOG_FILE, merge, {})
+
+def load_worker_status() -> Dict[str, Any]:
+    """Heartbeat written by ingest_worker after each run, empty if the worker never ran."""
+    return read_json(WORKER_STATUS_FILE, {})
+
+def save_worker_status(status: Dict[str, Any]):
+    write_json(WORKER_STATUS_FILE, status)
+
+def worker_is_active(status: Dict[str, Any], now: Optional[datetime] = None) -> bool:
+    """True when the ingestion worker has run within two of its intervals, so the dashboard can leave fetching to it."""
+    if not status.get('last_run'):
+        return False
+    now = now or datetime.now()
+    return now - datetime.fromisoformat(status['last_run']) < timedelta(seconds=2 * status.get('interval', 0))
+
+def estimate_activity_rates(activities_df: pd.DataFrame) -> Dict[int, float]:
+    """Average number of new activities per day for each club, over the span of its fetch history."""
+    if activities_df.empty or 'club_id' not in activities_df.columns:
+        return {}
+    upload_dates = pd.to_datetime(activities_df['upload_date'])
+    per_club = upload_dates.groupby(activities_df['club_id']).agg(['count', 'min', 'max'])
+    days = ((per_club['max'] - per_club['min']).dt.total_seconds() / 86400).clip(lower=1)
+    return (per_club['count'] / days).to_dict()
+
+def schedule_clubs(clubs: List[Dict[str, Any]], last_fetch_times: Dict[int, datetime], activity_rates: Dict[int, float],
+                   now: Optional[datetime] = None) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    Order clubs for refresh so the request budget goes to the clubs with the most missed activities.
+
+    A club's priority is its staleness in days times its activity rate, i.e. the expected
+    number of activities posted since it was last fetched. Clubs fetched less than
+    MIN_REFRESH_INTERVAL ago are not due.
+
+    Args:
+        clubs (List[Dict[str, Any]]): club summaries with at least 'id' and 'name'
+        last_fetch_times (Dict[int, datetime]): last successful fetch per club id
+        activity_rates (Dict[int, float]): activities per day per club id
+        now (Optional[datetime]): reference time, defaults to datetime.now()
+
+    Returns:
+        Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]: (due clubs by descending priority, clubs not due yet)
+    """
+    now = now or datetime.now()
+    due, recent = [], []
+    for club in clubs:
+        staleness = now - last_fetch_times.get(club['id'], datetime.min)
+        (recent if staleness < MIN_REFRESH_INTERVAL else due).append(club)
+    def priority(club):
+        staleness_days = (now - last_fetch_times.get(club['id'], datetime.min)).total_seconds() / 86400
+        return staleness_days * max(activity_rates.get(club['id'], 0.0), MIN_ACTIVITY_RATE)
+    due.sort(key=priority, reverse=True)
+    return due, recent
+
+def fetch_new_club_activities(access_token: str, club_id: int, high_water_mark: Optional[List[str]], throttle: RequestThrottle) -> List[Dict[str, Any]]:
+    """
+    Page through a club's feed (newest first) and stop at the first activity already seen.
+
+    Args:
+        access_token (str): Strava access token
+        club_id (int): club to fetch
+        high_water_mark (Optional[List[str]]): fingerprints of the newest activities from the previous sync
+        throttle (RequestThrottle): shared throttle applied before every page request
+
+    Returns:
+        List[Dict[str, Any]]: activities newer than the high-water mark, newest first
+    """
+    seen = set(high_water_mark or [])
+    per_page = INCREMENTAL_PAGE_SIZE if seen else FULL_PAGE_SIZE
+    new_activities = []
+    pages = iter_club_activity_pages(access_token, club_id, per_page=per_page)
+    while True:
+        throttle.wait()
+        page = next(pages, None)
+        if page is None:
+            return new_activities
+        for activity in page:
+            if activity_fingerprint(activity) in seen:
+                return new_activities
+            new_activities.append(activity)
+
+def fetch_club(access_token: str, club: Dict[str, Any], high_water_mark: Optional[List[str]], throttle: RequestThrottle, abort: threading.Event) -> ClubFetchResult:
+    result = ClubFetchResult(club_id=club['id'], club_name=club['name'])
+    # member_count comes with the club summary, so eligibility costs no request
+    if (club.get('member_count') or 0) > MAX_CLUB_MEMBERS:
+        result.skipped = f"it has more than {MAX_CLUB_MEMBERS} members"
+        return result
+    if abort.is_set():
+        result.deferred = True
+        return result
+    start = time.monotonic()
+    try:
+        result.activities = fetch_new_club_activities(access_token, result.club_id, high_water_mark, throttle)
+        # Topped up with the previous mark so it never shrinks: the newest activities are the
+        # likeliest to be renamed or deleted, and a mark that matches nothing pages the whole feed
+        result.high_water_mark = ([activity_fingerprint(a) for a in result.activities]
+                                  + (high_water_mark or []))[:HIGH_WATER_MARK_SIZE]
+    except RateLimitExhausted:
+        # Leave this club and every club not started yet for the next quota window
+        abort.set()
+        result.deferred = True
+    except requests.HTTPError as e:
+        result.error = f"status code {e.response.status_code}"
+    except requests.RequestException as e:
+        result.error = str(e)
+    finally:
+        result.elapsed = time.monotonic() - start
+    return result
+
+def _fetch_club_in_background(*args) -> ClubFetchResult:
+    with rate_budget.background():
+        return fetch_club(*args)
+
+def fetch_clubs(access_token: str, clubs: List[Dict[str, Any]], max_workers: int = MAX_WORKERS,
+                min_request_interval: float = MIN_REQUEST_INTERVAL) -> Iterator[ClubFetchResult]:
+    """
+    Fetch new activities for several clubs in parallel on a bounded thread pool.
+
+    Results are yielded as each club completes so the caller can report progress.
+    Workers never call Streamlit; all UI updates stay on the calling thread.
+    Clubs are started in the given order, so pass them through schedule_clubs first.
+    Requests draw on the shared rate_budget in background mode: they pause while the
+    15-minute window resets, and once the budget cannot recover within its max wait
+    the remaining clubs come back as deferred rather than failed.
+    Each club is fetched incrementally against its stored high-water mark; the caller
+    persists the new marks with update_high_water_marks once the results are merged.
+
+    Args:
+        access_token (str): Strava access token
+        clubs (List[Dict[str, Any]]): club summaries with at least 'id', 'name' and 'member_count'
+        max_workers (int): number of clubs fetched at the same time
+        min_request_interval (float): seconds between two request starts across all workers
+
+    Yields:
+        ClubFetchResult: one result per club, in completion order
+    """
+    throttle = RequestThrottle(min_request_interval)
+    abort = threading.Event()
+    marks = load_high_water_marks()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # Worker spans land in the caller's trace when one is active
+        fetch_club_task = run_in_context(_fetch_club_in_background)
+        futures = [executor.submit(fetch_club_task, access_token, club, marks.get(str(club['id'])), throttle, abort) for club in clubs]
+        for future in as_completed(futures):
+            yield future.result()
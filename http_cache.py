@@ -0,0 +1,169 @@
+"""
+Disk-backed cache of Strava GET responses, shared by every session, process and restart.
+
+Entries are keyed on the resource rather than on the access token: club members and
+club activity pages are the same for every member of a club, so one user's fetch serves
+the next. Athlete-scoped endpoints (/athlete, /athlete/clubs, stats, ...) are keyed on a
+hash of the token as well, so they never leak between users. Each endpoint has its own
+time to live; once it expires, the stored ETag is sent as If-None-Match and a 304 renews
+the entry without downloading it again. The cache is bounded in size and evicts the least
+recently used entries. Identical requests already in flight from other sessions or threads
+are not sent again; they share the first request's response.
+"""
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit
+import requests
+from requests.structures import CaseInsensitiveDict
+
+CACHE_PATH = os.getenv('STRAVA_HTTP_CACHE', 'data/http_cache.db')
+MAX_CACHE_BYTES = 64 * 1024 * 1024
+# (path pattern, seconds to live, shared between users); unmatched GETs are not cached
+CACHE_POLICIES = [
+    (re.compile(r'/api/v3/clubs/\d+/members$'), 24 * 3600, True),
+    (re.compile(r'/api/v3/clubs/\d+/activities$'), 10 * 60, True),
+    (re.compile(r'/api/v3/athlete$'), 3600, False),
+    (re.compile(r'/api/v3/athlete/clubs$'), 3600, False),
+    (re.compile(r'/api/v3/athletes/\d+/stats$'), 3600, False),
+    (re.compile(r'/api/v3/activities/following$'), 3600, False),
+]
+STORED_HEADERS = ['Content-Type', 'ETag']  # rate-limit headers are never replayed from the cache
+
+class ResponseCache:
+    """
+    SQLite-backed response store; each thread uses its own connection.
+
+    Args:
+        path (str): cache database file
+        max_bytes (int): total body size above which the least recently used entries are evicted
+    """
+
+    def __init__(self, path: str = CACHE_PATH, max_bytes: int = MAX_CACHE_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.path != self.path:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            with conn:
+                conn.execute('CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, url TEXT, headers TEXT, '
+                             'body BLOB, etag TEXT, expires_at REAL, last_access REAL, size INTEGER)')
+                conn.execute('CREATE INDEX IF NOT EXISTS idx_responses_last_access ON responses (last_access)')
+            self._local.conn, self._local.path = conn, self.path
+        return conn
+
+    @staticmethod
+    def policy(url: str) -> Optional[Tuple[int, bool]]:
+        """(ttl, shared) for a cacheable URL, None otherwise."""
+        path = urlsplit(url).path
+        for pattern, ttl, shared in CACHE_POLICIES:
+            if pattern.search(path):
+                return ttl, shared
+        return None
+
+    @staticmethod
+    def key(url: str, shared: bool, authorization: Optional[str]) -> str:
+        parts = urlsplit(url)
+        resource = f'{parts.path}?{urlencode(sorted(parse_qsl(parts.query)))}'
+        if shared:
+            return resource
+        scope = hashlib.sha256((authorization or '').encode('utf-8')).hexdigest()[:16]
+        return f'{scope}:{resource}'
+
+    def get(self, key: str) -> Optional[Dict]:
+        row = self._connect().execute('SELECT url, headers, body, etag, expires_at FROM responses WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        url, headers, body, etag, expires_at = row
+        return {'url': url, 'headers': json.loads(headers), 'body': body, 'etag': etag, 'expires_at': expires_at}
+
+    def put(self, key: str, response: requests.Response, ttl: int):
+        headers = {name: response.headers[name] for name in STORED_HEADERS if name in response.headers}
+        now = time.time()
+        conn = self._connect()
+        with conn:
+            conn.execute('INSERT OR REPLACE INTO responses (key, url, headers, body, etag, expires_at, last_access, size) '
+                         'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                         (key, response.url, json.dumps(headers), response.content, response.headers.get('ETag'),
+                          now + ttl, now, len(response.content)))
+            self._evict(conn)
+
+    def touch(self, key: str, ttl: Optional[int] = None):
+        """Mark an entry as used, and renew its expiry when ttl is given (after a 304)."""
+        now = time.time()
+        conn = self._connect()
+        with conn:
+            if ttl is None:
+                conn.execute('UPDATE responses SET last_access = ? WHERE key = ?', (now, key))
+            else:
+                conn.execute('UPDATE responses SET last_access = ?, expires_at = ? WHERE key = ?', (now, now + ttl, key))
+
+    def _evict(self, conn: sqlite3.Connection):
+        total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        excess = total - self.max_bytes
+        freed = 0
+        stale_keys = []
+        for key, size in conn.execute('SELECT key, size FROM responses ORDER BY last_access'):
+            stale_keys.append((key,))
+            freed += size
+            if freed >= excess:
+                break
+        conn.executemany('DELETE FROM responses WHERE key = ?', stale_keys)
+
+    def clear(self):
+        conn = self._connect()
+        with conn:
+            conn.execute('DELETE FROM responses')
+
+    @staticmethod
+    def to_response(entry: Dict, status: str) -> requests.Response:
+        """Rebuild a 200 response from a cache entry; X-Cache tells callers where it came from."""
+        response = requests.Response()
+        response.status_code = 200
+        response.url = entry['url']
+        response._content = entry['body']
+        response.headers = CaseInsensitiveDict({**entry['headers'], 'X-Cache': status})
+        response.encoding = 'utf-8'
+        return response
+
+class SingleFlight:
+    """Collapses concurrent calls with the same key into one: later callers wait for the first caller's result."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, Future] = {}
+
+    def do(self, key: str, func: Callable[[], Any]) -> Any:
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+        if not leader:
+            return future.result()
+        try:
+            result = func()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+response_cache = ResponseCache()
+in_flight = SingleFlight()
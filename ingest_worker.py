@@ -0,0 +1,116 @@
+"""
+Headless ingestion worker: keeps the activity register up to date outside of the dashboard.
+
+For every athlete who authorized the app, it refreshes their access token, lists their
+clubs and fetches new club activities with the same engine as the dashboard. Each club
+is checkpointed as soon as it completes (register, high-water mark, fetch log), so an
+interrupted run resumes where it stopped. While the worker is running, the dashboard
+hides its fetch button and only reads the register.
+
+Run once (e.g. from cron, passing the cron period) or as a long-running loop:
+    python ingest_worker.py --once --interval 1800
+    python ingest_worker.py --interval 3600
+"""
+import argparse
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Tuple
+import requests
+from dotenv import load_dotenv
+from club_index import get_athlete_clubs_indexed
+from data_processing import process_activities
+from fetch_engine import ClubFetchResult, fetch_clubs, get_last_fetch_time, save_worker_status, schedule_clubs
+from ingestion import commit_clubs
+from strava_api import rate_budget
+from token_store import get_access_token, load_tokens
+
+DEFAULT_INTERVAL = 3600  # seconds between two runs in loop mode
+
+logger = logging.getLogger('ingest_worker')
+
+def collect_clubs(client_id: str, client_secret: str) -> List[Tuple[str, List[Dict[str, Any]]]]:
+    """
+    Clubs to refresh, grouped by the access token used to read them.
+
+    A club shared by several athletes is only fetched once, with the first athlete's token.
+    Athletes whose token cannot be refreshed are logged and skipped.
+    """
+    seen_clubs = set()
+    clubs_by_token = []
+    for athlete_id in load_tokens():
+        try:
+            access_token = get_access_token(athlete_id, client_id, client_secret)
+            clubs = get_athlete_clubs_indexed(access_token, athlete_id)
+        except requests.RequestException as e:
+            logger.warning("Skipping athlete %s: %s", athlete_id, e)
+            continue
+        new_clubs = [club for club in clubs if club['id'] not in seen_clubs]
+        seen_clubs.update(club['id'] for club in new_clubs)
+        if new_clubs:
+            clubs_by_token.append((access_token, new_clubs))
+    return clubs_by_token
+
+def checkpoint(result: ClubFetchResult) -> int:
+    """Persist one completed club and return the number of new activities in the register."""
+    if result.skipped:
+        logger.info("Skipped %s as %s", result.club_name, result.skipped)
+        return 0
+    if result.deferred:
+        logger.info("Deferred %s until the Strava rate limit resets", result.club_name)
+        return 0
+    if result.error:
+        logger.warning("Failed to fetch %s (%s)", result.club_name, result.error)
+        return 0
+    frames = [process_activities(result.activities, result.club_id, result.club_name)] if result.activities else []
+    new_rows = commit_clubs(frames, {result.club_id: result.high_water_mark}, [result.club_id])
+    logger.info("Fetched %s: %d activities, %d new, in %.1fs", result.club_name, len(result.activities), new_rows, result.elapsed)
+    return new_rows
+
+def run_once(client_id: str, client_secret: str, interval: int = DEFAULT_INTERVAL) -> Dict[str, Any]:
+    """Refresh every due club once and record a heartbeat for the dashboard."""
+    started = datetime.now()
+    fetched, new_rows = 0, 0
+    for access_token, clubs in collect_clubs(client_id, client_secret):
+        last_fetch_times = {club['id']: get_last_fetch_time(club['id']) for club in clubs}
+        activity_rates = {club['id']: club.get('activity_rate') or 0.0 for club in clubs}
+        due_clubs, _ = schedule_clubs(clubs, last_fetch_times, activity_rates)
+        for result in fetch_clubs(access_token, due_clubs):
+            new_rows += checkpoint(result)
+            fetched += not (result.skipped or result.deferred or result.error)
+    short_remaining, daily_remaining = rate_budget.remaining()
+    status = {'last_run': started.isoformat(), 'interval': interval, 'clubs_fetched': fetched,
+              'new_activities': new_rows, 'duration': (datetime.now() - started).total_seconds(),
+              'short_remaining': short_remaining, 'daily_remaining': daily_remaining}
+    save_worker_status(status)
+    logger.info("Run complete: %d clubs fetched, %d new activities", fetched, new_rows)
+    return status
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--once', action='store_true', help='run a single pass and exit')
+    parser.add_argument('--interval', type=int, default=None,
+                        help=f'seconds between two passes (default {DEFAULT_INTERVAL}); with --once, the period of '
+                             'the cron job, without which the dashboard does not count on the next pass')
+    args = parser.parse_args()
+    # The heartbeat only promises another pass when one is scheduled
+    interval = args.interval if args.interval is not None else 0 if args.once else DEFAULT_INTERVAL
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    load_dotenv()
+    client_id = os.getenv('STRAVA_CLIENT_ID')
+    client_secret = os.getenv('STRAVA_CLIENT_SECRET')
+    while True:
+        try:
+            run_once(client_id, client_secret, interval)
+        except Exception:
+            if args.once:
+                raise
+            # Keep the daemon alive; whatever was checkpointed stays, the rest is retried next pass
+            logger.exception("Ingestion run failed")
+        if args.once:
+            return
+        time.sleep(interval)
+
+if __name__ == '__main__':
+    main()
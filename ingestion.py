@@ -0,0 +1,91 @@
+"""
+Coordination of concurrent fetches within one server process.
+
+Every Streamlit session runs in its own thread of the same process. Club claims stop
+two sessions from fetching the same club at the same time, and all writes to the
+register and its state files go through one writer thread, applied in submission order.
+Across processes (dashboard and ingestion worker), the store's write transactions and
+the file locks in atomic_files keep the data consistent.
+"""
+import queue
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Iterable, List, Tuple
+import pandas as pd
+from activity_store import read_activities, upsert_activities
+from club_index import update_activity_rates
+from fetch_engine import estimate_activity_rates, update_fetch_log, update_high_water_marks
+from instrumentation import run_in_context
+
+class ClubClaims:
+    """Clubs currently being fetched by a session of this process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._claimed = set()
+
+    def claim(self, clubs: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """Claim every club nobody else is fetching; returns (claimed clubs, clubs busy elsewhere)."""
+        claimed, busy = [], []
+        with self._lock:
+            for club in clubs:
+                if club['id'] in self._claimed:
+                    busy.append(club)
+                else:
+                    self._claimed.add(club['id'])
+                    claimed.append(club)
+        return claimed, busy
+
+    def release(self, club_ids: Iterable[int]):
+        with self._lock:
+            self._claimed.difference_update(club_ids)
+
+class RegisterWriter:
+    """A single background thread applying register writes one at a time, in submission order."""
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def submit(self, func: Callable, *args, **kwargs) -> Future:
+        future = Future()
+        self._queue.put((future, run_in_context(func), args, kwargs))
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='register-writer', daemon=True)
+                self._thread.start()
+        return future
+
+    def _run(self):
+        while True:
+            future, func, args, kwargs = self._queue.get()
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(func(*args, **kwargs))
+                except BaseException as e:
+                    future.set_exception(e)
+
+club_claims = ClubClaims()
+register_writer = RegisterWriter()
+
+def commit_clubs(frames: List[pd.DataFrame], high_water_marks: Dict[int, List[str]], club_ids: List[int]) -> int:
+    """
+    Write the activities of completed clubs, then their high-water marks, fetch times and activity rates.
+
+    The register goes first: a crash before the marks are saved only means refetching
+    activities the store deduplicates.
+
+    Returns:
+        int: number of new activities in the register
+    """
+    new_rows = upsert_activities(pd.concat(frames)) if frames else 0
+    if club_ids:
+        update_high_water_marks(high_water_marks)
+        update_fetch_log(*club_ids)
+        rates = {}
+        for club_id in club_ids:
+            history = read_activities(columns=['club_id', 'upload_date'], club_id=club_id)
+            rates[club_id] = estimate_activity_rates(history).get(club_id, 0.0)
+        update_activity_rates(rates)
+    return new_rows
@@ -0,0 +1,131 @@
+import cProfile
+import contextvars
+import functools
+import io
+import json
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field, asdict
+from typing import Any, Dict, List, Optional
+
+@dataclass
+class Span:
+    name: str
+    category: str
+    start: float  # seconds since the trace started
+    duration: float
+    thread: str
+    attrs: Dict[str, Any] = field(default_factory=dict)
+
+class Trace:
+    """Spans recorded during one dashboard rerun, from the script thread and any worker threads."""
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.spans: List[Span] = []
+        self.profile: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def add(self, span: Span):
+        with self._lock:
+            self.spans.append(span)
+
+    def totals(self) -> Dict[str, float]:
+        """Total seconds per span category."""
+        totals = {}
+        for span in self.spans:
+            totals[span.category] = totals.get(span.category, 0.0) + span.duration
+        return totals
+
+    def to_jsonl(self) -> str:
+        return ''.join(json.dumps(asdict(span), default=str) + '\n' for span in self.spans)
+
+_current_trace = contextvars.ContextVar('current_trace', default=None)
+
+class _NullSpan:
+    def set(self, **attrs):
+        pass
+
+_NULL_SPAN = _NullSpan()
+
+class _ActiveSpan:
+    def __init__(self):
+        self.attrs = {}
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+@contextmanager
+def start_trace(enabled: bool = True):
+    """Record spans for the duration of the block; with enabled=False every span is a no-op."""
+    if not enabled:
+        yield None
+        return
+    trace = Trace()
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+@contextmanager
+def span(name: str, category: str, **attrs):
+    """
+    Time a block as one span of the current trace.
+
+    Outside start_trace() this only costs a context variable lookup. The yielded object's
+    set() attaches attributes discovered inside the block, such as a response status.
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        yield _NULL_SPAN
+        return
+    active = _ActiveSpan()
+    active.attrs.update(attrs)
+    start = time.perf_counter()
+    try:
+        yield active
+    finally:
+        end = time.perf_counter()
+        trace.add(Span(name=name, category=category, start=start - trace.origin, duration=end - start,
+                       thread=threading.current_thread().name, attrs=active.attrs))
+
+def traced(category: str, name: Optional[str] = None):
+    """Decorator recording every call of the function as a span when a trace is active."""
+    def decorator(func):
+        span_name = name or func.__name__
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _current_trace.get() is None:
+                return func(*args, **kwargs)
+            with span(span_name, category):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def run_in_context(func):
+    """Wrap func so it runs in a copy of the caller's context, letting worker threads record into the caller's trace."""
+    context = contextvars.copy_context()
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        return context.copy().run(func, *args, **kwargs)
+    return wrapper
+
+@contextmanager
+def profiled(enabled: bool, trace: Optional[Trace] = None, top: int = 30):
+    """Run the block under cProfile and store the top functions by cumulative time on the trace."""
+    if not enabled:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        if trace is not None:
+            output = io.StringIO()
+            pstats.Stats(profiler, stream=output).sort_stats('cumulative').print_stats(top)
+            trace.profile = output.getvalue()
@@ -1,9 +1,9 @@
+import io
 import time
 import pandas as pd
 import numpy as np
 if not hasattr(np, 'bool8'):
     np.bool8 = np.bool_
-import base64
 import datetime as dt
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
@@ -11,21 +11,25 @@ import os
 from cryptography.fernet import Fernet
 from strava_api import *
 from data_processing import *
-from visualization import *
+from data_access import get_activities
+from query import Query
+from fetch_engine import (fetch_clubs, update_high_water_marks, schedule_clubs, get_last_fetch_time,
+                          update_fetch_log, load_worker_status, worker_is_active)
+from club_index import get_athlete_clubs_indexed, club_index_frame
+from activity_store import count_activities
+from token_store import delete_token, save_token
+from ingestion import club_claims, commit_clubs, register_writer
+from atomic_files import read_json, write_json
+from instrumentation import start_trace, profiled
 import streamlit as st
-from streamlit import components
 #from bokeh.models import ColumnDataSource, HoverTool, Legend
 #from bokeh.plotting import figure
 #from bokeh.models import ColumnDataSource, HoverTool
 #from bokeh.palettes import Spectral10, Turbo256
 #from bokeh.models import Legend, LegendItem
-import colorcet as cc
 import requests
-import matplotlib.pyplot as plt
-import seaborn as sns
 import json
-import plotly
-import hashlib
+# visualization (plotly, colorcet) is imported where the charts are drawn, so the login page never loads it
 
 test_mode = False
 
@@ -56,59 +60,51 @@ if test_mode:
 # Use the decrypted secret in your application
 CLIENT_SECRET = decrypted_secret# Add this function to check the last fetch time
 
+MEDIA_MAX_WIDTH = 1460  # Streamlit's maximum content width; wider images are resized on every rerun
+LAST_SELECTED_CLUB_FILE = 'data/last_selected_club.json'
+
 def powered_by_strava_stream():
     pbs= 'powered by Strava'
     for word in pbs.split(" "):
         yield word + " "
-        time.sleep(0.5)
+
+@st.cache_resource(show_spinner=False)
+def load_media(path: str) -> bytes:
+    """Read a static image once per process, already downsized to the width Streamlit would display it at."""
+    from PIL import Image
+    with open(path, 'rb') as f:
+        data = f.read()
+    image = Image.open(io.BytesIO(data))
+    if image.width <= MEDIA_MAX_WIDTH:
+        return data
+    image_format = image.format
+    image = image.resize((MEDIA_MAX_WIDTH, image.height * MEDIA_MAX_WIDTH // image.width), resample=Image.BILINEAR)
+    output = io.BytesIO()
+    image.save(output, format=image_format, quality=90)
+    return output.getvalue()
 
 def display_strava_disconnect_button():
     with st.sidebar:
 #        st.write("Click the button below to remove Strava authorization")
         if st.button('De-Authorize Strava Access'):
+            access_token = st.session_state.access_token
+            profile = get_athlete_profile(access_token)
             headers = {'Authorization': f'Bearer {access_token}'}
             requests.post(url='https://www.strava.com/oauth/deauthorize',headers = headers, timeout=15)
+            # Without its stored tokens the ingestion worker and history download stop acting for this athlete
+            if profile is not None:
+                delete_token(profile['id'])
+            st.session_state.access_token = None
+            st.rerun()
 
 def save_last_selected_club(club_name):
-    with open('last_selected_club.json', 'w') as f:
-        json.dump({'last_club': club_name}, f)
+    write_json(LAST_SELECTED_CLUB_FILE, {'last_club': club_name})
 
 def load_existing_activities():
-    file_path = 'data/all_club_activities.csv'
-    try:
-        return pd.read_csv(file_path, parse_dates=['upload_date'])
-        #pd.read_csv(file_path, parse_dates=['upload_date'])
-    except FileNotFoundError:
-        return pd.DataFrame()
+    return get_activities()
 
 def load_last_selected_club():
-    try:
-        with open('data/last_selected_club.json', 'r') as f:
-            data = json.load(f)
-        return data.get('last_club')
-    except FileNotFoundError:
-        return None
-
-def get_last_fetch_time(club_id):
-    try:
-        with open('data/fetch_log.json', 'r') as f:
-            log = json.load(f)
-        return datetime.fromisoformat(log.get(str(club_id), '2000-01-01T00:00:00'))
-    except (FileNotFoundError, json.JSONDecodeError):
-        return datetime.fromisoformat('2000-01-01T00:00:00')
-
-# Add this function to update the fetch log
-def update_fetch_log(club_id):
-    try:
-        with open('data/fetch_log.json', 'r') as f:
-            log = json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
-        log = {}
-    
-    log[str(club_id)] = datetime.now().isoformat()
-    
-    with open('data/fetch_log.json', 'w') as f:
-        json.dump(log, f)
+    return read_json(LAST_SELECTED_CLUB_FILE, {}).get('last_club')
 
 def display_athlete_stats():
     stats = get_athlete_stats(st.session_state.access_token)
@@ -134,74 +130,125 @@ def display_friend_activities():
 def display_clubs():
     with st.sidebar:
         st.subheader("Clubs you belong to")
-        clubs = get_athlete_clubs(st.session_state.access_token)
+        clubs = None
+        profile = get_athlete_profile(st.session_state.access_token)
+        if profile is not None:
+            try:
+                # Listed from Strava at most once a day; member counts and activity rates come with the index
+                clubs = get_athlete_clubs_indexed(st.session_state.access_token, profile['id'])
+            except requests.RequestException as e:
+                st.error(f"Failed to fetch clubs: {str(e)}")
         if clubs:
-            st.session_state.clubs_df = pd.DataFrame(clubs)
-            st.dataframe(st.session_state.clubs_df[['id', 'name', 'sport_type']], hide_index=True)
+            st.session_state.clubs = clubs
+            st.session_state.clubs_df = club_index_frame(clubs)
+            st.dataframe(st.session_state.clubs_df[['id', 'name', 'sport_type', 'member_count']], hide_index=True)
         else:
             st.warning("No clubs found or unable to retrieve them.")
 
-def display_club_stats(selected_club, all_activities_df):
+def display_club_stats(selected_club):
     st.subheader(f"Stats for {selected_club}")
-    club_activities = all_activities_df[all_activities_df['club_name'] == selected_club]
-    if not club_activities.empty:
-        st.write(f"Total activities: {len(club_activities)}")
-        st.write(f"Total distance: {int(club_activities['distance'].sum())} km")
-        st.write(f"Total moving time: {int(club_activities['moving_time'].sum())} hours")
-        unique_contributors = club_activities[['firstname', 'lastname']].drop_duplicates()
-        num_unique_contributors = len(unique_contributors)
+    contributors = (Query('rollup').where(club_name=selected_club).group_by('firstname', 'lastname')
+                    .agg(activity_count=('activity_count', 'sum'), distance=('distance_sum', 'sum'),
+                         moving_time=('moving_time_sum', 'sum'))
+                    .collect())
+    if not contributors.empty:
+        st.write(f"Total activities: {int(contributors['activity_count'].sum())}")
+        st.write(f"Total distance: {int(contributors['distance'].sum())} km")
+        st.write(f"Total moving time: {int(contributors['moving_time'].sum())} hours")
+        num_unique_contributors = len(contributors)
         st.write(f"performed by: {num_unique_contributors} different members")
     else:
         st.write("No activities found for this club.")
 
 def display_club_activities(selected_club, clubs_df):
-    get_athlete_info(st.session_state.access_token)
     selected_club_id = clubs_df[clubs_df['name'] == selected_club]['id'].values[0]
-    # Load existing activities
-    all_activities_df = pd.read_csv('data/all_club_activities.csv', parse_dates=['upload_date'])
-    if 'club_id' not in all_activities_df.columns:
-        st.warning("No club activities found. Please fetch activities first.")
-        return
-    # Filter activities for the selected club
-    df = all_activities_df[all_activities_df['club_id'] == selected_club_id].copy()
-    if df.empty:
+    # Only the upload dates of the selected club are read
+    extent = (Query('activities').where(club_id=selected_club_id)
+              .agg(activity_count=('upload_date', 'size'), first=('upload_date', 'min'), last=('upload_date', 'max'))
+              .collect().iloc[0])
+    if extent['activity_count'] == 0:
         st.warning("No activities found for this club. Please fetch activities first.")
         return
-    st.write(f"Showing details for {selected_club}. Total activities: {len(df)}")
-    # Get min and max dates
-    with st.sidebar:
-        min_date = df['upload_date'].min().date()
-        max_date = df['upload_date'].max().date()
-    # Ensure min_date and max_date are different
-        if min_date == max_date:
-            min_date = min_date - timedelta(days=1)
-            max_date = max_date + timedelta(days=1)
-        # Create the slider
-        # Calculate a default range (e.g., last 30 days)
-        default_end = max_date
-        default_start = max(min_date, default_end - timedelta(days=30))
-        date_range = st.slider(
-            "Select date range",
-            min_value=min_date,
-            max_value=max_date,
-            value=(default_start, default_end),
-            format="YYYY-MM-DD"
-        )
-        # Filter data based on selected date range
-        mask = (df['upload_date'].dt.date >= date_range[0]) & (df['upload_date'].dt.date <= date_range[1])
-        filtered_df = df.loc[mask]
+    st.write(f"Showing details for {selected_club}. Total activities: {extent['activity_count']}")
     # Get user information
     #    user_firstname = st.text_input("Enter your first name")
     #    user_lastname_initial = st.text_input("Enter your last name initial")'''
-    # Create and display plot
     athlete_firstname, athlete_lastname = get_athlete_info(st.session_state.access_token)
+    display_activity_range(int(selected_club_id), extent['first'].date(), extent['last'].date(),
+                           athlete_firstname, athlete_lastname)
+
+@st.fragment
+def display_activity_range(club_id, min_date, max_date, athlete_firstname, athlete_lastname):
+    """
+    Date range slider with the activity plots and summary statistics of the selected range.
+
+    Moving the slider reruns this fragment alone. Everything it reads is passed in by the
+    full run that rendered it, so the rest of the dashboard is left untouched.
+    """
+    from visualization import display_summary_statistics, get_activity_plots
+    # Ensure min_date and max_date are different
+    if min_date == max_date:
+        min_date = min_date - timedelta(days=1)
+        max_date = max_date + timedelta(days=1)
+    # Create the slider
+    # Calculate a default range (e.g., last 30 days)
+    default_end = max_date
+    default_start = max(min_date, default_end - timedelta(days=30))
+    # A fragment cannot draw into the sidebar, so the slider sits above the plots it filters
+    date_range = st.slider(
+        "Select date range",
+        min_value=min_date,
+        max_value=max_date,
+        value=(default_start, default_end),
+        format="YYYY-MM-DD"
+    )
+    # Create and display plot
     if athlete_firstname and athlete_lastname:
-        fig = create_activity_plots(filtered_df, athlete_firstname, athlete_lastname)  # Using first letter of lastname
-        st.pyplot(fig)
-        display_summary_statistics(filtered_df)
+        # Filtered to the selected date range and cached per dataset version, club and range
+        fig = get_activity_plots(club_id, date_range[0], date_range[1], athlete_firstname, athlete_lastname)  # Using first letter of lastname
+        st.plotly_chart(fig, use_container_width=True)
+        display_summary_statistics(club_id, date_range[0], date_range[1])
     else:
         st.error("Failed to retrieve athlete information.")
 
+@st.fragment
+def display_palmares_on_request(selected_club):
+    """'Display Palmares' button; a click reruns only this fragment to show the club's Halls of Fame."""
+    from visualization import display_palmares
+    if st.button('Display Palmares'):
+        display_palmares(selected_club)
+
+def fetch_and_store_clubs(clubs):
+    """Fetch the due clubs among those claimed by this session and queue one register write for all of them."""
+    # Fetch times are read after claiming, so clubs another session has just stored are no longer due
+    last_fetch_times = {club['id']: get_last_fetch_time(club['id']) for club in clubs}
+    # Stalest, busiest clubs first so the rate-limit budget buys the most new data
+    activity_rates = {club['id']: club.get('activity_rate') or 0.0 for club in clubs}
+    due_clubs, recent_clubs = schedule_clubs(clubs, last_fetch_times, activity_rates)
+    for club in recent_clubs:
+        st.info(f"Skipping {club['name']} as it was fetched less than 6 hours ago.")
+    new_frames = []
+    fetched_club_ids = []
+    high_water_marks = {}
+    if due_clubs:
+        progress = st.progress(0.0, text=f"Fetching {len(due_clubs)} clubs...")
+        for done, result in enumerate(fetch_clubs(st.session_state.access_token, due_clubs), start=1):
+            progress.progress(done / len(due_clubs), text=f"Fetched {done}/{len(due_clubs)} clubs")
+            if result.skipped:
+                st.warning(f"Skipping {result.club_name} as {result.skipped}.")
+            elif result.deferred:
+                st.info(f"Deferred {result.club_name} until the Strava rate limit resets.")
+            elif result.error:
+                st.warning(f"Failed to retrieve activities for {result.club_name} ({result.error}).")
+            else:
+                new_frames.append(process_activities(result.activities, result.club_id, result.club_name))
+                fetched_club_ids.append(result.club_id)
+                high_water_marks[result.club_id] = result.high_water_mark
+                st.success(f"Retrieved {len(result.activities)} new activities for {result.club_name} in {result.elapsed:.1f}s")
+    if fetched_club_ids:
+        # Merge every club into the register in a single write, serialized with the other sessions' writes
+        register_writer.submit(commit_clubs, new_frames, high_water_marks, fetched_club_ids).result()
+
 def get_latest_fetch_date(filename):
     """
     Finds the latest date from a json.file, and returns it in 'ddd mmm yyyy' format.
@@ -231,7 +278,7 @@ def get_latest_fetch_date(filename):
     except Exception as e:
         return f"An unexpected error occurred: {str(e)}"
 
-def main():
+def render_dashboard():
     GA_TRACKING_ID = 'G-57FFY9GS5T'
     # Inject Google Analytics tracking code into the Streamlit app
     st.markdown(f"""
@@ -245,8 +292,8 @@ def main():
         """, unsafe_allow_html=True)
     st.title('Metrics on my and clubs activities')
     st.write_stream(powered_by_strava_stream)
-    st.logo(image='media/api_logo_pwrdBy_strava_horiz_gray.png',link='https://strava.com', icon_image='media/api_logo_pwrdBy_strava_stack_gray.png')
-    st.image('media/3_Men_photos.jpg', caption=None)
+    st.logo(image=load_media('media/api_logo_pwrdBy_strava_horiz_gray.png'),link='https://strava.com', icon_image=load_media('media/api_logo_pwrdBy_strava_stack_gray.png'))
+    st.image(load_media('media/3_Men_photos.jpg'), caption=None)
     if 'access_token' not in st.session_state:
         st.session_state.access_token = None
     if 'selected_club' not in st.session_state:
@@ -256,82 +303,101 @@ def main():
         token_response = exchange_code_for_token(CLIENT_ID, CLIENT_SECRET, code)
         if 'access_token' in token_response:
             st.session_state.access_token = token_response['access_token']
+            # Keep the refresh token so ingest_worker can fetch for this athlete while nobody is logged in
+            save_token(token_response)
             st.success("Successfully authorized!")
-            display_strava_disconnect_button()
         else:
             st.error(f"Failed to obtain access token. Error: {token_response.get('error', 'Unknown error')}")
         del st.query_params['code']
     if st.session_state.access_token:
+        from visualization import display_club_details_with_plotly, display_training_load
+        # Shown on every rerun while logged in, so a click on the next rerun is handled
+        display_strava_disconnect_button()
         display_athlete_stats()
+        profile = get_athlete_profile(st.session_state.access_token)
+        if profile is not None:
+            display_training_load(profile['id'])
         st.markdown('---')
 #        display_athlete_stats_extended()
 #        display_friend_activities()
         display_clubs()
-         # Get athlete info
-        get_athlete_info(st.session_state.access_token) # get_athlete_info(st.session_state.access_token)
-        # Load existing activities
-        #all_activities_df = load_existing_activities()
-        all_activities_df = pd.read_csv('data/all_club_activities.csv', parse_dates=['upload_date'])
+        worker_status = load_worker_status()
         with st.sidebar:
         # Add a button to trigger fetching
         #    last_fetch_date=get_latest_fetch_date(fetch_log)
         #    print(f"Data last refreshed on: {last_fetch_date}")
-            if st.button('Fetch New Activities'):
+            if worker_is_active(worker_status):
+                # The ingestion worker owns fetching; the dashboard only reads the register
+                last_run = datetime.fromisoformat(worker_status['last_run'])
+                st.caption(f"Activities are refreshed in the background, last run {last_run:%a %b %d %H:%M}")
+            elif st.button('Fetch New Activities'):
         # Fetch and consolidate activities for all clubs
-                all_activities_df = pd.DataFrame()
-                clubs = get_athlete_clubs(st.session_state.access_token)
+                clubs = st.session_state.get('clubs')
                 if clubs:
-                    for club in clubs:
-                        club_id = club['id']
-                        club_name = club['name']
-                        # Check if club has more than 500 members
-                        members = get_club_members(st.session_state.access_token, club_id)
-                        if len(members) > 300:
-                            st.warning(f"Skipping {club_name} as it has more than 300 members.")
-                            continue
-                        # Check if last fetch was more than 24 hours ago
-                        last_fetch_time = get_last_fetch_time(club_id)
-                        if datetime.now() - last_fetch_time < timedelta(hours=6):
-                            st.info(f"Skipping {club_name} as it was fetched less than 6 hours ago.")
-                            continue
-                        new_activities_json = get_club_activities(st.session_state.access_token, club_id, club_name)
-                        if new_activities_json:
-                            new_activities_df = process_activities(new_activities_json, club_id, club_name)
-                            all_activities_df = pd.concat([all_activities_df, new_activities_df])
-                            # Update the register after each successful fetch
-                            all_activities_df = update_activities_register(all_activities_df)
-                            update_fetch_log(club_id)  # Update the fetch log
-                            st.success(f"Retrieved activities for {club_name}")
-                        else:
-                            st.warning(f"Failed to retrieve activities for {club_name}. Stopping further fetches.")
-                            break  # Stop fetching on first error (e.g., 503)
-                    st.success(f"Total unique activities: {len(all_activities_df)}")
+                    # Clubs another session is fetching right now are left to it
+                    clubs, busy_clubs = club_claims.claim(clubs)
+                    for club in busy_clubs:
+                        st.info(f"Skipping {club['name']} as another session is fetching it.")
+                    try:
+                        fetch_and_store_clubs(clubs)
+                    finally:
+                        club_claims.release(club['id'] for club in clubs)
+                    st.success(f"Total unique activities: {count_activities()}")
+                    short_remaining, daily_remaining = rate_budget.remaining()
+                    if short_remaining is not None:
+                        st.caption(f"Strava requests left: {short_remaining} in this 15-minute window, {daily_remaining} today")
 
         # Create a dropdown for club selection
         club_names = st.session_state.clubs_df['name'].tolist()
         default_index = club_names.index(st.session_state.selected_club) if st.session_state.selected_club in club_names else 0
-        # selected_club = st.selectbox("Select a club for detailed view", club_names, index=default_index)
         with st.sidebar:
-            selected_club = st.selectbox("Select a club for detailed view", st.session_state.clubs_df['name'])
-        # club_names, index=default_index) 
+            # Opens on the club selected last, restored from LAST_SELECTED_CLUB_FILE in a new session
+            selected_club = st.selectbox("Select a club for detailed view", club_names, index=default_index)
         if selected_club:
             st.session_state.selected_club = selected_club
             save_last_selected_club(selected_club)
             display_club_details_with_plotly(selected_club)
             display_club_activities(selected_club, st.session_state.clubs_df)
             # Display stats for the selected club using existing data
-            display_club_stats(selected_club, all_activities_df)
-        # Button to display palmares
-        with st.sidebar:
-            if st.button('Display Palmares'):
-                club_activities = all_activities_df[all_activities_df['club_name'] == selected_club]
-                display_palmares(club_activities)
+            display_club_stats(selected_club)
+            # Button to display palmares
+            display_palmares_on_request(selected_club)
     #            display_palmares(filtered_df)
     else:
         st.write("Click the button below to authorize this app to access your Strava data.")
         if st.button('Authorize Strava Access'):
             auth_url = create_strava_auth_url(CLIENT_ID, STRAVA_REDIRECT_URI)
             st.link_button("Authorize", auth_url, use_container_width=False, type="primary")
-            st.image('media/btn_strava_connectwith_orange.png', caption = None)
+            st.image(load_media('media/btn_strava_connectwith_orange.png'), caption = None)
+
+def display_debug_panel(trace):
+    """Sidebar panel with the spans recorded during this rerun, a JSON lines export and the optional profile."""
+    with st.sidebar.expander("Debug timings"):
+        st.toggle("Record timings", key='debug_timings')
+        if st.button("Profile next rerun"):
+            st.session_state.profile_next_rerun = True
+            st.rerun()
+        if trace is None:
+            return
+        if trace.spans:
+            spans_df = pd.DataFrame([{'category': s.category, 'name': s.name, 'ms': round(s.duration * 1000, 1),
+                                      'start_ms': round(s.start * 1000, 1), 'thread': s.thread, **s.attrs}
+                                     for s in trace.spans])
+            totals = {category: round(seconds * 1000, 1) for category, seconds in trace.totals().items()}
+            st.write("Total ms per phase:", totals)
+            st.dataframe(spans_df, hide_index=True)
+            st.download_button("Download trace (JSONL)", trace.to_jsonl(), file_name='trace.jsonl', mime='application/jsonl')
+        if trace.profile:
+            st.text(trace.profile)
+
+def main():
+    # Timings are only recorded while the debug toggle is on, so a normal rerun pays nothing
+    debug = st.session_state.get('debug_timings', False)
+    profile = st.session_state.pop('profile_next_rerun', False)
+    with start_trace(enabled=debug or profile) as trace:
+        with profiled(profile, trace):
+            render_dashboard()
+    display_debug_panel(trace)
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,222 @@
+"""
+Lazy queries over the activity register and the rollup cube: filter, group, aggregate, top-k.
+
+A Query only records its steps; collect() runs them. The scan reads from the store only
+the columns the later steps use, and only the selected club's rows. It is kept per data
+version, sorted by date when the query has a date range, so that the range is a
+binary-search slice of it. Every later stage is cached on the plan up to that stage, so
+a widget that changes the last step (e.g. k of a top-k) re-runs that step alone, on the
+cached result of the steps before.
+
+An aggregation over every club can run on a process pool: each worker scans and
+aggregates one club, and the partial aggregates are merged in the calling process.
+
+    Query('rollup').where(club_name='Club', sport_types=['Run']).group_by('firstname', 'lastname') \\
+        .agg(distance=('distance_sum', 'sum')).top(10, by='distance').collect()
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, replace
+from datetime import date
+from typing import Any, Dict, Optional, Tuple
+import pandas as pd
+import streamlit as st
+from activity_store import club_ids, data_version, read_activities, read_rollup
+from data_access import date_slice
+from data_processing import named_athletes
+from instrumentation import traced
+
+# Source -> date column the scan is sorted on
+SOURCES = {'activities': 'upload_date', 'rollup': 'day'}
+FILTERS = ['club_id', 'club_name', 'sport_types', 'start', 'end', 'named_only']
+AGGREGATIONS = ['sum', 'count', 'size', 'mean', 'min', 'max', 'nunique']
+# How partial aggregates of several partitions combine; mean is carried as a sum and a count
+MERGES = {'sum': 'sum', 'count': 'sum', 'size': 'sum', 'min': 'min', 'max': 'max'}
+QUERY_WORKERS = os.cpu_count() or 2
+
+@dataclass(frozen=True)
+class Query:
+    """
+    Immutable query plan; every builder method returns a new plan.
+
+    Args:
+        source (str): 'activities' (the register) or 'rollup' (the daily rollup cube)
+    """
+    source: str
+    filters: Tuple[Tuple[str, Any], ...] = ()
+    columns: Tuple[str, ...] = ()
+    keys: Tuple[str, ...] = ()
+    aggregates: Tuple[Tuple[str, str, str], ...] = ()
+    order: Optional[Tuple[str, bool]] = None
+    limit: Optional[int] = None
+
+    def __post_init__(self):
+        if self.source not in SOURCES:
+            raise ValueError(f"Unknown query source: {self.source}")
+
+    def where(self, club_id: Optional[int] = None, club_name: Optional[str] = None, sport_types=None,
+              start: Optional[date] = None, end: Optional[date] = None, named_only: bool = False) -> 'Query':
+        """Keep the rows of one club, of some sport types, between two days (inclusive), and of named athletes only."""
+        given = dict(club_id=None if club_id is None else int(club_id), club_name=club_name,
+                     sport_types=None if sport_types is None else tuple(sport_types), start=start, end=end,
+                     named_only=named_only or None)
+        filters = {**dict(self.filters), **{name: value for name, value in given.items() if value is not None}}
+        return replace(self, filters=tuple((name, filters[name]) for name in FILTERS if name in filters))
+
+    def select(self, *columns: str) -> 'Query':
+        """Columns of the result when nothing is aggregated."""
+        return replace(self, columns=columns)
+
+    def group_by(self, *keys: str) -> 'Query':
+        return replace(self, keys=keys)
+
+    def agg(self, **aggregates: Tuple[str, str]) -> 'Query':
+        """Named aggregations, output=(column, function) with a function from AGGREGATIONS; per group if grouped."""
+        for column, func in aggregates.values():
+            if func not in AGGREGATIONS:
+                raise ValueError(f"Unsupported aggregation: {func}")
+        return replace(self, aggregates=tuple((output, column, func) for output, (column, func) in aggregates.items()))
+
+    def top(self, k: int, by: str, ascending: bool = False) -> 'Query':
+        """The k first rows by a column, largest first unless ascending."""
+        return replace(self, order=(by, ascending), limit=k)
+
+    def needed_columns(self) -> Tuple[str, ...]:
+        """Columns the scan has to read: those the filters, keys, aggregates and result use."""
+        filters = dict(self.filters)
+        needed = list(self.columns) + list(self.keys) + [column for _, column, _ in self.aggregates]
+        if 'sport_types' in filters:
+            needed.append('sport_type')
+        if 'named_only' in filters:
+            needed.extend(['firstname', 'lastname'])
+        if 'start' in filters or 'end' in filters:
+            needed.append(SOURCES[self.source])
+        if self.order and not self.aggregates:
+            needed.append(self.order[0])
+        return tuple(sorted(set(needed)))
+
+    @traced('query')
+    def collect(self, parallel: bool = False) -> pd.DataFrame:
+        """
+        Run the plan against the current data version.
+
+        The result is shared with later identical queries and must be treated as read-only.
+
+        Args:
+            parallel (bool): aggregate each club in a worker process when the query spans every club; this
+                only pays off when per-club work outweighs shipping partial results between processes
+        """
+        return _top(data_version(), self, parallel)
+
+def _scan_key(query: Query) -> Tuple:
+    filters = dict(query.filters)
+    return query.source, filters.get('club_id'), filters.get('club_name'), query.needed_columns()
+
+@st.cache_resource(max_entries=32, show_spinner=False)
+def _scan(version: int, source: str, club_id: Optional[int], club_name: Optional[str], columns: Tuple[str, ...]) -> pd.DataFrame:
+    # One club (or all clubs), only the needed columns, oldest first for binary-search date ranges
+    reader = read_activities if source == 'activities' else read_rollup
+    df = reader(columns=list(columns), club_id=club_id, club_name=club_name)
+    if SOURCES[source] in df.columns:
+        df = df.sort_values(SOURCES[source], kind='stable', ignore_index=True)
+    return df
+
+def _apply_filters(df: pd.DataFrame, query: Query) -> pd.DataFrame:
+    filters = dict(query.filters)
+    if 'start' in filters or 'end' in filters:
+        df = date_slice(df, SOURCES[query.source], filters.get('start'), filters.get('end'))
+    if 'sport_types' in filters:
+        df = df[df['sport_type'].isin(filters['sport_types'])]
+    if 'named_only' in filters:
+        df = named_athletes(df)
+    return df
+
+@st.cache_resource(max_entries=64, show_spinner=False)
+def _filtered(version: int, scan_key: Tuple, filters: Tuple) -> pd.DataFrame:
+    source, club_id, club_name, columns = scan_key
+    return _apply_filters(_scan(version, source, club_id, club_name, columns), Query(source, filters))
+
+def _named_aggregates(query: Query, partial: bool) -> Dict[str, Tuple[str, str]]:
+    named = {}
+    for output, column, func in query.aggregates:
+        if partial and func == 'mean':
+            named[f'{output}__sum'] = (column, 'sum')
+            named[f'{output}__count'] = (column, 'count')
+        else:
+            named[output] = (column, func)
+    return named
+
+def _aggregate_frame(df: pd.DataFrame, query: Query, partial: bool = False) -> pd.DataFrame:
+    named = _named_aggregates(query, partial)
+    if query.keys:
+        return df.groupby(list(query.keys), sort=False, dropna=False, observed=True).agg(**named).reset_index()
+    return pd.DataFrame({output: [df[column].agg(func) if func != 'size' else len(df)] for output, (column, func) in named.items()})
+
+def _merge_partials(partials, query: Query) -> pd.DataFrame:
+    combined = pd.concat(partials, ignore_index=True)
+    merges = {}
+    for output, _, func in query.aggregates:
+        if func == 'mean':
+            merges[f'{output}__sum'] = 'sum'
+            merges[f'{output}__count'] = 'sum'
+        else:
+            merges[output] = MERGES[func]
+    if query.keys:
+        merged = combined.groupby(list(query.keys), sort=False, dropna=False, observed=True).agg(merges).reset_index()
+    else:
+        merged = combined.agg(merges).to_frame().T
+    for output, _, func in query.aggregates:
+        if func == 'mean':
+            counts = merged.pop(f'{output}__count')
+            merged[output] = merged.pop(f'{output}__sum') / counts.where(counts > 0)
+    return merged[list(query.keys) + [output for output, _, _ in query.aggregates]]
+
+def _aggregate_club(query: Query, club_id: int) -> pd.DataFrame:
+    """Worker process: scan and partially aggregate one club."""
+    filters = dict(query.filters)
+    reader = read_activities if query.source == 'activities' else read_rollup
+    df = reader(columns=list(query.needed_columns()), club_id=club_id, start=filters.get('start'), end=filters.get('end'))
+    return _aggregate_frame(_apply_filters(df, query), query, partial=True)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Spawned, not forked: the Streamlit server process runs many threads
+            _pool = ProcessPoolExecutor(max_workers=QUERY_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+        return _pool
+
+def _can_run_in_parallel(query: Query) -> bool:
+    filters = dict(query.filters)
+    return ('club_id' not in filters and 'club_name' not in filters
+            and all(func in MERGES or func == 'mean' for _, _, func in query.aggregates))
+
+@st.cache_resource(max_entries=64, show_spinner=False)
+def _aggregated(version: int, query: Query, parallel: bool) -> pd.DataFrame:
+    if parallel and _can_run_in_parallel(query):
+        clubs = club_ids()
+        partials = list(_get_pool().map(_aggregate_club, [query] * len(clubs), clubs))
+        if partials:
+            return _merge_partials(partials, query)
+    return _aggregate_frame(_filtered(version, _scan_key(query), query.filters), query)
+
+@st.cache_resource(max_entries=64, show_spinner=False)
+def _top(version: int, query: Query, parallel: bool) -> pd.DataFrame:
+    if query.aggregates:
+        # order and limit do not change what is aggregated, so they share one aggregate
+        df = _aggregated(version, replace(query, order=None, limit=None), parallel)
+    else:
+        df = _filtered(version, _scan_key(query), query.filters)
+        if query.columns:
+            df = df[list(query.columns)]
+    if query.order is not None:
+        by, ascending = query.order
+        if query.limit is not None:
+            return (df.nsmallest if ascending else df.nlargest)(query.limit, by, keep='first').reset_index(drop=True)
+        return df.sort_values(by, ascending=ascending, kind='stable', ignore_index=True)
+    return df
@@ -1,40 +1,288 @@
 import datetime as dt
 from datetime import datetime, timedelta
+import os
+import threading
+import time
+from contextlib import contextmanager
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import streamlit as st
-from typing import Dict, Any, List, Optional
+from instrumentation import span
+from http_cache import in_flight, response_cache
+from typing import Dict, Any, Iterator, List, Optional, Tuple
 
-@st.cache_data(ttl=3600)
-def get_athlete_info(access_token):
+# Overridable so the app and the benchmarks can run against a local stub of the Strava API
+STRAVA_BASE_URL = os.getenv('STRAVA_BASE_URL', 'https://www.strava.com')
+STRAVA_API_URL = f'{STRAVA_BASE_URL}/api/v3'
+REQUEST_TIMEOUT = (5, 30)  # (connect, read) seconds
+POOL_SIZE = 10
+MAX_RETRIES = 3
+RETRY_BACKOFF = 0.5  # seconds, doubled on each retry
+RETRY_JITTER = 0.5  # seconds of random jitter added to each backoff
+RATE_LIMIT_RESERVE = 5  # requests kept back in each window for interactive page views
+MAX_RATE_LIMIT_WAIT = 120  # seconds a call may pause for the 15-minute window to reset
+SHORT_WINDOW = 15 * 60
+DAILY_WINDOW = 24 * 60 * 60
+
+_session = None
+_session_lock = threading.Lock()
+
+class RateLimitExhausted(requests.RequestException):
+    """Raised when the Strava request budget will not reset within the allowed wait."""
+
+class RateLimitBudget:
+    """
+    Tracks Strava's 15-minute and daily request budgets from the X-RateLimit-* and
+    X-ReadRateLimit-* response headers.
+
+    Strava resets the short window on each quarter hour and the daily window at
+    midnight UTC. Requests are counted optimistically when they start so parallel
+    workers do not overshoot; server-reported usage replaces the local count as
+    soon as a response arrives. Calls made inside background() leave `reserve`
+    requests of each window untouched for interactive page views.
+    """
+
+    def __init__(self, max_wait: float = MAX_RATE_LIMIT_WAIT, reserve: int = RATE_LIMIT_RESERVE):
+        self.max_wait = max_wait
+        self.reserve = reserve
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._limits = {}  # header prefix -> (short limit, daily limit)
+        self._usage = {}  # header prefix -> [short usage, daily usage]
+        self._windows = (None, None)
+        self._blocked_until = 0.0
+
+    @contextmanager
+    def background(self):
+        """Apply the interactive reserve to every request made by this thread inside the block."""
+        self._local.background = True
+        try:
+            yield
+        finally:
+            self._local.background = False
+
+    def _roll_windows(self, now: float):
+        windows = (int(now // SHORT_WINDOW), int(now // DAILY_WINDOW))
+        if windows != self._windows:
+            for usage in self._usage.values():
+                if windows[0] != self._windows[0]:
+                    usage[0] = 0
+                if windows[1] != self._windows[1]:
+                    usage[1] = 0
+            self._windows = windows
+
+    def _remaining(self) -> Tuple[Optional[int], Optional[int]]:
+        short = [limit[0] - self._usage[prefix][0] for prefix, limit in self._limits.items()]
+        daily = [limit[1] - self._usage[prefix][1] for prefix, limit in self._limits.items()]
+        return (min(short) if short else None, min(daily) if daily else None)
+
+    def remaining(self) -> Tuple[Optional[int], Optional[int]]:
+        """Requests left in the (15-minute, daily) windows, or None before the first response."""
+        with self._lock:
+            self._roll_windows(time.time())
+            return self._remaining()
+
+    def update(self, response: requests.Response):
+        with self._lock:
+            self._roll_windows(time.time())
+            for prefix in ('X-RateLimit', 'X-ReadRateLimit'):
+                limit = response.headers.get(f'{prefix}-Limit')
+                usage = response.headers.get(f'{prefix}-Usage')
+                if not limit or not usage:
+                    continue
+                try:
+                    short_limit, daily_limit = (int(v) for v in limit.split(','))
+                    short_usage, daily_usage = (int(v) for v in usage.split(','))
+                except ValueError:
+                    continue
+                self._limits[prefix] = (short_limit, daily_limit)
+                local = self._usage.setdefault(prefix, [0, 0])
+                # Requests still in flight are not in the server count yet
+                local[0] = max(local[0], short_usage)
+                local[1] = max(local[1], daily_usage)
+
+    def exhaust(self):
+        """Block new requests until the current 15-minute window resets, e.g. after a 429."""
+        with self._lock:
+            now = time.time()
+            self._blocked_until = now + SHORT_WINDOW - now % SHORT_WINDOW
+
+    def acquire(self):
+        """
+        Reserve one request, pausing until the budget resets when it is used up.
+
+        Raises:
+            RateLimitExhausted: if the reset is further away than max_wait
+        """
+        reserve = self.reserve if getattr(self._local, 'background', False) else 0
+        while True:
+            with self._lock:
+                now = time.time()
+                self._roll_windows(now)
+                short, daily = self._remaining()
+                if now < self._blocked_until:
+                    wait = self._blocked_until - now
+                elif daily is not None and daily <= reserve:
+                    wait = DAILY_WINDOW - now % DAILY_WINDOW
+                elif short is not None and short <= reserve:
+                    wait = SHORT_WINDOW - now % SHORT_WINDOW
+                else:
+                    for usage in self._usage.values():
+                        usage[0] += 1
+                        usage[1] += 1
+                    return
+            if wait > self.max_wait:
+                raise RateLimitExhausted(f"Strava rate limit reached, budget resets in {int(wait)}s")
+            time.sleep(wait + 1)
+
+rate_budget = RateLimitBudget()
+
+class StravaSession(requests.Session):
+    """
+    requests.Session that applies REQUEST_TIMEOUT unless a call passes its own, and
+    keeps every call inside the shared rate_budget: it waits for budget before each
+    request and pauses and retries on a 429 instead of failing.
+
+    GETs of the endpoints listed in http_cache.CACHE_POLICIES are answered from the
+    disk cache while fresh, and revalidated with If-None-Match once expired. Concurrent
+    misses on the same resource share a single upstream request.
+    """
+
+    def request(self, method, url, **kwargs):
+        policy = response_cache.policy(url) if method.upper() == 'GET' and not kwargs.get('params') else None
+        if policy is None:
+            return self._send(method, url, **kwargs)
+        ttl, shared = policy
+        headers = dict(kwargs.pop('headers', None) or {})
+        key = response_cache.key(url, shared, headers.get('Authorization'))
+        entry = response_cache.get(key)
+        if entry is not None and entry['expires_at'] > time.time():
+            response_cache.touch(key)
+            with span(f'{method} {url.split("?")[0]}', 'http', cache='hit'):
+                return response_cache.to_response(entry, 'HIT')
+        return in_flight.do(key, lambda: self._revalidate(method, url, key, entry, ttl, headers, **kwargs))
+
+    def _revalidate(self, method, url, key, entry, ttl, headers, **kwargs):
+        if entry is not None and entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        response = self._send(method, url, headers=headers, **kwargs)
+        if response.status_code == 304 and entry is not None:
+            response_cache.touch(key, ttl)
+            return response_cache.to_response(entry, 'REVALIDATED')
+        # Read the body now: the response may be handed to several waiting threads
+        response.content
+        if response.status_code == 200:
+            response_cache.put(key, response, ttl)
+        return response
+
+    def _send(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', REQUEST_TIMEOUT)
+        while True:
+            rate_budget.acquire()
+            with span(f'{method} {url.split("?")[0]}', 'http') as request_span:
+                response = super().request(method, url, **kwargs)
+                request_span.set(status=response.status_code,
+                                 rate_limit_usage=response.headers.get('X-RateLimit-Usage'),
+                                 rate_limit_limit=response.headers.get('X-RateLimit-Limit'))
+            rate_budget.update(response)
+            if response.status_code != 429:
+                return response
+            rate_budget.exhaust()
+
+def get_session() -> requests.Session:
+    """
+    Return the process-wide HTTP session used for every Strava call.
+
+    The session keeps connections alive in a pool shared by all threads, asks for
+    gzip responses, and retries idempotent requests on connection errors and 5xx
+    responses with jittered exponential backoff. Once retries are exhausted the last
+    response is returned, so callers still see the final status code.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            retry = Retry(
+                total=MAX_RETRIES,
+                backoff_factor=RETRY_BACKOFF,
+                backoff_jitter=RETRY_JITTER,
+                status_forcelist=(500, 502, 503, 504),
+                allowed_methods=frozenset(['GET']),
+                raise_on_status=False,
+            )
+            adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE, max_retries=retry)
+            session = StravaSession()
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            session.headers.update({'Accept-Encoding': 'gzip, deflate'})
+            _session = session
+        return _session
+
+def request_athlete(access_token: str) -> Dict[str, Any]:
+    """Fetch the token's athlete profile without touching Streamlit.
+
+    Raises:
+        requests.RequestException: on network errors or non-2xx responses
+    """
     headers = {'Authorization': f'Bearer {access_token}'}
-    athlete_url = 'https://www.strava.com/api/v3/athlete'
-    response = requests.get(athlete_url, headers=headers)
-    if response.status_code == 200:
-        st.session_state.athlete_data = response.json()
-        user_firstname = st.session_state.athlete_data['firstname']
-        user_lastname = st.session_state.athlete_data['lastname']
-        return st.session_state.athlete_data['firstname'], st.session_state.athlete_data['lastname']#, st.session_state.athlete_data
-    else:
-        st.error(f"Failed to fetch athlete info. Status code: {response.status_code}")
-        return None, None, None
+    athlete_url = f'{STRAVA_API_URL}/athlete'
+    response = get_session().get(athlete_url, headers=headers)
+    response.raise_for_status()
+    return response.json()
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def get_athlete_profile(access_token: str) -> Optional[Dict[str, Any]]:
+    """The token's athlete profile, fetched once per hour and shared by every caller of the process."""
+    try:
+        return request_athlete(access_token)
+    except requests.HTTPError as e:
+        st.error(f"Failed to fetch athlete info. Status code: {e.response.status_code}")
+        return None
+    except requests.RequestException as e:
+        st.error(f"Failed to fetch athlete info: {str(e)}")
+        return None
+
+def get_athlete_info(access_token):
+    profile = get_athlete_profile(access_token)
+    if profile is None:
+        return None, None
+    st.session_state.athlete_data = profile
+    return profile['firstname'], profile['lastname']
 
 @st.cache_data(ttl=3600)
 def create_strava_auth_url(client_id: str, redirect_uri: str) -> str:
     scope = 'read,profile:read_all,activity:read_all'
     return f"https://www.strava.com/oauth/authorize?client_id={client_id}&redirect_uri={redirect_uri}&response_type=code&scope={scope}"
 
-def exchange_code_for_token(client_id: str, client_secret: str, code: str) -> Dict[str, Any]:
-    token_url = 'https://www.strava.com/oauth/token'
+def request_token(client_id: str, client_secret: str, **grant) -> Dict[str, Any]:
+    """Post a grant to Strava's token endpoint without touching Streamlit, so the ingestion worker can use it.
+
+    The response carries access_token, refresh_token and expires_at (plus the athlete for a code grant).
+
+    Raises:
+        requests.RequestException: on network errors or non-2xx responses
+    """
+    token_url = f'{STRAVA_BASE_URL}/oauth/token'
     data = {
         'client_id': client_id,
         'client_secret': client_secret,
-        'code': code,
-        'grant_type': 'authorization_code'
+        **grant
     }
+    response = get_session().post(token_url, data=data)
+    response.raise_for_status()
+    return response.json()
+
+def refresh_access_token(client_id: str, client_secret: str, refresh_token: str) -> Dict[str, Any]:
+    """Trade a refresh token for a new access token; Strava may rotate the refresh token too, so keep the whole response.
+
+    Raises:
+        requests.RequestException: on network errors or non-2xx responses
+    """
+    return request_token(client_id, client_secret, refresh_token=refresh_token, grant_type='refresh_token')
+
+def exchange_code_for_token(client_id: str, client_secret: str, code: str) -> Dict[str, Any]:
     try:
-        response = requests.post(token_url, data=data)
-        response.raise_for_status()
-        return response.json()
+        return request_token(client_id, client_secret, code=code, grant_type='authorization_code')
     except requests.RequestException as e:
         st.error(f"Failed to exchange code for token: {str(e)}")
         return {}
@@ -42,14 +290,13 @@ def exchange_code_for_token(client_id: str, client_secret: str, code: str) -> Di
 @st.cache_data(ttl=3600)
 def get_athlete_stats(access_token: str) -> Dict[str, Any]:
     headers = {'Authorization': f'Bearer {access_token}'}
-    athlete_url = 'https://www.strava.com/api/v3/athlete'
-    stats_url = 'https://www.strava.com/api/v3/athletes/{}/stats'
+    profile = get_athlete_profile(access_token)
+    if profile is None:
+        return {}
+    stats_url = f'{STRAVA_API_URL}/athletes/{profile["id"]}/stats'
   
     try:
-        athlete_response = requests.get(athlete_url, headers=headers)
-        athlete_response.raise_for_status()
-        athlete_id = athlete_response.json()['id']
-        stats_response = requests.get(stats_url.format(athlete_id), headers=headers)
+        stats_response = get_session().get(stats_url, headers=headers)
         stats_response.raise_for_status()
         return stats_response.json()
     except requests.RequestException as e:
@@ -61,8 +308,8 @@ def get_friend_activities(access_token: str) -> List[Dict[str, Any]]:
     # Implementation remains the same, add error handling
     headers = {'Authorization': f'Bearer {access_token}'}
     six_months_ago = int((dt.datetime.now() - dt.timedelta(days=180)).timestamp())
-    activities_url = f'https://www.strava.com/api/v3/activities/following?after={six_months_ago}'
-    response = requests.get(activities_url, headers=headers)
+    activities_url = f'{STRAVA_API_URL}/activities/following?after={six_months_ago}'
+    response = get_session().get(activities_url, headers=headers)
     if response.status_code == 200:
         return response.json()
     else:
@@ -71,43 +318,130 @@ def get_friend_activities(access_token: str) -> List[Dict[str, Any]]:
         return []
 
 
+def request_athlete_clubs(access_token: str) -> List[Dict[str, Any]]:
+    """Fetch the clubs of the token's athlete without touching Streamlit.
+
+    Raises:
+        requests.RequestException: on network errors or non-2xx responses
+    """
+    headers = {'Authorization': f'Bearer {access_token}'}
+    clubs_url = f'{STRAVA_API_URL}/athlete/clubs'
+    response = get_session().get(clubs_url, headers=headers)
+    response.raise_for_status()
+    return response.json()
+
 @st.cache_data(ttl=3600)
 def get_athlete_clubs(access_token: str) -> List[Dict[str, Any]]:
-    headers = {'Authorization': f'Bearer {access_token}'}
-    clubs_url = 'https://www.strava.com/api/v3/athlete/clubs'
-    response = requests.get(clubs_url, headers=headers)
-    if response.status_code == 200:
-        return response.json()
-    else:
-        st.error(f"Failed to fetch clubs. Status code: {response.status_code}")
+    try:
+        return request_athlete_clubs(access_token)
+    except requests.HTTPError as e:
+        st.error(f"Failed to fetch clubs. Status code: {e.response.status_code}")
         return None
+    except requests.RequestException as e:
+        st.error(f"Failed to fetch clubs: {str(e)}")
+        return None
+
+def request_club_members(access_token: str, club_id: int) -> List[Dict[str, Any]]:
+    """Fetch a club's member list without touching Streamlit, so it is safe to call from worker threads.
+
+    Raises:
+        requests.RequestException: on network errors or non-2xx responses
+    """
+    headers = {'Authorization': f'Bearer {access_token}', 'accept': 'application/json'}
+    members_url = f'{STRAVA_API_URL}/clubs/{club_id}/members'
+    response = get_session().get(members_url, headers=headers)
+    response.raise_for_status()
+    members = response.json()
+    # Ensure each member has the expected fields
+    for member in members:
+        member['firstname'] = member.get('firstname', 'N/A')
+        member['lastname'] = member.get('lastname', 'N/A')
+        member['id'] = member.get('id', 'N/A')
+    return members
+
+def request_club_activities(access_token: str, club_id: int, page: int = 1, per_page: int = 200) -> List[Dict[str, Any]]:
+    """Fetch one page of a club's activities (newest first) without touching Streamlit, so it is safe to call from worker threads.
+
+    Raises:
+        requests.RequestException: on network errors or non-2xx responses
+    """
+    headers = {'Authorization': f'Bearer {access_token}', 'accept': 'application/json'}
+    activities_url = f'{STRAVA_API_URL}/clubs/{club_id}/activities?page={page}&per_page={per_page}'
+    response = get_session().get(activities_url, headers=headers)
+    response.raise_for_status()
+    return response.json()
+
+def iter_club_activity_pages(access_token: str, club_id: int, per_page: int = 200, max_pages: int = 20) -> Iterator[List[Dict[str, Any]]]:
+    """Yield successive pages of a club's activities until a short page or max_pages is reached.
+
+    The caller may stop iterating early (e.g. once it reaches activities it already has),
+    in which case no further pages are requested.
+    """
+    for page in range(1, max_pages + 1):
+        activities = request_club_activities(access_token, club_id, page=page, per_page=per_page)
+        if activities:
+            yield activities
+        if len(activities) < per_page:
+            return
+
+def request_athlete_activities(access_token: str, after: Optional[int] = None, before: Optional[int] = None,
+                               page: int = 1, per_page: int = 200) -> List[Dict[str, Any]]:
+    """Fetch one page of the token's own activities without touching Streamlit.
+
+    Args:
+        access_token (str): Strava access token with activity:read_all scope
+        after (Optional[int]): only activities started after this epoch second
+        before (Optional[int]): only activities started before this epoch second
+        page (int): page number, starting at 1
+        per_page (int): activities per page, at most 200
+
+    Raises:
+        requests.RequestException: on network errors or non-2xx responses
+    """
+    headers = {'Authorization': f'Bearer {access_token}', 'accept': 'application/json'}
+    params = {'page': page, 'per_page': per_page}
+    if after is not None:
+        params['after'] = int(after)
+    if before is not None:
+        params['before'] = int(before)
+    response = get_session().get(f'{STRAVA_API_URL}/athlete/activities', headers=headers, params=params)
+    response.raise_for_status()
+    return response.json()
+
+def request_activity_streams(access_token: str, activity_id: int, keys: List[str]) -> Dict[str, List]:
+    """Fetch the time series of one activity, as {stream type: data}, without touching Streamlit.
+
+    Strava only returns the streams the activity has; manual activities have none and answer 404.
+
+    Raises:
+        requests.RequestException: on network errors or non-2xx responses
+    """
+    headers = {'Authorization': f'Bearer {access_token}', 'accept': 'application/json'}
+    params = {'keys': ','.join(keys), 'key_by_type': 'true'}
+    response = get_session().get(f'{STRAVA_API_URL}/activities/{activity_id}/streams', headers=headers, params=params)
+    response.raise_for_status()
+    return {stream_type: stream['data'] for stream_type, stream in response.json().items()}
 
 @st.cache_data(ttl=3600)
 def get_club_members(access_token, club_id):
-    headers = {'Authorization': f'Bearer {access_token}', 'accept': 'application/json'}
-    members_url = f'https://www.strava.com/api/v3/clubs/{club_id}/members'
-    response = requests.get(members_url, headers=headers)
-    if response.status_code == 200:
-        members = response.json()
-        # Ensure each member has the expected fields
-        for member in members:
-            member['firstname'] = member.get('firstname', 'N/A')
-            member['lastname'] = member.get('lastname', 'N/A')
-            member['id'] = member.get('id', 'N/A')
-        return members
-    else:
-        st.error(f"Failed to fetch club members. Status code: {response.status_code}")
-        st.write("Response content:", response.text)
+    try:
+        return request_club_members(access_token, club_id)
+    except requests.HTTPError as e:
+        st.error(f"Failed to fetch club members. Status code: {e.response.status_code}")
+        st.write("Response content:", e.response.text)
+        return None
+    except requests.RequestException as e:
+        st.error(f"Failed to fetch club members: {str(e)}")
         return None
    
 @st.cache_data(ttl=3600)
 def get_club_activities(access_token: str, club_id: int, club_name: str) -> List[Dict[str, Any]]:
-    headers = {'Authorization': f'Bearer {access_token}', 'accept': 'application/json'}
-    activities_url = f'https://www.strava.com/api/v3/clubs/{club_id}/activities?page=1&per_page=200'
-    response = requests.get(activities_url, headers=headers)
-    if response.status_code == 200:
-        return response.json()
-    else:
-        st.error(f"Failed to fetch club activities. Status code: {response.status_code}")
-        st.write("Response content:", response.text)
+    try:
+        return [activity for page in iter_club_activity_pages(access_token, club_id) for activity in page]
+    except requests.HTTPError as e:
+        st.error(f"Failed to fetch club activities. Status code: {e.response.status_code}")
+        st.write("Response content:", e.response.text)
+        return None
+    except requests.RequestException as e:
+        st.error(f"Failed to fetch club activities: {str(e)}")
         return None
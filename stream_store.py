@@ -0,0 +1,159 @@
+"""
+Append-only store of activity streams (time series) in typed, memory-mapped arrays.
+
+Each athlete has a directory with one flat binary file per stream type, holding the
+samples of every stored activity back to back, and an index.npy with the activity id,
+sample offset and sample count of each activity, sorted by activity id. Reading an
+activity is a binary search in the index and a slice of the memory-mapped files: no
+parsing and no copy. Streams an activity lacks are stored as NaN so every file stays
+aligned on the same offsets.
+
+Appends hold a file lock. The data files are first cut back to the end recorded in
+the index (dropping whatever an interrupted append left behind), then the new samples
+are appended and the index is replaced atomically, so readers only ever see complete
+activities.
+"""
+import io
+import os
+import threading
+from typing import Dict, Iterable, List, Optional
+import numpy as np
+from atomic_files import atomic_write, file_lock
+
+STREAMS_DIR = 'data/streams'
+# Stream types kept, with their on-disk dtype; latlng (2-D) and moving (boolean) are not stored
+STREAM_DTYPES = {
+    'time': np.dtype('<i4'),
+    'distance': np.dtype('<f4'),
+    'altitude': np.dtype('<f4'),
+    'velocity_smooth': np.dtype('<f4'),
+    'heartrate': np.dtype('<f4'),
+    'cadence': np.dtype('<f4'),
+    'watts': np.dtype('<f4'),
+    'grade_smooth': np.dtype('<f4'),
+    'temp': np.dtype('<f4'),
+}
+STREAM_KEYS = list(STREAM_DTYPES)
+INDEX_DTYPE = np.dtype([('activity_id', '<i8'), ('offset', '<i8'), ('length', '<i4')])
+
+class StreamStore:
+    """
+    Streams of one athlete's activities.
+
+    Args:
+        athlete_id: owner of the activities
+        root (str): directory holding one subdirectory per athlete
+    """
+
+    def __init__(self, athlete_id, root: str = STREAMS_DIR):
+        self.directory = os.path.join(root, str(athlete_id))
+        self.index_path = os.path.join(self.directory, 'index.npy')
+        self._lock = threading.Lock()
+        self._index_mtime = None
+        self._index = np.empty(0, dtype=INDEX_DTYPE)
+        self._maps: Dict[str, np.memmap] = {}
+
+    def _data_path(self, key: str) -> str:
+        return os.path.join(self.directory, f'{key}.bin')
+
+    def _read_index(self) -> np.ndarray:
+        try:
+            return np.load(self.index_path)
+        except FileNotFoundError:
+            return np.empty(0, dtype=INDEX_DTYPE)
+
+    def index(self) -> np.ndarray:
+        """The offset index, reloaded (and the memory maps reopened) when another process appended."""
+        with self._lock:
+            try:
+                mtime = os.stat(self.index_path).st_mtime_ns
+            except FileNotFoundError:
+                mtime = None
+            if mtime != self._index_mtime:
+                self._index = self._read_index()
+                self._index_mtime = mtime
+                self._maps = {}
+            return self._index
+
+    def activity_ids(self) -> np.ndarray:
+        return self.index()['activity_id']
+
+    def __contains__(self, activity_id) -> bool:
+        ids = self.activity_ids()
+        position = np.searchsorted(ids, activity_id)
+        return bool(position < len(ids) and ids[position] == activity_id)
+
+    def _map(self, key: str, end: int) -> np.ndarray:
+        stream = self._maps.get(key)
+        if stream is None or len(stream) < end:
+            stream = self._maps[key] = np.memmap(self._data_path(key), dtype=STREAM_DTYPES[key], mode='r', shape=(end,))
+        return stream
+
+    def read(self, activity_id, keys: Optional[Iterable[str]] = None) -> Optional[Dict[str, np.ndarray]]:
+        """
+        One activity's streams as read-only views into the memory-mapped files.
+
+        Args:
+            activity_id: activity to read
+            keys (Optional[Iterable[str]]): stream types to return, all of STREAM_KEYS if omitted
+
+        Returns:
+            Optional[Dict[str, np.ndarray]]: arrays by stream type, None if the activity is not stored
+        """
+        index = self.index()
+        position = np.searchsorted(index['activity_id'], activity_id)
+        if position == len(index) or index['activity_id'][position] != activity_id:
+            return None
+        offset, length = int(index['offset'][position]), int(index['length'][position])
+        if length == 0:
+            return {key: np.empty(0, dtype=STREAM_DTYPES[key]) for key in (keys or STREAM_KEYS)}
+        end = int((index['offset'] + index['length']).max())
+        with self._lock:
+            return {key: self._map(key, end)[offset:offset + length] for key in (keys or STREAM_KEYS)}
+
+    def append(self, streams_by_activity: Dict[int, Dict[str, List]]) -> int:
+        """
+        Store the streams of new activities, as returned by strava_api.request_activity_streams.
+
+        An activity without streams (e.g. a manual entry) is stored with length 0, so it is
+        not requested again. Activities already stored are ignored.
+
+        Returns:
+            int: number of activities added
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        with file_lock(self.index_path):
+            index = self._read_index()
+            end = int((index['offset'] + index['length']).max()) if len(index) else 0
+            new_ids = sorted(set(streams_by_activity) - set(index['activity_id'].tolist()))
+            entries = np.empty(len(new_ids), dtype=INDEX_DTYPE)
+            columns = {key: [] for key in STREAM_KEYS}
+            offset = end
+            for i, activity_id in enumerate(new_ids):
+                streams = streams_by_activity[activity_id]
+                # Streams of one activity share their length, but any of them may be absent
+                length = max((len(streams.get(key) or []) for key in STREAM_KEYS), default=0)
+                entries[i] = (activity_id, offset, length)
+                for key, dtype in STREAM_DTYPES.items():
+                    missing = -1 if dtype.kind == 'i' else np.nan
+                    data = streams.get(key)
+                    if data is None or len(data) != length:
+                        columns[key].append(np.full(length, missing, dtype=dtype))
+                    else:
+                        # Strava sends null for samples a sensor missed; they become NaN, or -1 in integer streams
+                        values = np.array(data, dtype=np.float64)
+                        columns[key].append(np.where(np.isnan(values), missing, values).astype(dtype))
+                offset += length
+            for key, dtype in STREAM_DTYPES.items():
+                with open(self._data_path(key), 'ab') as f:
+                    f.truncate(end * dtype.itemsize)
+                    for chunk in columns[key]:
+                        f.write(chunk.tobytes())
+                    f.flush()
+                    os.fsync(f.fileno())
+            new_index = np.concatenate([index, entries])
+            new_index.sort(order='activity_id')
+            buffer = io.BytesIO()
+            np.save(buffer, new_index)
+            atomic_write(self.index_path, buffer.getvalue())
+        return len(new_ids)
@@ -0,0 +1,78 @@
+"""
+Encrypted storage of Strava OAuth tokens, so the ingestion worker can act for athletes who authorized the app.
+
+Tokens are kept per athlete id in one Fernet-encrypted file, with the ENCRYPTION_KEY
+environment variable that main.py already uses for the client secret.
+"""
+import json
+import os
+import time
+from typing import Any, Dict, Optional
+from cryptography.fernet import Fernet, InvalidToken
+from atomic_files import atomic_write, file_lock
+from strava_api import refresh_access_token
+
+TOKEN_FILE = 'data/strava_tokens.enc'
+TOKEN_FIELDS = ['access_token', 'refresh_token', 'expires_at']
+REFRESH_MARGIN = 10 * 60  # seconds before expiry at which an access token is refreshed
+
+def _cipher(key: Optional[str] = None) -> Fernet:
+    return Fernet((key or os.getenv('ENCRYPTION_KEY')).encode())
+
+def load_tokens(key: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+    """
+    Return the stored tokens by athlete id.
+
+    Tokens encrypted with another key cannot be read; they are treated as absent and the
+    athletes have to authorize the app again.
+    """
+    try:
+        with open(TOKEN_FILE, 'rb') as f:
+            return json.loads(_cipher(key).decrypt(f.read()))
+    except (FileNotFoundError, InvalidToken):
+        return {}
+
+def _write_tokens(tokens: Dict[str, Dict[str, Any]], key: Optional[str] = None):
+    atomic_write(TOKEN_FILE, _cipher(key).encrypt(json.dumps(tokens).encode('utf-8')), mode=0o600)
+
+def save_token(token_response: Dict[str, Any], athlete_id: Optional[int] = None, key: Optional[str] = None):
+    """
+    Store the tokens of a code exchange or refresh response.
+
+    Args:
+        token_response (Dict[str, Any]): response of the Strava token endpoint
+        athlete_id (Optional[int]): owner of the tokens, read from the response's athlete if omitted
+        key (Optional[str]): Fernet key, ENCRYPTION_KEY if omitted
+    """
+    athlete_id = athlete_id or token_response['athlete']['id']
+    # The dashboard and the ingestion worker may both save tokens at the same time
+    with file_lock(TOKEN_FILE):
+        tokens = load_tokens(key)
+        tokens[str(athlete_id)] = {field: token_response[field] for field in TOKEN_FIELDS}
+        _write_tokens(tokens, key)
+
+def delete_token(athlete_id, key: Optional[str] = None):
+    """Forget an athlete's tokens, e.g. once they de-authorized the app; the ingestion worker then skips them."""
+    with file_lock(TOKEN_FILE):
+        tokens = load_tokens(key)
+        if tokens.pop(str(athlete_id), None) is not None:
+            _write_tokens(tokens, key)
+
+def get_access_token(athlete_id, client_id: str, client_secret: str, key: Optional[str] = None) -> Optional[str]:
+    """
+    Return a valid access token for an athlete, refreshing and storing it first if it is about to expire.
+
+    Returns:
+        Optional[str]: access token, None if the athlete never authorized the app
+
+    Raises:
+        requests.RequestException: if the refresh fails, e.g. because access was revoked
+    """
+    token = load_tokens(key).get(str(athlete_id))
+    if token is None:
+        return None
+    if token['expires_at'] - time.time() > REFRESH_MARGIN:
+        return token['access_token']
+    refreshed = refresh_access_token(client_id, client_secret, token['refresh_token'])
+    save_token(refreshed, athlete_id, key)
+    return refreshed['access_token']
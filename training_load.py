@@ -0,0 +1,147 @@
+"""
+Training load of an athlete over their own stored history (see activity_history).
+
+Each activity gets a load: Strava's relative effort (suffer_score) when it was recorded
+with heart rate, otherwise an estimate from its moving time. Loads and volumes are summed
+per local day on a continuous calendar, and the daily series carries running totals of
+every measure along with the acute and chronic training loads (ATL, CTL), exponentially
+weighted averages of the daily load. Any window total is the difference of two running
+totals, so weekly, monthly and rolling volumes and per-sport trends are vectorized
+subtractions instead of regroupings of the history.
+
+Running totals and exponential averages only depend on the previous day, so TrainingLoad
+extends its series with new days and activities without recomputing the past.
+"""
+import threading
+from datetime import date
+from typing import Optional
+import pandas as pd
+from activity_store import count_athlete_activities, read_athlete_activities
+from instrumentation import traced
+
+ATL_DAYS = 7  # time constant of the acute load ("fatigue")
+CTL_DAYS = 42  # time constant of the chronic load ("fitness")
+DEFAULT_LOAD_PER_HOUR = 50  # load of an hour without heart rate, about an endurance-pace relative effort
+HISTORY_COLUMNS = ['start_date_local', 'sport_type', 'distance', 'moving_time', 'total_elevation_gain', 'suffer_score']
+SPORT_PREFIX = 'distance:'  # per-sport distance columns, e.g. 'distance:Ride'
+
+def activity_load(activities_df: pd.DataFrame) -> pd.Series:
+    estimate = activities_df['moving_time'] / 3600 * DEFAULT_LOAD_PER_HOUR
+    return activities_df['suffer_score'].fillna(estimate)
+
+def daily_totals(activities_df: pd.DataFrame, start: Optional[pd.Timestamp], end: pd.Timestamp) -> pd.DataFrame:
+    """
+    Per-day sums of activity count, load, volume and distance per sport type.
+
+    Args:
+        activities_df (pd.DataFrame): activities with HISTORY_COLUMNS
+        start (Optional[pd.Timestamp]): first day of the calendar, the first activity's day if omitted
+        end (pd.Timestamp): last day of the calendar
+
+    Returns:
+        pd.DataFrame: one row per day from start to end, zero on days without activities
+    """
+    days = activities_df['start_date_local'].dt.normalize().rename('day')
+    measures = pd.DataFrame({
+        'activities': 1,
+        'load': activity_load(activities_df),
+        'distance': activities_df['distance'].fillna(0.0),
+        'moving_time': activities_df['moving_time'].fillna(0),
+        'elevation': activities_df['total_elevation_gain'].fillna(0.0),
+    })
+    per_sport = pd.get_dummies(activities_df['sport_type'], prefix=SPORT_PREFIX, prefix_sep='', dtype=float)
+    per_sport = per_sport.mul(measures['distance'], axis=0)
+    totals = pd.concat([measures, per_sport], axis=1).groupby(days).sum().astype(float)
+    calendar = pd.date_range(start if start is not None else days.min(), end, freq='D', name='day')
+    return totals.reindex(calendar, fill_value=0.0)
+
+def _exponential_average(values: pd.Series, days: int, previous: float) -> pd.Series:
+    # Seeding the recursion with the previous day's value continues the series exactly
+    seeded = pd.concat([pd.Series([previous]), values.reset_index(drop=True)])
+    averaged = seeded.ewm(alpha=1 / days, adjust=False).mean().iloc[1:]
+    return pd.Series(averaged.to_numpy(), index=values.index)
+
+def accumulate(totals: pd.DataFrame, previous: Optional[pd.Series] = None) -> pd.DataFrame:
+    """
+    Add running totals (cum_<measure>), ATL, CTL and form (tsb = ctl - atl) to daily totals.
+
+    Args:
+        totals (pd.DataFrame): output of daily_totals
+        previous (Optional[pd.Series]): last row of an earlier accumulate, continued from when given
+    """
+    if previous is not None:
+        # Sport types of earlier days carry their running totals forward
+        earlier = [column for column in previous.index if column.startswith('cum_')]
+        totals = totals.reindex(columns=totals.columns.union([c[len('cum_'):] for c in earlier], sort=False), fill_value=0.0)
+    running = totals.cumsum().add_prefix('cum_')
+    if previous is not None:
+        running += previous.reindex(running.columns, fill_value=0.0)
+    atl = _exponential_average(totals['load'], ATL_DAYS, previous['atl'] if previous is not None else 0.0)
+    ctl = _exponential_average(totals['load'], CTL_DAYS, previous['ctl'] if previous is not None else 0.0)
+    return pd.concat([totals, running], axis=1).assign(atl=atl, ctl=ctl, tsb=ctl - atl)
+
+def rolling_volume(daily: pd.DataFrame, days: int) -> pd.DataFrame:
+    """Sums over the trailing `days` days of every measure, as differences of running totals."""
+    running = daily.filter(like='cum_')
+    return (running - running.shift(days, fill_value=0.0)).rename(columns=lambda c: c[len('cum_'):])
+
+def period_volume(daily: pd.DataFrame, freq: str = 'W') -> pd.DataFrame:
+    """Sums of every measure per calendar period ('W' weeks ending on Sunday, 'ME' months), labelled by period end."""
+    running = daily.filter(like='cum_')
+    # The history starts at zero, so the first period's total is its last running total
+    ends = running.resample(freq).last()
+    return ends.diff().fillna(ends).rename(columns=lambda c: c[len('cum_'):])
+
+def sport_trends(daily: pd.DataFrame, days: int = 28) -> pd.DataFrame:
+    """Trailing `days`-day distance in metres per sport type, one column per sport type."""
+    trends = rolling_volume(daily.filter(like=f'cum_{SPORT_PREFIX}'), days)
+    return trends.rename(columns=lambda c: c[len(SPORT_PREFIX):])
+
+class TrainingLoad:
+    """
+    Daily training series of one athlete, extended as days pass and activities arrive.
+
+    Only the last day and the days after it are rebuilt on an update. If activities
+    appear before the last day (e.g. a resumed history download filled an older
+    window), the series is recomputed from the whole history.
+
+    Args:
+        athlete_id (int): owner of the history
+    """
+
+    def __init__(self, athlete_id: int):
+        self.athlete_id = athlete_id
+        self._lock = threading.Lock()
+        self._daily: Optional[pd.DataFrame] = None
+        self._settled = 0  # activities before the last day of _daily
+
+    def _count_settled(self, daily: pd.DataFrame) -> int:
+        return count_athlete_activities(self.athlete_id, end=(daily.index[-1] - pd.Timedelta(days=1)).date())
+
+    @traced('aggregate')
+    def daily(self, today: Optional[date] = None) -> pd.DataFrame:
+        """
+        The series from the first activity's day until today, one row per day; empty without history.
+
+        The returned frame is shared with later callers and must be treated as read-only.
+        """
+        today = pd.Timestamp(today or date.today())
+        with self._lock:
+            daily = self._daily
+            if daily is not None and self._count_settled(daily) == self._settled:
+                last_day = daily.index[-1]
+                if today < last_day:
+                    return daily
+                # The last day may have gained activities, so it is rebuilt along with the new days
+                recent = read_athlete_activities(self.athlete_id, HISTORY_COLUMNS, start=last_day.date(), end=today.date())
+                kept = daily.iloc[:-1]
+                extension = accumulate(daily_totals(recent, last_day, today), kept.iloc[-1] if len(kept) else None)
+                daily = pd.concat([kept, extension]).fillna(0.0)
+            else:
+                history = read_athlete_activities(self.athlete_id, HISTORY_COLUMNS, end=today.date())
+                if history.empty:
+                    return pd.DataFrame()
+                daily = accumulate(daily_totals(history, None, today))
+            self._daily = daily
+            self._settled = self._count_settled(daily)
+            return daily
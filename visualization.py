@@ -1,104 +1,73 @@
 import streamlit as st
 import datetime as dt
 from datetime import datetime, timedelta
-import matplotlib.pyplot as plt
-import seaborn as sns
 import pandas as pd
 from typing import Tuple
 import ast
 from data_processing import *
 from strava_api import *
-import colorcet as cc
+import numpy as np
 import plotly.graph_objects as go
+from plotly.subplots import make_subplots
+from activity_store import data_version
+from data_access import get_training_load
+from instrumentation import traced
+from query import Query
+from training_load import period_volume, sport_trends
 
 
 
 def display_club_details_with_plotly(selected_club):
-    # Define sport_types at the beginning of the function
-    sport_types = {
-        "Running (Trail + Running)": ['Trail', 'Run'],
-        "Cycling (Gravel, Road, Mountain Bike, Virtual)": ['Gravel Ride', 'Ride', 'MountainBikeRide', 'VirtualRide'],
-        "Swimming": ['Swim']
-    }
+    sport_types = SPORT_CATEGORIES
 
-    # Read the CSV file
-    df = pd.read_csv('data/all_club_activities.csv')
+    # Per-athlete daily rollups of the selected club, so the work scales with athletes rather than activities
+    club_rollup = Query('rollup').where(club_name=selected_club)
     
-    # Filter activities for the selected club
-    club_activities = df[df['club_name'] == selected_club]
-    
-    if not club_activities.empty:
+    if club_rollup.agg(rows=('day', 'size')).collect()['rows'].iloc[0]:
         st.subheader(f"Member Activities for {selected_club}")    
         for sport_name, sport_activities in sport_types.items():
-            st.subheader(f"{sport_name} Activities")
-            
-            # Filter activities for this sport type
-            sport_df = club_activities[club_activities['sport_type'].isin(sport_activities)]
-            
-            if sport_df.empty:
-                st.write(f"No {sport_name} activities found for this club.")
-                continue
-            
-            # Aggregate data by athlete
-            athlete_stats = sport_df.groupby(['firstname', 'lastname']).agg({
-                'distance': 'sum',
-                'moving_time': 'sum',
-                'avg_speed': 'mean'
-            }).reset_index()
-            
-            # Calculate number of activities
-            activity_counts = sport_df.groupby(['firstname', 'lastname']).size().reset_index(name='activity_count')
-            athlete_stats = athlete_stats.merge(activity_counts, on=['firstname', 'lastname'])
-            
-            # Sort by number of activities and get top 50
-            top_50_athletes = athlete_stats.sort_values('activity_count', ascending=False).head(50)
-            
-            # Create a color palette for athletes
-            num_athletes = len(top_50_athletes) 
-            color_palette = cc.glasbey_category10[:num_athletes]  # Use of a color palette from colorcet instead of Turbo256
-            top_50_athletes['color'] = color_palette
-            
-            # Create the Plotly figure
-            fig = go.Figure()
-
-            # Add bubbles
-            fig.add_trace(go.Scatter(
-                x=top_50_athletes['activity_count'],
-                y=top_50_athletes['avg_speed'],
-                mode='markers',
-                marker=dict(
-                    size=top_50_athletes['moving_time'] / 3600,  # Convert to hours
-                    sizemode='area',
-                    sizeref=2.*max(top_50_athletes['moving_time']/3600)/(40.**2),
-                    sizemin=4,
-                    color=top_50_athletes.index,
-                    colorscale='Turbo',
-                    showscale=False
-                ),
-                text=top_50_athletes.apply(lambda row: f"{row['firstname']} {row['lastname']}<br>Activities: {row['activity_count']}<br>Avg Speed: {row['avg_speed']:.2f}<br>Total Distance: {row['distance']:.2f} km<br>Moving Time: {row['moving_time']/3600:.2f} hours", axis=1),
-                hoverinfo='text'
-            ))
-
-            # Customize the layout
-            fig.update_layout(
-                title=f"Top 50 {sport_name} Athletes",
-                xaxis_title="Number of Activities",
-                yaxis_title="Average Speed",
-                width=800,
-                height=600,
-                showlegend=False
-            )
-
-            # Display the Plotly figure
-            st.plotly_chart(fig, use_container_width=True)
-
-            # Optionally, display the data table
-            if st.toggle('Show dataframe', key=f"toggle_{sport_name.replace(' ', '_')}"):
-                st.dataframe(top_50_athletes[['firstname', 'lastname', 'activity_count', 'avg_speed', 'distance', 'moving_time'
-            ]], hide_index=True)
+            display_sport_category(club_rollup, sport_name, sport_activities)
     else:
         st.warning(f"No activities found for {selected_club}.")
 
+@st.fragment
+def display_sport_category(club_rollup: Query, sport_name: str, sport_activities):
+    """One sport category's top athletes; its 'Show dataframe' toggle reruns this section alone."""
+    import colorcet as cc
+    st.subheader(f"{sport_name} Activities")
+    
+    # Aggregate data by athlete, for this sport type, and get the top 50 by number of activities
+    top_50_athletes = (club_rollup.where(sport_types=sport_activities, named_only=True)
+                       .group_by('firstname', 'lastname')
+                       .agg(activity_count=('activity_count', 'sum'), distance=('distance_sum', 'sum'),
+                            moving_time=('moving_time_sum', 'sum'), speed_sum=('speed_sum', 'sum'),
+                            speed_count=('speed_count', 'sum'))
+                       .top(50, by='activity_count')
+                       .collect())
+    
+    if top_50_athletes.empty:
+        st.write(f"No {sport_name} activities found for this club.")
+        return
+    
+    # Create a color palette for athletes
+    num_athletes = len(top_50_athletes) 
+    color_palette = cc.glasbey_category10[:num_athletes]  # Use of a color palette from colorcet instead of Turbo256
+    # The query result is shared, so the derived columns go on a copy
+    top_50_athletes = top_50_athletes.assign(
+        avg_speed=top_50_athletes['speed_sum'] / top_50_athletes['speed_count'].where(top_50_athletes['speed_count'] > 0),
+        color=color_palette)
+    
+    # Create the Plotly figure
+    fig = create_bubble_chart(top_50_athletes, sport_name)
+
+    # Display the Plotly figure
+    st.plotly_chart(fig, use_container_width=True)
+
+    # Optionally, display the data table
+    if st.toggle('Show dataframe', key=f"toggle_{sport_name.replace(' ', '_')}"):
+        st.dataframe(top_50_athletes[['firstname', 'lastname', 'activity_count', 'avg_speed', 'distance', 'moving_time'
+    ]], hide_index=True)
+
 
 def display_club_details(selected_club):
     # Define sport_types at the beginning of the function
@@ -128,14 +97,14 @@ def display_club_details(selected_club):
                 continue
             
             # Aggregate data by athlete
-            athlete_stats = sport_df.groupby(['firstname', 'lastname']).agg({
+            athlete_stats = sport_df.groupby(['firstname', 'lastname'], observed=True).agg({
                 'distance': 'sum',
                 'moving_time': 'sum',
                 'avg_speed': 'mean'
             }).reset_index()
             
             # Calculate number of activities
-            activity_counts = sport_df.groupby(['firstname', 'lastname']).size().reset_index(name='activity_count')
+            activity_counts = sport_df.groupby(['firstname', 'lastname'], observed=True).size().reset_index(name='activity_count')
             athlete_stats = athlete_stats.merge(activity_counts, on=['firstname', 'lastname'])
             
             # Sort by number of activities and get top 50
@@ -190,16 +159,10 @@ def display_club_details(selected_club):
     else:
         st.warning(f"No activities found for {selected_club}.")
 
+@traced('chart')
 def create_bubble_chart(df, sport_name):
-    # Aggregate data by athlete
-    athlete_stats = df.groupby(['firstname', 'lastname']).agg({
-        'distance': 'sum',
-        'moving_time': 'sum',
-        'avg_speed': 'mean',
-        'activity_count': 'sum'
-    }).reset_index()
-    # Sort by number of activities and get top 50
-    top_50_athletes = athlete_stats.sort_values('activity_count', ascending=False).head(50)
+    # df already holds one row per athlete, the top 50 by number of activities
+    top_50_athletes = df.reset_index(drop=True)
     # Create the Plotly figure
     fig = go.Figure()
     # Add bubbles
@@ -231,76 +194,152 @@ def create_bubble_chart(df, sport_name):
     return fig
 
 
+WEBGL_MAX_POINTS = 20000  # above this many activities a panel is drawn as a density heatmap
+DENSITY_BINS = 80
+
+def _activity_panel_traces(panel_df: pd.DataFrame, user_df: pd.DataFrame) -> list:
+    """
+    Traces for one distance/moving-time panel, choosing the rendering strategy by point count.
+
+    Up to WEBGL_MAX_POINTS activities are sent as a WebGL scatter. Larger panels are binned
+    server-side into a 2D histogram and sent as a heatmap, so the payload is DENSITY_BINS^2
+    cells whatever the history length. The user's own activities are always overlaid as points.
+    """
+    traces = []
+    if len(panel_df) <= WEBGL_MAX_POINTS:
+        traces.append(go.Scattergl(x=panel_df['distance'], y=panel_df['moving_time'], mode='markers',
+                                   marker=dict(size=5, opacity=0.6), name='Club activities', hoverinfo='x+y'))
+    else:
+        points = panel_df[['distance', 'moving_time']].dropna()
+        counts, x_edges, y_edges = np.histogram2d(points['distance'], points['moving_time'], bins=DENSITY_BINS)
+        traces.append(go.Heatmap(
+            z=np.log1p(counts.T),
+            x=(x_edges[:-1] + x_edges[1:]) / 2,
+            y=(y_edges[:-1] + y_edges[1:]) / 2,
+            customdata=counts.T,
+            colorscale='Blues',
+            showscale=False,
+            hovertemplate='%{customdata:.0f} activities<extra></extra>',
+            name='Club activities',
+        ))
+    if not user_df.empty:
+        traces.append(go.Scattergl(x=user_df['distance'], y=user_df['moving_time'], mode='markers',
+                                   marker=dict(color='red', symbol='star', size=12), name='Your activities'))
+    return traces
+
+@traced('chart')
 def create_activity_plots(filtered_df, user_firstname, user_lastname):
-    fig, axs = plt.subplots(2, 2, figsize=(35, 35))
-    plt.subplots_adjust(hspace=0.4)
-    # Plot 1: All activities
-    sns.scatterplot(data=filtered_df, x='distance', y='moving_time', ax=axs[0, 0])
-    
+    # Panel 1: all activities, panels 2-4: the first three sport types
+    sport_types = filtered_df['sport_type'].dropna().unique()[:3]
+    titles = ['All Activities'] + [f'{sport} Activities' for sport in sport_types]
+    fig = make_subplots(rows=2, cols=2, subplot_titles=titles, vertical_spacing=0.12)
+
     # Identify user activities
     user_activities = filtered_df[
         (filtered_df['firstname'] == user_firstname) & 
         (filtered_df['lastname'] == user_lastname) #['lastname'].str[0]
     ]
-    
-    if not user_activities.empty:
-        axs[0, 0].scatter(user_activities['distance'], user_activities['moving_time'], color='red', marker='*', s=500, label='Your activities')
-    
-    axs[0, 0].set_title('All Activities')
-    axs[0, 0].set_xlabel('Distance (km)')
-    axs[0, 0].set_ylabel('Moving Time (hours)')
-    axs[0, 0].legend('')
-
-    # Plot 2-4: Activities by sport type
-    sport_types = filtered_df['sport_type'].unique()
-    for i, sport in enumerate(sport_types[:3]):
-        row, col = divmod(i + 1, 2)
-        sport_df = filtered_df[filtered_df['sport_type'] == sport]
-        sns.scatterplot(data=sport_df, x='distance', y='moving_time', ax=axs[row, col])
-        if not user_activities.empty:
-            user_sport_activities = user_activities[user_activities['sport_type'] == sport]
-            axs[row, col].scatter(user_sport_activities['distance'], user_sport_activities['moving_time'], color='red', marker='*', s=100, label='Your activities')
-        axs[row, col].set_title(f'{sport} Activities')
-        axs[row, col].set_xlabel('Distance (km)')
-        axs[row, col].set_ylabel('Moving Time (hours)')
-        axs[row, col].legend()
 
+    panels = [(filtered_df, user_activities)]
+    for sport in sport_types:
+        panels.append((filtered_df[filtered_df['sport_type'] == sport], user_activities[user_activities['sport_type'] == sport]))
+    for i, (panel_df, user_df) in enumerate(panels):
+        row, col = divmod(i, 2)
+        for trace in _activity_panel_traces(panel_df, user_df):
+            trace.showlegend = i == 0
+            fig.add_trace(trace, row=row + 1, col=col + 1)
+        fig.update_xaxes(title_text='Distance (km)', row=row + 1, col=col + 1)
+        fig.update_yaxes(title_text='Moving Time (hours)', row=row + 1, col=col + 1)
+
+    fig.update_layout(height=900, legend=dict(orientation='h'))
+    return fig
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def _cached_activity_plots(version: int, club_id: int, start_date, end_date, user_firstname, user_lastname):
+    activities = (Query('activities').where(club_id=club_id, start=start_date, end=end_date)
+                  .select('firstname', 'lastname', 'sport_type', 'distance', 'moving_time').collect())
+    return create_activity_plots(activities, user_firstname, user_lastname)
+
+@traced('chart')
+def get_activity_plots(club_id: int, start_date, end_date, user_firstname, user_lastname):
+    """Activity plots for a club and date range, built once per (dataset version, club, date range, user)."""
+    return _cached_activity_plots(data_version(), int(club_id), start_date, end_date, user_firstname, user_lastname)
+
+TRAINING_LOAD_DAYS = 365  # days of history drawn in the training load charts
+
+@traced('chart')
+def create_training_load_chart(daily: pd.DataFrame) -> go.Figure:
+    recent = daily.iloc[-TRAINING_LOAD_DAYS:]
+    weekly = period_volume(daily, 'W').loc[recent.index[0]:]
+    fig = make_subplots(rows=2, cols=1, shared_xaxes=True, vertical_spacing=0.08,
+                        subplot_titles=("Fitness (CTL), fatigue (ATL) and form (TSB)", "Weekly volume (km)"))
+    fig.add_trace(go.Scatter(x=recent.index, y=recent['ctl'], name='Fitness (CTL)', line=dict(color='#1f77b4')), row=1, col=1)
+    fig.add_trace(go.Scatter(x=recent.index, y=recent['atl'], name='Fatigue (ATL)', line=dict(color='#d62728')), row=1, col=1)
+    fig.add_trace(go.Bar(x=recent.index, y=recent['tsb'], name='Form (TSB)', marker_color='#7f7f7f', opacity=0.5), row=1, col=1)
+    fig.add_trace(go.Bar(x=weekly.index, y=weekly['distance'] / 1000, name='Distance', marker_color='#fc4c02'), row=2, col=1)
+    fig.update_layout(height=600, legend=dict(orientation='h'))
+    return fig
+
+@traced('chart')
+def create_sport_trend_chart(daily: pd.DataFrame) -> go.Figure:
+    trends = sport_trends(daily).iloc[-TRAINING_LOAD_DAYS:]
+    fig = go.Figure()
+    for sport_type in trends.columns:
+        if trends[sport_type].any():
+            fig.add_trace(go.Scatter(x=trends.index, y=trends[sport_type] / 1000, name=sport_type, mode='lines'))
+    fig.update_layout(title="Distance over the last 28 days by sport (km)", height=400, legend=dict(orientation='h'))
     return fig
 
-def display_summary_statistics(filtered_df: pd.DataFrame):
+def display_training_load(athlete_id: int):
+    """Training load charts over the athlete's own stored history, if activity_history has downloaded it."""
+    daily = get_training_load(athlete_id)
+    if daily.empty:
+        st.caption("Your training load appears here once your activity history has been downloaded.")
+        return
+    st.subheader("My Training Load")
+    today = daily.iloc[-1]
+    columns = st.columns(3)
+    columns[0].metric("Fitness (CTL)", f"{today['ctl']:.0f}")
+    columns[1].metric("Fatigue (ATL)", f"{today['atl']:.0f}")
+    columns[2].metric("Form (TSB)", f"{today['tsb']:.0f}")
+    st.plotly_chart(create_training_load_chart(daily), use_container_width=True)
+    st.plotly_chart(create_sport_trend_chart(daily), use_container_width=True)
+    display_monthly_volume(daily)
+
+@st.fragment
+def display_monthly_volume(daily: pd.DataFrame):
+    """Monthly volume table behind a toggle that reruns only this fragment."""
+    if st.toggle('Show monthly volume', key='toggle_monthly_volume'):
+        monthly = period_volume(daily, 'ME')[['activities', 'distance', 'moving_time', 'elevation', 'load']]
+        monthly = monthly.assign(distance=monthly['distance'] / 1000, moving_time=monthly['moving_time'] / 3600)
+        st.dataframe(monthly.rename(columns={'distance': 'distance (km)', 'moving_time': 'moving time (h)',
+                                             'elevation': 'elevation (m)'}).iloc[::-1].round(1))
+
+def display_summary_statistics(club_id: int, start_date, end_date):
     st.subheader("Summary Statistics")
-    st.write(filtered_df.groupby('sport_type').agg({
-        'distance': ['sum', 'mean'],
-        'moving_time': ['sum', 'mean'],
-        'avg_speed': 'mean',
-        'name': 'count'
-    }).reset_index())
-
-def display_palmares(filtered_df: pd.DataFrame):
-    st.subheader("Halls of Fame")
+    sport_totals = (Query('rollup').where(club_id=club_id, start=start_date, end=end_date).group_by('sport_type')
+                    .agg(**{measure: (measure, 'sum') for measure in ['activity_count', 'distance_sum', 'moving_time_sum',
+                                                                     'speed_sum', 'speed_count']})
+                    .collect())
+    st.write(sport_summary(sport_totals))
 
-    sport_categories = {
-        "Running (Trail + Running)": ['Trail', 'Run'],
-        "Cycling (Gravel, Road, Mountain Bike, Virtual)": ['Gravel Ride', 'Ride', 'MountainBikeRide', 'VirtualRide'],
-        "Swimming": ['Swim']
-    }
+def display_palmares(club_name: str, k: int = 3):
+    st.subheader("Halls of Fame")
 
-    metrics = {
-        "Highest ascent": 'total_elevation_gain',
-        "Highest cumulative moving time": 'moving_time',
-        "Highest cumulative distance": 'distance',
-        "Highest average moving speed": 'avg_speed'
-    }
+    # Which leaderboards each section shows
+    sections = {category: ["Highest ascent", "Highest cumulative moving time", "Highest cumulative distance", "Highest average moving speed"]
+                for category in SPORT_CATEGORIES}
+    sections[ALL_ACTIVITIES] = ["Highest cumulative moving time", "Highest number of activities", "Highest average moving speed"]
 
-    for category, sports in sport_categories.items():
+    # Every (category x metric) leaderboard comes out of one grouped pass over the club's rollups
+    club_rollup = (Query('rollup').where(club_name=club_name)
+                   .select('sport_type', 'firstname', 'lastname', *LEADERBOARD_TOTALS).collect())
+    leaderboards = rank_leaderboards(leaderboard_totals(club_rollup), k=k)
+    for category, metric_names in sections.items():
         st.write(f"**{category}**")
-        for metric_name, metric in metrics.items():
-            result = get_palmares(filtered_df, sports, metric)
-            st.write(f"{metric_name}:", result)
-
-    st.write("**All Activities**")
-    st.write("Highest cumulative moving time:", get_palmares(filtered_df, filtered_df['sport_type'].unique(), 'moving_time'))
-    st.write("Highest number of activities:", filtered_df.groupby(['firstname', 'lastname'])['name'].count().nlargest(1).reset_index())
-    st.write("Highest average moving speed:", get_palmares(filtered_df, filtered_df['sport_type'].unique(), 'avg_speed'))
+        category_boards = leaderboards[leaderboards['category'] == category]
+        for metric_name in metric_names:
+            result = category_boards[category_boards['metric'] == metric_name][['rank', 'firstname', 'lastname', 'value']]
+            st.write(f"{metric_name}:", result.reset_index(drop=True))
 
 